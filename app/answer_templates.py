@@ -0,0 +1,138 @@
+"""
+Renders the final answer sentence from the fetched rows, without a second LLM call.
+The sentence is chosen by the question's intent (app.intents) and the shape of the result:
+- a single value (e.g. an average),
+- a list of cities (one column, or City plus the filtered value),
+- the single extreme row (hottest/coldest),
+- an empty result for a yes/no question.
+render_answer returns None when the shape is not recognized, so the caller can fall back to the LLM.
+Intent sentences are only used for rows fetched by the intent's own SQL.
+"""
+import os
+from decimal import Decimal
+from app.schema import get_schema_values
+from app.sql_normalizer import canonicalize_sql
+
+ANSWER_MODES = ("template", "llm")
+
+# Models whose answers are always phrased by the LLM, e.g. {"gpt-4o-mini": "llm"}
+model_answer_modes = {}
+
+
+def get_answer_mode(model_name: str, answer_mode: str = None) -> str:
+    """
+    Returns the requested mode, else the mode configured for the model, else ANSWER_MODE (default "template").
+    """
+    mode = answer_mode or model_answer_modes.get(model_name) or os.getenv("ANSWER_MODE", "template")
+    return mode if mode in ANSWER_MODES else "template"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, (float, Decimal)):
+        return f"{float(value):.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _join(items: list) -> str:
+    items = [str(item) for item in items]
+    if len(items) <= 1:
+        return "".join(items)
+    return ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def _degrees(value) -> str:
+    return f"{_format_value(value)}°C"
+
+
+def _describe(slots: dict) -> str:
+    # " with sunny weather", " with a tropical climate", " with sunny weather and a tropical climate"
+    parts = []
+    if slots.get("Weather"):
+        parts.append(f"{slots['Weather']} weather")
+    if slots.get("Climate"):
+        parts.append(f"a {slots['Climate']} climate")
+    return " with " + " and ".join(parts) if parts else ""
+
+
+def _is_city_list(rows: list, columns: list = None) -> bool:
+    """
+    True if the first column holds cities: by its name when the cursor reported one, else by its values.
+    """
+    if not all(len(row) >= 1 and isinstance(row[0], str) for row in rows):
+        return False
+    if columns:
+        return columns[0].lower() == "city"
+    cities = {city.lower() for city in get_schema_values()["City"]}
+    return all(row[0].lower() in cities for row in rows)
+
+
+def _render_intent(intent: dict, rows: list, columns: list) -> str:
+    name, slots = intent["intent"], intent["slots"]
+
+    if name == "weather_in_city":
+        if rows:
+            return f"Yes, it is {slots['Weather']} in {slots['City']}."
+        return f"No, it is not {slots['Weather']} in {slots['City']}."
+    if not rows:
+        return None
+
+    if name == "average_temperature" and len(rows) == 1 and len(rows[0]) == 1:
+        if rows[0][0] is None:
+            return None
+        scope = f" in {slots['City']}" if slots.get("City") else _describe(slots)
+        if scope.startswith(" with"):
+            scope = " in cities" + scope
+        return f"The average temperature{scope} is {_degrees(rows[0][0])}."
+
+    if name == "extreme_temperature" and len(rows) == 1 and len(rows[0]) == 2:
+        city, temperature = rows[0]
+        return f"The {slots['Extreme']} city{_describe(slots)} is {city} at {_degrees(temperature)}."
+
+    if name == "city_temperature" and len(rows[0]) == 2:
+        return _join([f"The temperature in {city} is {_degrees(temperature)}" for city, temperature in rows]) + "."
+
+    if name == "city_weather" and len(rows[0]) == 2:
+        return _join([f"The weather in {city} is {weather}" for city, weather in rows]) + "."
+
+    if not _is_city_list(rows, columns):
+        return None
+    cities = [row[0] for row in rows]
+
+    if name == "weather_cities":
+        return f"It is {slots['Weather']} in {_join(cities)}."
+
+    if name == "climate_cities":
+        verb = "has" if len(cities) == 1 else "have"
+        return f"{_join(cities)} {verb} a {slots['Climate']} climate."
+
+    if name == "temperature_cities" and all(len(row) == 2 for row in rows):
+        operator, degrees = slots["Temperature"]
+        if operator == "=":
+            return f"It is {_degrees(degrees)} in {_join(cities)}."
+        comparison = "above" if operator == ">" else "below"
+        listed = _join([f"{city} ({_degrees(temperature)})" for city, temperature in rows])
+        return f"Cities {comparison} {_degrees(degrees)}: {listed}."
+
+    return None
+
+
+def render_answer(rows: list, intent: dict = None, sql_query: str = None) -> str:
+    """
+    Returns the answer sentence for the rows, or None if neither the intent nor the result shape is recognized.
+    - `intent`: the match from app.intents.intent_matcher for the question, if any.
+    - `sql_query`: the query that fetched the rows; the intent's sentence is only used if it is the intent's SQL
+      (otherwise the rows answer a question the template does not describe).
+    """
+    columns = getattr(rows, "columns", None)
+    rows = [tuple(row) for row in rows]
+    if intent is not None and sql_query is not None and canonicalize_sql(sql_query) != canonicalize_sql(intent["sql"]):
+        intent = None
+    if intent is not None:
+        return _render_intent(intent, rows, columns)
+
+    # No intent: only shapes that read the same whatever the question was
+    if len(rows) == 1 and len(rows[0]) == 1 and rows[0][0] is not None:
+        return f"The result is {_format_value(rows[0][0])}."
+    if rows and all(len(row) == 1 for row in rows) and _is_city_list(rows, columns):
+        return f"{_join([row[0] for row in rows])}."
+    return None
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.batching import seq2seq_scheduler
+from app.clients import get_async_openai_client, ollama_send_async, close_http_client
+from app.spelling import normalize_question
+from app.intents import intent_matcher
+from app.timing import stage_timer
+from app.query_guard import CancelToken
+from app.racing import RACE_MODEL, get_race_models, validate_sql, race_async, race_outcome, no_winner_error
+from app import metrics
+from app.nlp import (
+    LOCAL_SEQ2SEQ_MODELS, seq2seq_generate_kwargs, get_db_type, correct_question, answer_num_ctx, ANSWER_NUM_PREDICT,
+    ollama_payload, intent_sql, start_model_sql, finish_model_sql, generation_error, is_generation_error, execute_sql,
+    summarize_results, settle_answer, race_validated
+)
+
+# The stages themselves are app.nlp's; only the model calls, database work and LanguageTool differ here.
+# Blocking stages run on bounded executors so the event loop never waits on them:
+# - DB work gets as many threads as the connection pool has connections.
+# - CPU-bound work (LanguageTool, intent matching, prompt building, SQL normalization and validation, the
+#   SQL cache's file appends, answer templates) gets a small fixed pool; local HuggingFace models run on
+#   the micro-batching scheduler's own worker threads (app.batching).
+db_executor = ThreadPoolExecutor(max_workers=int(os.getenv("DB_POOL_SIZE", "5")), thread_name_prefix="nl2sql-db")
+cpu_executor = ThreadPoolExecutor(max_workers=int(os.getenv("ASYNC_CPU_WORKERS", "4")), thread_name_prefix="nl2sql-cpu")
+
+async def run_blocking(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+
+
+async def ollama_generate(model_name: str, prompt: str, temperature: float, num_ctx: int, num_predict: int) -> str:
+    response = await ollama_send_async("/api/generate", ollama_payload(model_name, prompt, temperature, num_ctx, num_predict))
+    response.raise_for_status()
+    return response.json()["response"]
+
+
+async def ollama_generate_stream(model_name: str, prompt: str, temperature: float, num_ctx: int, num_predict: int):
+    """
+    Yields the response of an Ollama generation piece by piece (stream=True, NDJSON lines).
+    """
+    response = await ollama_send_async(
+        "/api/generate", ollama_payload(model_name, prompt, temperature, num_ctx, num_predict, stream=True), stream=True)
+    try:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                break
+    finally:
+        await response.aclose()
+
+
+async def openai_chat_stream(model_name: str, api_key: str, prompt: str, temperature: float):
+    stream = await get_async_openai_client(api_key).chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def openai_chat(model_name: str, api_key: str, prompt: str, temperature: float) -> str:
+    response = await get_async_openai_client(api_key).chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature
+    )
+    return response.choices[0].message.content.strip()
+
+
+async def intent_sql_async(corrected_question: str, db_type: str, timings: dict = None) -> str:
+    """
+    Async counterpart of app.nlp.intent_sql; the first call reads the schema values for the intent
+    patterns from the database (unless the warmup already did).
+    """
+    if intent_matcher.enabled and not intent_matcher.loaded:
+        await run_blocking(db_executor, lambda: intent_matcher.patterns)
+    return await run_blocking(cpu_executor, intent_sql, corrected_question, db_type, timings)
+
+
+async def generate_sql_async(question: str, model_name: str, api_key: str = None, prompt_template: str = None,
+                             temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, db_type: str = None,
+                             timings: dict = None) -> tuple:
+    """
+    Async counterpart of app.nlp.generate_sql with the same return value and error strings.
+    - `timings`: optional dict that receives seconds spent in "correction", "intent", "generation", "normalization" and "validation".
+    """
+    if db_type is None:
+        db_type = await run_blocking(db_executor, get_db_type)
+    with stage_timer(timings, "correction"):
+        corrected_question = await run_blocking(cpu_executor, correct_question, question)
+    sql_query = await intent_sql_async(corrected_question, db_type, timings)
+    if sql_query is not None:
+        return corrected_question, sql_query
+    return corrected_question, await model_generate_sql_async(corrected_question, model_name, api_key, prompt_template,
+                                                              temperature, num_ctx, num_predict, db_type, timings)
+
+
+async def model_generate_sql_async(corrected_question: str, model_name: str, api_key: str = None,
+                                   prompt_template: str = None, temperature: float = 0.1, num_ctx: int = 2048,
+                                   num_predict: int = 256, db_type: str = None, timings: dict = None) -> str:
+    """
+    Async counterpart of app.nlp.model_generate_sql.
+    """
+    if db_type is None:
+        db_type = await run_blocking(db_executor, get_db_type)
+    try:
+        with stage_timer(timings, "generation"):
+            prompt, num_ctx, cache_key, cached_sql = await run_blocking(
+                cpu_executor, start_model_sql, corrected_question, model_name, prompt_template, temperature, num_ctx,
+                num_predict, db_type)
+            if cached_sql is not None:
+                return cached_sql
+
+            if model_name in LOCAL_SEQ2SEQ_MODELS:
+                # Awaits the micro-batch future instead of holding a CPU worker thread
+                answer = await asyncio.wrap_future(
+                    seq2seq_scheduler.submit(model_name, prompt, **seq2seq_generate_kwargs[model_name]))
+                answer = answer.strip()
+            elif "gpt" in model_name.lower():
+                answer = await openai_chat(model_name, api_key, prompt, temperature)
+            else:
+                answer = await ollama_generate(model_name, prompt, temperature, num_ctx, num_predict)
+
+        return await run_blocking(cpu_executor, finish_model_sql, answer, model_name, cache_key, db_type, timings)
+
+    except Exception as e:
+        return generation_error(e)
+
+
+async def race_generate_sql_async(question: str, api_key: str = None, models: list = None, prompt_template: str = None,
+                                  temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256,
+                                  db_type: str = None, timings: dict = None, race_details: dict = None) -> tuple:
+    """
+    Async counterpart of app.nlp.race_generate_sql; the losing models' requests are cancelled.
+    """
+    if db_type is None:
+        db_type = await run_blocking(db_executor, get_db_type)
+    models = get_race_models(api_key) if models is None else models
+    race_details = {} if race_details is None else race_details
+    race_details.update({"winner": None, "attempts": []})
+    with stage_timer(timings, "correction"):
+        corrected_question = await run_blocking(cpu_executor, correct_question, question)
+    if not models:
+        return corrected_question, no_winner_error([]), None
+    sql_query = await intent_sql_async(corrected_question, db_type, timings)
+    if sql_query is not None:
+        return corrected_question, sql_query, models[0]
+
+    async def candidate(model):
+        sql = await model_generate_sql_async(corrected_question, model, api_key, prompt_template, temperature, num_ctx,
+                                             num_predict, db_type)
+        return sql, await run_blocking(db_executor, validate_sql, sql, db_type)
+
+    with stage_timer(timings, "generation"):
+        winner, sql_query, attempts = await race_async(models, candidate)
+    sql_query, winner = race_outcome(winner, sql_query, attempts, race_details)
+    return corrected_question, sql_query, winner
+
+
+async def generate_candidate_sql_async(question: str, model_name: str, api_key: str, details: dict, **generate_kwargs) -> tuple:
+    """
+    Returns (corrected_question, sql, model) from generate_sql_async, or from the race when `model_name`
+    is "race" (the winning model then phrases the answer; its race details go to details["race"]).
+    """
+    if model_name == RACE_MODEL:
+        return await race_generate_sql_async(question, api_key, race_details=details.setdefault("race", {}),
+                                             **generate_kwargs)
+    corrected_question, sql_query = await generate_sql_async(question, model_name, api_key, **generate_kwargs)
+    return corrected_question, sql_query, model_name
+
+
+async def execute_sql_async(sql_query: str, validated: bool = False) -> tuple:
+    cancel = CancelToken()
+    try:
+        return await run_blocking(db_executor, execute_sql, sql_query, cancel=cancel, validated=validated)
+    except asyncio.CancelledError:
+        # The request was abandoned (e.g. the client disconnected): stop the query instead of
+        # letting it hold a pooled connection until it finishes
+        cancel.cancel()
+        raise
+
+
+async def answer_question_async(question: str, model_name: str, api_key: str, prompt_template: str = None,
+                                temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256,
+                                final_prompt: str = None, answer_temperature: float = 0.5, answer_mode: str = None,
+                                details: dict = None) -> tuple:
+    """
+    Async counterpart of app.nlp.answer_question; returns the same
+    (sql, result_summary, final_answer, corrected_question, has_error) tuple.
+    - `model_name`: a model, or "race" to use the first valid SQL of the RACE_MODELS (app.racing).
+    - `details`: optional dict that receives the fetched "rows", whether they were "truncated"
+      (see app.results), per-stage "timings" (seconds) and, in race mode, the "race" winner and attempts.
+    Stage timings, errors and in-flight requests are also recorded in app.metrics.
+    """
+    if details is None:
+        details = {}
+    timings = details.setdefault("timings", {})
+    details.setdefault("rows", [])
+    details.setdefault("truncated", False)
+    with metrics.track_request(model_name, "async", timings):
+        result = await _answer_question_async(question, model_name, api_key, prompt_template, temperature, num_ctx,
+                                              num_predict, final_prompt, answer_temperature, answer_mode, details)
+    sql_query, _, final_answer, _, has_error = result
+    metrics.record_result(model_name, sql_query, final_answer, has_error)
+    return result
+
+
+async def _answer_question_async(question, model_name, api_key, prompt_template, temperature, num_ctx, num_predict,
+                                 final_prompt, answer_temperature, answer_mode, details) -> tuple:
+    timings = details["timings"]
+    db_type = await run_blocking(db_executor, get_db_type)
+    corrected_question, sql_query, model_name = await generate_candidate_sql_async(
+        question, model_name, api_key, details,
+        prompt_template=prompt_template,
+        temperature=temperature,
+        num_ctx=num_ctx,
+        num_predict=num_predict,
+        db_type=db_type,
+        timings=timings
+    )
+
+    if is_generation_error(sql_query):
+        return sql_query, sql_query, sql_query, corrected_question, True
+    with stage_timer(timings, "execution"):
+        results, has_error = await execute_sql_async(sql_query, validated=race_validated(details))
+    if not has_error:
+        details["rows"] = [list(row) for row in results]
+        details["truncated"] = results.truncated
+
+    result_summary = summarize_results(results, has_error)
+    try:
+        result, final_response, answer_prompt = await run_blocking(
+            cpu_executor, settle_answer, corrected_question, sql_query, results, has_error, result_summary, model_name,
+            db_type, answer_mode, final_prompt, timings)
+        if answer_prompt is None:
+            return sql_query, result, final_response, corrected_question, has_error
+
+        with stage_timer(timings, "answer"):
+            if "gpt" in model_name.lower():
+                final_response = await openai_chat(model_name, api_key, answer_prompt, answer_temperature)
+            else:
+                final_response = (await ollama_generate(model_name, answer_prompt, answer_temperature,
+                                                        num_ctx=answer_num_ctx(model_name, answer_prompt), num_predict=ANSWER_NUM_PREDICT)).strip()
+
+        return sql_query, result_summary, final_response, corrected_question, has_error
+
+    except Exception as e:
+        return sql_query, result_summary, f"Error: {e}", corrected_question, True
+
+
+async def answer_questions_batch_async(questions: list, model_name: str, api_key: str, parallelism: int = None, **kwargs) -> list:
+    """
+    Answers many questions concurrently (at most `parallelism` at a time).
+    Identical questions are answered once; results are returned in input order as dicts with
+    question, corrected_question, sql, rows, result, answer, has_error and per-stage timings.
+    """
+    if parallelism is None:
+        parallelism = int(os.getenv("BATCH_PARALLELISM", "8"))
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def answer_one(question: str) -> dict:
+        async with semaphore:
+            details = {}
+            start = time.perf_counter()
+            try:
+                sql, result, answer, corrected_question, has_error = await answer_question_async(
+                    question, model_name, api_key, details=details, **kwargs)
+            except Exception as e:
+                sql, result, answer, corrected_question, has_error = None, None, f"Error: {e}", question, True
+            details.setdefault("timings", {})["total"] = time.perf_counter() - start
+            return {
+                "question": question,
+                "corrected_question": corrected_question,
+                "sql": sql,
+                "rows": details.get("rows", []),
+                "truncated": details.get("truncated", False),
+                "result": result,
+                "answer": answer,
+                "has_error": bool(has_error),
+                "timings": details["timings"],
+            }
+
+    unique = {}
+    for question in questions:
+        key = normalize_question(question)
+        if key not in unique:
+            unique[key] = asyncio.ensure_future(answer_one(question))
+
+    answers = {key: await task for key, task in unique.items()}
+    return [{**answers[normalize_question(question)], "question": question} for question in questions]
+
+
+async def stream_answer_events(question: str, model_name: str, api_key: str, prompt_template: str = None,
+                               temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256,
+                               final_prompt: str = None, answer_temperature: float = 0.5, answer_mode: str = None):
+    """
+    Runs the pipeline and yields (event, data) pairs as soon as each stage finishes:
+    - ("question", corrected question)
+    - ("race", {"winner": ..., "attempts": [...]}), only for model "race"
+    - ("sql", generated SQL)
+    - ("result", {"summary": ..., "has_error": ..., "truncated": ...})
+    - ("token", piece of the final answer), repeated
+    - ("done", {"answer": ..., "has_error": ...})
+    """
+    timings = {}
+    sql_query = None
+    with metrics.track_request(model_name, "stream", timings):
+        async for event, data in _stream_answer_events(question, model_name, api_key, prompt_template, temperature, num_ctx,
+                                                       num_predict, final_prompt, answer_temperature, answer_mode, timings):
+            if event == "sql":
+                sql_query = data
+            elif event == "done":
+                metrics.record_result(model_name, sql_query, data["answer"], data["has_error"])
+            yield event, data
+
+
+async def _stream_answer_events(question, model_name, api_key, prompt_template, temperature, num_ctx, num_predict,
+                                final_prompt, answer_temperature, answer_mode, timings):
+    db_type = await run_blocking(db_executor, get_db_type)
+    details = {}
+    corrected_question, sql_query, model_name = await generate_candidate_sql_async(
+        question, model_name, api_key, details,
+        prompt_template=prompt_template,
+        temperature=temperature,
+        num_ctx=num_ctx,
+        num_predict=num_predict,
+        db_type=db_type,
+        timings=timings
+    )
+    yield "question", corrected_question
+    if "race" in details:
+        yield "race", details["race"]
+    yield "sql", sql_query
+
+    if is_generation_error(sql_query):
+        yield "done", {"answer": sql_query, "has_error": True}
+        return
+
+    with stage_timer(timings, "execution"):
+        results, has_error = await execute_sql_async(sql_query, validated=race_validated(details))
+    result_summary = summarize_results(results, has_error)
+    yield "result", {"summary": result_summary, "has_error": has_error,
+                     "truncated": bool(getattr(results, "truncated", False))}
+
+    try:
+        _, answer, answer_prompt = await run_blocking(
+            cpu_executor, settle_answer, corrected_question, sql_query, results, has_error, result_summary, model_name,
+            db_type, answer_mode, final_prompt, timings)
+    except Exception as e:
+        yield "done", {"answer": f"Error: {e}", "has_error": True}
+        return
+    if answer_prompt is None:
+        if not has_error:
+            yield "token", answer
+        yield "done", {"answer": answer, "has_error": has_error}
+        return
+
+    if "gpt" in model_name.lower():
+        pieces = openai_chat_stream(model_name, api_key, answer_prompt, answer_temperature)
+    else:
+        pieces = ollama_generate_stream(model_name, answer_prompt, answer_temperature,
+                                        num_ctx=answer_num_ctx(model_name, answer_prompt), num_predict=ANSWER_NUM_PREDICT)
+
+    answer = []
+    try:
+        # Includes the time the client takes to read the tokens
+        with stage_timer(timings, "answer"):
+            async for piece in pieces:
+                answer.append(piece)
+                yield "token", piece
+    except Exception as e:
+        yield "done", {"answer": f"Error: {e}", "has_error": True}
+        return
+    yield "done", {"answer": "".join(answer).strip(), "has_error": False}
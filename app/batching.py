@@ -0,0 +1,103 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.model_registry import model_registry
+
+
+class BatchScheduler:
+    """
+    Micro-batching scheduler for the local seq2seq models.
+    - Prompts submitted concurrently for the same model (and generate kwargs) are collected
+      for up to `max_wait_ms` into batches of at most `max_batch_size`.
+    - Each batch is one padded `generate_batch_fn(model_name, prompts, **kwargs)` call, run on
+      one worker thread per model; the outputs are routed back through futures.
+    """
+
+    def __init__(self, generate_batch_fn=None, max_batch_size: int = None, max_wait_ms: float = None):
+        self.generate_batch_fn = generate_batch_fn or model_registry.generate_batch
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv("SEQ2SEQ_MAX_BATCH_SIZE", "8"))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("SEQ2SEQ_MAX_WAIT_MS", "20"))
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queues = {}  # (model_name, kwargs) -> queue of (prompt, future)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+
+    @staticmethod
+    def _key(model_name: str, generate_kwargs: dict) -> tuple:
+        # Only prompts with identical generation settings can share a generate() call
+        return model_name, tuple(sorted(generate_kwargs.items()))
+
+    def submit(self, model_name: str, prompt: str, **generate_kwargs) -> Future:
+        """
+        Queues a prompt and returns a Future with its decoded output.
+        """
+        key = self._key(model_name, generate_kwargs)
+        future = Future()
+        with self._lock:
+            pending = self._queues.get(key)
+            if pending is None:
+                pending = self._queues[key] = queue.Queue()
+                worker = threading.Thread(target=self._worker, args=(key, pending),
+                                          name=f"seq2seq-batch-{model_name}", daemon=True)
+                worker.start()
+        pending.put((prompt, future))
+        return future
+
+    def generate(self, model_name: str, prompt: str, **generate_kwargs) -> str:
+        """
+        Blocking drop-in for ModelRegistry.generate that goes through the batch queue.
+        """
+        return self.submit(model_name, prompt, **generate_kwargs).result()
+
+    def _collect(self, pending: queue.Queue) -> list:
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, key: tuple, pending: queue.Queue):
+        model_name, kwargs = key
+        while True:
+            batch = [(prompt, future) for prompt, future in self._collect(pending)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self.generate_batch_fn(model_name, [prompt for prompt, _ in batch], **dict(kwargs))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "largest_batch": self.largest_batch,
+            "average_batch": self.requests / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+
+seq2seq_scheduler = BatchScheduler()
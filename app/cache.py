@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with hit/miss counters.
+    - `ttl` (seconds) makes entries expire; None keeps them until evicted.
+    - `on_evict(key, value)` is called (outside the lock) for values evicted or replaced by put().
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] is not None and entry[1] <= time.time():
+                del self._data[key]
+                self.expirations += 1
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, expires_at: float = None):
+        if self.maxsize <= 0:
+            return
+        if expires_at is None and self.ttl:
+            expires_at = time.time() + self.ttl
+        evicted = []
+        with self._lock:
+            previous = self._data.get(key, _MISSING)
+            if previous is not _MISSING and previous[0] is not value:
+                evicted.append((key, previous))
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        if self.on_evict is not None:
+            for evicted_key, (evicted_value, _) in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class PersistentLRUCache(LRUCache):
+    """
+    LRUCache backed by an append-only JSON-lines file, so entries survive restarts.
+    - Keys must be JSON-serializable (tuples are stored as lists and restored as tuples).
+    - The file is rewritten with only the live entries once it grows past 2x maxsize lines.
+    """
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: float = None):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        self._file_lock = threading.Lock()
+        self._lines = 0
+        self._load()
+
+    @staticmethod
+    def _restore_key(key):
+        return tuple(key) if isinstance(key, list) else key
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self._lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written line from a crash
+                if record["expires_at"] is not None and record["expires_at"] <= now:
+                    continue
+                LRUCache.put(self, self._restore_key(record["key"]), record["value"], record["expires_at"])
+
+    def put(self, key, value, expires_at: float = None):
+        if expires_at is None and self.ttl:
+            expires_at = time.time() + self.ttl
+        super().put(key, value, expires_at)
+        if self.maxsize <= 0:
+            return
+        record = json.dumps({"key": key, "value": value, "expires_at": expires_at})
+        with self._file_lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(record + "\n")
+            self._lines += 1
+            if self._lines > 2 * self.maxsize:
+                self._compact()
+
+    def _compact(self):
+        # Must be called with self._file_lock held
+        with self._lock:
+            entries = list(self._data.items())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, (value, expires_at) in entries:
+                f.write(json.dumps({"key": key, "value": value, "expires_at": expires_at}) + "\n")
+        os.replace(tmp_path, self.path)
+        self._lines = len(entries)
+
+    def clear(self):
+        super().clear()
+        with self._file_lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._lines = 0
+
+
+class VersionedCache:
+    """
+    LRU cache that is cleared whenever the watched data changes.
+    - `version_fn()` returns the current data version (e.g. row count + checksum); it is
+      called at most once per `check_interval` seconds, so hits usually cost no round trip.
+    - version_fn runs outside the lock and in one thread at a time; meanwhile the others keep
+      using the last version instead of waiting for the round trip.
+    - While the version cannot be read (version_fn returns None or raises) the cache is bypassed.
+    - Every clear bumps `generation`; read it after a miss and pass it to put(), so rows fetched before
+      a clear are dropped instead of being stored again.
+    """
+
+    def __init__(self, version_fn, maxsize: int = 256, check_interval: float = 5.0):
+        self.version_fn = version_fn
+        self.check_interval = check_interval
+        self.cache = LRUCache(maxsize=maxsize)
+        self._version = None
+        self._checked_at = float("-inf")
+        self._checking = False
+        self._generation = 0  # Bumped whenever the cache is cleared
+        self._lock = threading.Lock()
+        self.invalidations = 0
+
+    def current_version(self):
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_interval or self._checking:
+                return self._version  # Fresh enough, or another thread is reading it right now
+            self._checking = True
+            generation = self._generation
+        # Read without the lock: a slow round trip must not block the lookups of other threads
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            print(f"Could not read data version: {e}")
+            version = None
+        with self._lock:
+            self._checking = False
+            if generation != self._generation:
+                return self._version  # invalidate() ran meanwhile; this version may predate it
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._generation += 1
+                self.cache.clear()
+            self._version = version
+            self._checked_at = time.monotonic()
+            return version
+
+    def get(self, key, default=None):
+        if self.current_version() is None:
+            return default
+        return self.cache.get(key, default)
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, key, value, generation: int = None):
+        """
+        Stores the value, unless the cache was cleared since `generation` was read.
+        """
+        if self.current_version() is None:
+            return
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self.cache.put(key, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._version = None
+            self._checked_at = float("-inf")
+            self.cache.clear()
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "invalidations": self.invalidations, "version": self._version}
@@ -0,0 +1,208 @@
+"""
+Shared HTTP and OpenAI clients for the model backends.
+- Ollama: one keep-alive requests.Session (sync) and one httpx.AsyncClient (async), each with a
+  connection pool of LLM_POOL_SIZE, so calls reuse TCP (and TLS) connections.
+- OpenAI: one OpenAI / AsyncOpenAI client per API key (and event loop; LRU, OPENAI_CLIENT_CACHE_SIZE), reusing its
+  connection pool; evicted clients are closed.
+- Every call has a connect timeout (LLM_CONNECT_TIMEOUT) and a read timeout (LLM_READ_TIMEOUT).
+- Transient failures (connection errors, connect timeouts, HTTP 429/502/503/504) are retried up to LLM_MAX_RETRIES
+  times with exponential backoff and jitter (LLM_RETRY_BACKOFF); the OpenAI SDK applies the same
+  policy through its own max_retries.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+import weakref
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from app.cache import LRUCache
+
+RETRY_STATUSES = {429, 502, 503, 504}
+MAX_RETRY_DELAY = 10.0
+
+# Failures before the model started working; a read timeout is not retried, it already took LLM_READ_TIMEOUT
+_TRANSIENT_REQUESTS_ERRORS = (requests.ConnectionError,)
+_TRANSIENT_HTTPX_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def get_ollama_base_url() -> str:
+    return os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+
+
+def connect_timeout() -> float:
+    return float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+
+
+def read_timeout() -> float:
+    return float(os.getenv("LLM_READ_TIMEOUT", "300"))
+
+
+def max_retries() -> int:
+    return int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Seconds to wait before retry number `attempt` (0-based): exponential backoff with +-50% jitter,
+    so clients that failed together do not retry together.
+    """
+    base = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+    return min(MAX_RETRY_DELAY, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+def _pool_size() -> int:
+    return int(os.getenv("LLM_POOL_SIZE", "16"))
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_ollama_session() -> requests.Session:
+    """
+    Returns the shared keep-alive session for sync Ollama calls.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # Retries are done by ollama_post, with jitter
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size(), max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def ollama_post(path: str, payload: dict) -> dict:
+    """
+    POSTs to the Ollama API (e.g. "/api/generate") and returns the JSON response.
+    """
+    url = f"{get_ollama_base_url()}{path}"
+    retries = max_retries()
+    for attempt in range(retries + 1):
+        try:
+            response = get_ollama_session().post(url, json=payload, timeout=(connect_timeout(), read_timeout()))
+        except _TRANSIENT_REQUESTS_ERRORS as e:
+            if attempt == retries:
+                raise
+            print(f"Ollama request failed ({e.__class__.__name__}), retrying")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                response.raise_for_status()
+                return response.json()
+            print(f"Ollama returned HTTP {response.status_code}, retrying")
+        time.sleep(retry_delay(attempt))
+
+
+_http_client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared async HTTP client used for Ollama calls.
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout(), connect=connect_timeout()),
+            limits=httpx.Limits(max_connections=_pool_size(), max_keepalive_connections=_pool_size()),
+        )
+    return _http_client
+
+
+async def ollama_send_async(path: str, payload: dict, stream: bool = False) -> httpx.Response:
+    """
+    Sends a POST to the Ollama API with retries and returns the response; with `stream=True` the body
+    is not read yet and the caller must close the response (retries only happen before it is returned).
+    """
+    client = get_http_client()
+    url = f"{get_ollama_base_url()}{path}"
+    retries = max_retries()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.send(client.build_request("POST", url, json=payload), stream=stream)
+        except _TRANSIENT_HTTPX_ERRORS as e:
+            if attempt == retries:
+                raise
+            print(f"Ollama request failed ({e.__class__.__name__}), retrying")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            await response.aclose()
+            print(f"Ollama returned HTTP {response.status_code}, retrying")
+        await asyncio.sleep(retry_delay(attempt))
+
+
+def _close_openai_client(key: tuple, client):
+    """
+    Closes an OpenAI client evicted from the cache; an async one is closed on its own loop, if that still runs.
+    """
+    try:
+        if key[0] == "sync":
+            client.close()
+            return
+        loop = key[2]()
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(lambda: loop.create_task(client.close()))
+    except Exception as e:
+        print(f"Could not close an evicted OpenAI client: {e}")
+
+
+_openai_clients = LRUCache(maxsize=int(os.getenv("OPENAI_CLIENT_CACHE_SIZE", "32")), on_evict=_close_openai_client)
+
+
+def _key_hash(api_key: str) -> str:
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _openai_options() -> dict:
+    return {"timeout": httpx.Timeout(read_timeout(), connect=connect_timeout()), "max_retries": max_retries()}
+
+
+def get_openai_client(api_key: str):
+    """
+    Returns the OpenAI client for an API key, created once and reused.
+    """
+    from openai import OpenAI
+    key = ("sync", _key_hash(api_key))
+    client = _openai_clients.get(key)
+    if client is None:
+        client = OpenAI(api_key=api_key, **_openai_options())
+        _openai_clients.put(key, client)
+    return client
+
+
+def get_async_openai_client(api_key: str):
+    """
+    Returns the AsyncOpenAI client for an API key on the running event loop, created once and reused.
+    """
+    from openai import AsyncOpenAI
+    # Async clients hold connections bound to the loop they were used on. A weak reference never matches
+    # a new loop (unlike id(), which a new loop can reuse) and does not keep a finished loop alive
+    key = ("async", _key_hash(api_key), weakref.ref(asyncio.get_running_loop()))
+    client = _openai_clients.get(key)
+    if client is None:
+        client = AsyncOpenAI(api_key=api_key, **_openai_options())
+        _openai_clients.put(key, client)
+    return client
+
+
+async def close_http_client():
+    """
+    Closes the async Ollama client and the async OpenAI clients of the running loop.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _openai_clients.keys() if key[0] == "async" and key[2]() is loop]:
+        client = _openai_clients.pop(key)
+        if client is not None:
+            await client.close()
@@ -1,16 +1,449 @@
 import os
-import pyodbc
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from app.schema import WEATHER_TABLE, WEATHER_COLUMNS, TEXT_COLUMNS, load_seed_rows
+from app.sql_normalizer import to_sqlite
 
-def get_db_connection():
-    load_dotenv()  # Load environment variables from .env file
+load_dotenv()  # Load environment variables from .env file once, at import time
+
+
+def get_connection_string() -> str:
     server = os.getenv("DB_SERVER", "localhost")
     database = os.getenv("DB_NAME", "WeatherDB")
     username = os.getenv("DB_USER", "sa")
     password = os.getenv("DB_PASSWORD", "your_password_here")  # Replace with your actual password
     driver = "{ODBC Driver 17 for SQL Server}"
 
-    connection_string = f'DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}'
-    conn = pyodbc.connect(connection_string)
+    return f'DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}'
+
+
+def get_db_connection(autocommit: bool = False):
+    """
+    Opens a brand-new connection. Prefer get_pool().connection() on the request path.
+    """
+    import pyodbc  # Only needed for SQL Server, so DB_BACKEND=sqlite runs without the ODBC driver
+    conn = pyodbc.connect(get_connection_string(), autocommit=autocommit)
     return conn
- 
+
+
+_connect_listeners = []
+
+
+def add_connect_listener(listener):
+    """
+    Registers a callable invoked with every new connection the pool opens
+    (e.g. to re-detect the SQL dialect if the backend changed).
+    """
+    _connect_listeners.append(listener)
+
+
+def _notify_connect(conn):
+    for listener in _connect_listeners:
+        try:
+            listener(conn)
+        except Exception as e:
+            print(f"Connect listener failed: {e}")
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the checkout timeout."""
+
+
+class PoolClosedError(Exception):
+    """Raised when a connection is requested from a pool that was closed (or replaced by set_pool)."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of database connections.
+    - At most `max_size` connections are open at once; checkout waits up to `checkout_timeout` seconds.
+    - Connections idle for longer than `max_idle_seconds` are closed instead of reused.
+    - Connections idle for longer than `health_check_seconds` (or flagged after an error) are pinged before reuse.
+    - After close_all(), connections still checked out are closed when they are released.
+    """
+
+    def __init__(self, connect=None, max_size: int = None, max_idle_seconds: float = None,
+                 checkout_timeout: float = None, health_check_seconds: float = None):
+        self._connect = connect or (lambda: get_db_connection(autocommit=True))
+        self.max_size = max_size or int(os.getenv("DB_POOL_SIZE", "5"))
+        self.max_idle_seconds = max_idle_seconds if max_idle_seconds is not None else float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+        self.checkout_timeout = checkout_timeout if checkout_timeout is not None else float(os.getenv("DB_POOL_TIMEOUT", "10"))
+        self.health_check_seconds = health_check_seconds if health_check_seconds is not None else float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", "30"))
+
+        self._idle = deque()  # (conn, last_used, needs_check); most recently used on the right
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {"created": 0, "recycled": 0, "discarded": 0, "checkouts": 0, "timeouts": 0}
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, timeout: float = None):
+        """
+        Checks out a connection, opening a new one only while the pool is below max_size.
+        """
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            candidate = None
+            with self._cond:
+                while not self._closed and not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(f"No database connection available after {timeout:.1f}s")
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    raise PoolClosedError("The connection pool is closed")
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if candidate is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                    self._stats["checkouts"] += 1
+                _notify_connect(conn)
+                return conn
+
+            conn, last_used, needs_check = candidate
+            idle_for = time.monotonic() - last_used
+            if self.max_idle_seconds > 0 and idle_for > self.max_idle_seconds:
+                self._close_quietly(conn)
+                self._forget(stat="recycled")
+                continue
+            if (needs_check or idle_for > self.health_check_seconds) and not self._is_healthy(conn):
+                self._close_quietly(conn)
+                self._forget(stat="discarded")
+                continue
+
+            with self._cond:
+                self._stats["checkouts"] += 1
+            return conn
+
+    def release(self, conn, check: bool = False):
+        """
+        Returns a connection to the pool. `check=True` forces a health check before its next reuse.
+        """
+        with self._cond:
+            if not self._closed:
+                self._idle.append((conn, time.monotonic(), check))
+                self._cond.notify()
+                return
+        self._close_quietly(conn)
+        self._forget()
+
+    def discard(self, conn):
+        self._close_quietly(conn)
+        self._forget(stat="discarded")
+
+    def _forget(self, stat: str = None):
+        with self._cond:
+            self._size -= 1
+            if stat:
+                self._stats[stat] += 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, check=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        """
+        Closes the idle connections and the pool; checked-out connections are closed as they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+
+DB_BACKENDS = ("sqlserver", "replica", "sqlite")
+
+
+def get_db_backend() -> str:
+    """
+    Returns where read queries execute, from DB_BACKEND:
+    - 'sqlserver' (default): on SQL Server, over pyodbc.
+    - 'replica': on an in-memory SQLite copy of the Weather table, loaded from SQL Server and kept in sync.
+    - 'sqlite': on an in-memory SQLite copy seeded from init_db.sql; no SQL Server needed.
+    """
+    backend = os.getenv("DB_BACKEND", "sqlserver").strip().lower()
+    return backend if backend in DB_BACKENDS else "sqlserver"
+
+
+class ReplicaCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return super().execute(to_sqlite(sql), parameters)
+
+
+class ReplicaConnection(sqlite3.Connection):
+    """
+    Read-only SQLite connection over a private copy of the replica, re-copied when the replica was refreshed.
+    """
+    replica = None
+    version = None
+
+    def cursor(self, factory=ReplicaCursor):
+        if self.version is None or self.version != self.replica.version:
+            self.replica.copy_to(self)
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+
+class SQLiteReplica:
+    """
+    In-memory SQLite copy of a table, for executing read queries in-process.
+    - `source`: opens a connection to the primary SQL Server database; None seeds the copy from init_db.sql.
+    - refresh() reloads the copy when the primary's table version changed; start() does that every
+      `refresh_seconds` (DB_REPLICA_REFRESH_SECONDS) in a background thread.
+    - connect() returns a read-only connection; SQL Server syntax (TOP n, LEN, ...) is translated on execute.
+    Every connection holds its own copy (a page-level backup of the latest snapshot), so a refresh
+    never blocks or changes the data under a running query.
+    """
+
+    def __init__(self, source=None, table: str = WEATHER_TABLE, refresh_seconds: float = None):
+        self.source = source
+        self.table = table
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(os.getenv("DB_REPLICA_REFRESH_SECONDS", "60"))
+        self.version = None        # Version of the primary the snapshot was loaded from
+        self._snapshot = None      # sqlite3 connection holding the latest copy; replaced, never modified
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"loads": 0, "checks": 0, "failures": 0, "rows": 0, "loaded_at": None}
+
+    def load(self, rows: list, version=None):
+        """
+        Replaces the snapshot with `rows` of (City, Temperature, Weather, Climate).
+        """
+        # NOCASE matches SQL Server's default case-insensitive collation
+        columns = ", ".join(
+            f"{column} TEXT COLLATE NOCASE" if column in TEXT_COLUMNS else f"{column} INTEGER"
+            for column in WEATHER_COLUMNS
+        )
+        snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+        snapshot.execute(f"CREATE TABLE {self.table} ({columns})")
+        snapshot.executemany(f"INSERT INTO {self.table} VALUES ({', '.join('?' * len(WEATHER_COLUMNS))})",
+                             [tuple(row) for row in rows])
+        snapshot.commit()
+        with self._lock:
+            old, self._snapshot = self._snapshot, snapshot
+            self.version = version if version is not None else ("init_db.sql", time.time())
+            self._stats["loads"] += 1
+            self._stats["rows"] = len(rows)
+            self._stats["loaded_at"] = time.time()
+        if old is not None:
+            old.close()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reloads the snapshot if the primary's data changed (or `force`). Returns True if it was reloaded.
+        Without a primary, or while it is unreachable, the first call seeds the snapshot from init_db.sql.
+        """
+        if self.source is None:
+            if self._snapshot is None or force:
+                self.load(load_seed_rows())
+                return True
+            return False
+
+        with self._lock:
+            self._stats["checks"] += 1
+        try:
+            conn = self.source()
+            try:
+                version = get_table_version(conn, self.table, "sqlserver")
+                if version == self.version and not force:
+                    return False
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT {', '.join(WEATHER_COLUMNS)} FROM {self.table}")
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+        except Exception as e:
+            with self._lock:
+                self._stats["failures"] += 1
+            print(f"Could not refresh the {self.table} replica from the primary database: {e}")
+            if self._snapshot is None:
+                print(f"Seeding the {self.table} replica from init_db.sql")
+                self.load(load_seed_rows())
+                return True
+            return False
+
+        self.load(rows, version=version)
+        print(f"Loaded {len(rows)} rows into the {self.table} replica")
+        return True
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+    def start(self):
+        """
+        Loads the snapshot and, with a primary and refresh_seconds > 0, keeps it in sync in the background.
+        """
+        self.refresh()
+        if self.source is not None and self.refresh_seconds > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="replica-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def copy_to(self, conn: ReplicaConnection):
+        if self._snapshot is None:
+            self.refresh()
+        with self._lock:
+            self._snapshot.backup(conn)
+            conn.version = self.version
+
+    def connect(self) -> ReplicaConnection:
+        conn = sqlite3.connect(":memory:", factory=ReplicaConnection, check_same_thread=False)
+        conn.replica = self
+        conn.execute("PRAGMA query_only = ON")  # Copying the snapshot in still works; queries cannot write
+        return conn
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "version": self.version, "source": "primary" if self.source else "init_db.sql"}
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def get_replica() -> SQLiteReplica:
+    """
+    Returns the process-wide replica for DB_BACKEND=replica/sqlite, loaded (and syncing) on first use.
+    """
+    global _replica
+    if _replica is None:
+        with _replica_lock:
+            if _replica is None:
+                source = (lambda: get_db_connection(autocommit=True)) if get_db_backend() == "replica" else None
+                _replica = SQLiteReplica(source=source).start()
+    return _replica
+
+
+def _default_connect():
+    if get_db_backend() == "sqlserver":
+        return None
+    return get_replica().connect
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect=_default_connect())
+    return _pool
+
+
+def set_pool(pool: ConnectionPool):
+    """
+    Replaces the process-wide pool (e.g. with one over a local stand-in database); the old one is closed.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool is not pool:
+            _pool.close_all()
+        _pool = pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+def get_table_version(conn, table: str = "Weather", db_type: str = "sqlserver"):
+    """
+    Returns a cheap fingerprint of a table's data that changes whenever rows are inserted, deleted or updated:
+    - SQL Server: row count + checksum,
+    - the SQLite replica: the version of the snapshot it holds (the replica's data only changes on a load),
+    - other SQLite databases: a change counter kept by triggers on the table (installed on first use).
+    """
+    if db_type == "sqlserver":
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM {table}")
+        row = cursor.fetchone()
+        cursor.close()
+        return (int(row[0]), row[1])
+
+    if isinstance(conn, ReplicaConnection):
+        return conn.replica.version
+    return _sqlite_change_counter(conn, table)
+
+
+def _sqlite_change_counter(conn, table: str) -> int:
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute("SELECT version FROM table_versions WHERE name = ?", (table,))
+            row = cursor.fetchone()
+        except sqlite3.OperationalError:
+            row = None  # No table_versions table yet
+        if row is not None:
+            return row[0]
+        cursor.execute("CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        cursor.execute("INSERT OR IGNORE INTO table_versions VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table} "
+                           f"BEGIN UPDATE table_versions SET version = version + 1 WHERE name = '{table}'; END")
+        conn.commit()
+        return 0
+    finally:
+        cursor.close()
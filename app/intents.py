@@ -0,0 +1,254 @@
+"""
+Rule-based intent matcher for the common question shapes (see tests/questions.py):
+- "Where is it the hottest/coldest?"                  -> extreme_temperature
+- "What is the temperature in Warsaw?"                -> city_temperature
+- "What is the weather in Tokyo?"                     -> city_weather
+- "Is it cloudy in Chicago?"                          -> weather_in_city
+- "Which cities have tropical climate?"               -> climate_cities
+- "Where is it raining?" / "Where is the sky clear?"  -> weather_cities
+- "Where is it 20 degrees?" / "... above 25 degrees"  -> temperature_cities
+- "What is the average temperature in sunny cities?"  -> average_temperature
+
+Matched questions get their SQL straight from a template, so no model is called.
+Values are taken from the schema (app.schema.get_schema_values), never from free text.
+A template only answers exactly its shape: questions with a negation or exclusion ("not", "apart from"),
+a range ("between"), an ordinal or count ("second", "3 hottest"), more than one value ("cloudy or rainy",
+"Warsaw and Berlin"), a place that is not a known city ("in Europe") or a temperature in Fahrenheit or
+Kelvin are left to the model.
+"""
+import os
+import re
+import threading
+from app.schema import WEATHER_TABLE, get_schema_values
+from app.sql_normalizer import normalize_sql
+
+# Question words -> stored Weather values (in addition to the values themselves)
+WEATHER_SYNONYMS = {
+    "rain": "rainy",
+    "raining": "rainy",
+    "drizzling": "drizzle",
+    "drizzly": "drizzle",
+    "sky clear": "clear",
+    "clear sky": "clear",
+    "clear skies": "clear",
+    "stormy": "thunderstorms",
+    "thunderstorm": "thunderstorms",
+    "storming": "thunderstorms",
+    "showers": "scattered showers",
+    "smog": "smoggy",
+    "wind": "windy",
+    "sun": "sunny",
+}
+
+COMPARATORS = {
+    "above": ">", "over": ">", "more than": ">", "higher than": ">", "greater than": ">",
+    "warmer than": ">", "hotter than": ">",
+    "below": "<", "under": "<", "less than": "<", "lower than": "<", "colder than": "<",
+    "cooler than": "<",
+}
+
+_HOT = re.compile(r"\b(hottest|warmest|highest temperature)\b")
+_COLD = re.compile(r"\b(coldest|coolest|lowest temperature)\b")
+_AVERAGE = re.compile(r"\b(average|mean|avg)\b")
+_DEGREES = re.compile(r"(?:\b(" + "|".join(COMPARATORS) + r")\s+)?(-?\d+)\s*(?:degrees?|°c?|celsius)\b")
+_ASKS_WHERE = re.compile(r"^(where|which cit(y|ies)|what cit(y|ies)|in which cit(y|ies)|list (the )?cities)\b")
+_ASKS_IF = re.compile(r"^(is|was|does|will) (it|the weather|the sky)\b")
+_CITY_TEMPERATURE = re.compile(r"^(what is|what's|tell me|show me|how (hot|warm|cold) is it)\b.*\b(temperature )?(in|of|for)\s")
+_CITY_WEATHER = re.compile(r"^(what is|what's|how is|tell me|show me)\b.*\bweather (like )?(in|of|for)\s")
+# A capitalized place name ending the question, e.g. "in Fort Worth?"
+_PLACE_NAME = re.compile(r"\bin\s+((?:[A-Z][\w'.-]*)(?:\s+(?:[A-Z][\w'.-]*|de|del|da|do|la|le|upon|on))*)\s*[?.!]*\s*$")
+# Shapes no template can express: negation/exclusion, ranges, ordinals and counts, several values
+_UNSUPPORTED = re.compile(
+    r"\b(not|no|never|neither|nor|except|excluding|apart from|aside from|other than|besides|without|"
+    r"between|top|first|second|third|fourth|fifth|last|two|three|four|five|six|seven|eight|nine|ten|"
+    r"\d+(st|nd|rd|th)|and|or|versus|vs)\b|n't\b")
+# Temperatures in other units than the stored Celsius, e.g. "20 degrees Fahrenheit", "68°F"
+_OTHER_UNITS = re.compile(r"\b(fahrenheit|kelvin)\b|°\s*[fk]\b|\d\s*[fk]\b")
+_NUMBER = re.compile(r"-?\d+")
+_PUNCTUATION = re.compile(r"[?!.,;:]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _value_pattern(phrases) -> re.Pattern:
+    # Longest phrases first, so "tropical savanna" wins over "tropical"
+    alternatives = sorted({phrase.lower() for phrase in phrases}, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(phrase) for phrase in alternatives) + r")\b")
+
+
+class IntentMatcher:
+    """
+    Recognizes common question templates and emits their SQL without calling a model.
+    - `match(question, db_type)` returns {"intent", "sql", "slots"} or None on a miss.
+    - Disabled with INTENT_MATCHING=0; `stats()` reports the hit rate per intent.
+    """
+
+    def __init__(self, schema_values: dict = None, enabled: bool = None):
+        if enabled is None:
+            enabled = os.getenv("INTENT_MATCHING", "1") != "0"
+        self.enabled = enabled
+        self._schema_values = schema_values
+        self._patterns = None
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = {}
+
+    def _build_patterns(self):
+        values = self._schema_values or get_schema_values()
+        cities = {city.lower(): city for city in values["City"]}
+        weathers = {weather.lower(): weather for weather in values["Weather"]}
+        for word, weather in WEATHER_SYNONYMS.items():
+            if weather in weathers.values():
+                weathers.setdefault(word, weather)
+        climates = {climate.lower(): climate for climate in values["Climate"]}
+        return {
+            "City": (_value_pattern(cities), cities),
+            "Weather": (_value_pattern(weathers), weathers),
+            "Climate": (_value_pattern(climates), climates),
+        }
+
+    @property
+    def loaded(self) -> bool:
+        return self._patterns is not None
+
+    @property
+    def patterns(self) -> dict:
+        if self._patterns is None:
+            with self._lock:
+                if self._patterns is None:
+                    self._patterns = self._build_patterns()
+        return self._patterns
+
+    def _find_all(self, column: str, text: str) -> list:
+        pattern, values = self.patterns[column]
+        found = []
+        for match in pattern.finditer(text):
+            if values[match.group(1)] not in found:
+                found.append(values[match.group(1)])
+        return found
+
+    def _slots(self, question: str, text: str) -> dict:
+        """
+        Returns the slots, or None if the question names more than one value of a column,
+        a place that is not a known city, or more than one number.
+        """
+        cities, climates, weathers = (self._find_all(column, text) for column in ("City", "Climate", "Weather"))
+        # "humid" is part of the "humid subtropical" climate
+        weathers = [weather for weather in weathers if not any(weather.lower() in climate.lower() for climate in climates)]
+        if len(cities) > 1 or len(climates) > 1 or len(weathers) > 1:
+            return None
+        place = _PLACE_NAME.search(question.strip())
+        if place and place.group(1).lower() not in self.patterns["City"][1]:
+            return None  # "hottest city in Europe": a place the templates cannot filter on
+        slots = {"City": cities[0] if cities else None, "Climate": climates[0] if climates else None,
+                 "Weather": weathers[0] if weathers else None}
+        if _OTHER_UNITS.search(text):
+            return None  # Temperature is stored in Celsius; the model can convert
+        degrees = list(_DEGREES.finditer(text))
+        if len(_NUMBER.findall(text)) > len(degrees[:1]):
+            return None  # "the 3 hottest cities", "above 20 and below 30 degrees"
+        if degrees:
+            slots["Temperature"] = (COMPARATORS.get(degrees[0].group(1), "="), int(degrees[0].group(2)))
+        return slots
+
+    @staticmethod
+    def _filters(slots: dict, columns: tuple) -> list:
+        filters = []
+        if "City" in columns and slots.get("City"):
+            filters.append(f"City = {_quote(slots['City'])}")
+        if "Weather" in columns and slots.get("Weather"):
+            filters.append(f"Weather = {_quote(slots['Weather'])}")
+        if "Climate" in columns and slots.get("Climate"):
+            # "tropical climate" covers "tropical savanna" and "tropical monsoon", not "subtropical"
+            climate = slots["Climate"]
+            filters.append(f"(Climate = {_quote(climate)} OR Climate LIKE {_quote(climate + ' %')})")
+        return filters
+
+    @staticmethod
+    def _where(filters: list) -> str:
+        return " WHERE " + " AND ".join(filters) if filters else ""
+
+    def _classify(self, question: str) -> tuple:
+        text = _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", question.lower().replace("’", "'"))).strip()
+        text = text.replace("what's", "what is").replace("where's", "where is")
+        if _UNSUPPORTED.search(text):
+            return None
+        slots = self._slots(question, text)
+        if slots is None:
+            return None
+        where = self._where(self._filters(slots, ("City", "Weather", "Climate")))
+
+        if _AVERAGE.search(text) and "temperature" in text:
+            return "average_temperature", slots, \
+                f"SELECT ROUND(AVG(CAST(Temperature AS FLOAT)), 2) AS AverageTemperature FROM {WEATHER_TABLE}{where}"
+
+        hot, cold = _HOT.search(text), _COLD.search(text)
+        if (hot or cold) and not (hot and cold) and not slots.get("Temperature"):
+            order = "DESC" if hot else "ASC"
+            slots["Extreme"] = "hottest" if hot else "coldest"
+            return "extreme_temperature", slots, \
+                f"SELECT TOP 1 City, Temperature FROM {WEATHER_TABLE}{where} ORDER BY Temperature {order}"
+
+        if slots.get("Temperature") and _ASKS_WHERE.match(text):
+            operator, degrees = slots["Temperature"]
+            filters = [f"Temperature {operator} {degrees}"] + self._filters(slots, ("Weather", "Climate"))
+            return "temperature_cities", slots, f"SELECT City, Temperature FROM {WEATHER_TABLE}{self._where(filters)}"
+
+        if _ASKS_IF.match(text) and slots["City"] and slots["Weather"] and not slots["Climate"]:
+            return "weather_in_city", slots, \
+                f"SELECT City, Weather FROM {WEATHER_TABLE}{self._where(self._filters(slots, ('City', 'Weather')))}"
+
+        if slots["City"] and not slots["Weather"] and not slots["Climate"]:
+            if "temperature" in text and _CITY_TEMPERATURE.match(text) or re.match(r"^how (hot|warm|cold) is it in\b", text):
+                return "city_temperature", slots, f"SELECT City, Temperature FROM {WEATHER_TABLE}{where}"
+            if _CITY_WEATHER.match(text):
+                return "city_weather", slots, f"SELECT City, Weather FROM {WEATHER_TABLE}{where}"
+            return None
+
+        if not _ASKS_WHERE.match(text) or slots["City"]:
+            return None
+        if slots["Climate"] and not slots["Weather"]:
+            return "climate_cities", slots, f"SELECT City FROM {WEATHER_TABLE}{where}"
+        if slots["Weather"] and not slots["Climate"]:
+            return "weather_cities", slots, f"SELECT City, Weather FROM {WEATHER_TABLE}{where}"
+        return None
+
+    def match(self, question: str, db_type: str = None, record: bool = True) -> dict:
+        """
+        Returns {"intent": name, "sql": query in the given dialect, "slots": extracted values},
+        or None if the question does not fit a known template.
+        - `record=False` leaves the hit-rate counters alone (for looking the intent up again later).
+        """
+        if not self.enabled:
+            return None
+        try:
+            matched = self._classify(question)
+        except Exception as e:
+            print(f"Intent matching failed: {e}")
+            matched = None
+        if record:
+            with self._lock:
+                self.lookups += 1
+                if matched is not None:
+                    self.hits[matched[0]] = self.hits.get(matched[0], 0) + 1
+        if matched is None:
+            return None
+        name, slots, sql = matched
+        # Templates are written for SQL Server (TOP n); normalize_sql rewrites them for SQLite
+        return {"intent": name, "sql": normalize_sql(sql, db_type=db_type, extract=False), "slots": slots}
+
+    def stats(self) -> dict:
+        hits = sum(self.hits.values())
+        return {
+            "enabled": self.enabled,
+            "lookups": self.lookups,
+            "hits": hits,
+            "hit_rate": hits / self.lookups if self.lookups else 0.0,
+            "intents": dict(self.hits),
+        }
+
+
+intent_matcher = IntentMatcher()
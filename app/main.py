@@ -1,30 +1,75 @@
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi.responses import HTMLResponse, StreamingResponse, Response, JSONResponse
 from fastapi.templating import Jinja2Templates
-from app.database import get_db_connection
-from app.models import Question as QuestionModel
-from app.nlp import answer_question
+from app.database import close_pool
+from app.intents import intent_matcher
+from app import metrics, warmup
+from app.models import Question as QuestionModel, BatchQuestionRequest, BatchResponse
+from app.async_pipeline import answer_question_async, answer_questions_batch_async, close_http_client, stream_answer_events
 from fastapi.staticfiles import StaticFiles
+import json
+import os
 
+warmup.record_import(time.perf_counter() - _import_started)
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
+MISSING_API_KEY_MESSAGE = "API key is required for GPT-based models."
+INVALID_API_KEY_MESSAGE = "Your OpenAI API key is invalid. Please double-check and try again."
+INSUFFICIENT_QUOTA_MESSAGE = "You have exceeded your OpenAI API quota. Please check your billing settings or upgrade your plan."
+
+@app.on_event("startup")
+async def startup():
+    warmup.start_warmup()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
+    close_pool()
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Stage latency histograms, error counters, cache hit ratios and in-flight requests in Prometheus text format.
+    """
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness per component (LanguageTool, database, caches, Ollama and HF models); 503 until the warmup is done.
+    """
+    status = warmup.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats/intents")
+async def intent_stats():
+    """
+    Share of questions answered by the intent templates instead of a model.
+    """
+    return intent_matcher.stats()
+
 @app.post("/ask")
 async def ask_question(request: Request,
                        question: str = Form(...),
                        model: str = Form(...),
-                       api_key: str = Form("")):
+                       api_key: str = Form(""),
+                       answer_mode: str = Form(None)):
     try:
         if "gpt" in model.lower() and not api_key.strip():
             return templates.TemplateResponse("index.html", {
                 "request": request,
-                "error": "API key is required for GPT-based models.",
+                "error": MISSING_API_KEY_MESSAGE,
                 "model": model,
                 "question": question,
                 "api_key": api_key,
@@ -33,14 +78,15 @@ async def ask_question(request: Request,
             })
         
         question_model = QuestionModel(question=question, model=model, api_key=api_key)
-        sql, result_summary, final_answer, corrected_question, has_error = answer_question(question, model, api_key)
+        details = {}
+        sql, result_summary, final_answer, corrected_question, has_error = await answer_question_async(question, model, api_key, answer_mode=answer_mode, details=details)
         has_error = bool(has_error)
 
         # if invalid api key, return error message
         if isinstance(sql, str) and "invalid_api_key" in sql.lower():
             return templates.TemplateResponse("index.html", {
                 "request": request,
-                "error": "Your OpenAI API key is invalid. Please double-check and try again.",
+                "error": INVALID_API_KEY_MESSAGE,
                 "model": model,
                 "question": question,
                 "api_key": api_key,
@@ -54,7 +100,7 @@ async def ask_question(request: Request,
         elif isinstance(sql, str) and "insufficient_quota" in sql.lower():
             return templates.TemplateResponse("index.html", {
                     "request": request,
-                    "error": "You have exceeded your OpenAI API quota. Please check your billing settings or upgrade your plan.",
+                    "error": INSUFFICIENT_QUOTA_MESSAGE,
                     "model": model,
                     "question": question,
                     "api_key": api_key,
@@ -70,6 +116,7 @@ async def ask_question(request: Request,
             "request": request,
             "sql": sql,
             "result": result_summary,
+            "truncated": details.get("truncated", False),
             "answer": final_answer,
             "model": model,
             "question": question,
@@ -90,6 +137,64 @@ async def ask_question(request: Request,
             "is_gpt_and_missing_key": False
         })
 
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_question_stream(question: str = Form(...),
+                              model: str = Form(...),
+                              api_key: str = Form(""),
+                              answer_mode: str = Form(None)):
+    """
+    Server-sent events version of /ask: emits `question`, `sql`, `result`, then the
+    answer as `token` events, and finally `done` (or `error`).
+    """
+    async def events():
+        if "gpt" in model.lower() and not api_key.strip():
+            yield sse_event("error", {"message": MISSING_API_KEY_MESSAGE})
+            return
+        try:
+            async for event, data in stream_answer_events(question, model, api_key, answer_mode=answer_mode):
+                if event == "sql" and isinstance(data, str) and "invalid_api_key" in data.lower():
+                    yield sse_event("error", {"message": INVALID_API_KEY_MESSAGE})
+                    return
+                if event == "sql" and isinstance(data, str) and "insufficient_quota" in data.lower():
+                    yield sse_event("error", {"message": INSUFFICIENT_QUOTA_MESSAGE})
+                    return
+                yield sse_event(event, data)
+        except Exception as e:
+            yield sse_event("error", {"message": f"Something went wrong: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/ask/batch", response_model=BatchResponse)
+async def ask_batch(batch: BatchQuestionRequest):
+    """
+    Answers a list of questions with one model, concurrently, returning structured results in input order.
+    """
+    max_questions = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+    if len(batch.questions) > max_questions:
+        raise HTTPException(status_code=413, detail=f"At most {max_questions} questions per batch.")
+    if "gpt" in batch.model.lower() and not batch.api_key.strip():
+        raise HTTPException(status_code=400, detail=MISSING_API_KEY_MESSAGE)
+
+    parallelism = batch.parallelism
+    if parallelism is not None:
+        parallelism = min(parallelism, int(os.getenv("BATCH_MAX_PARALLELISM", "32")))
+
+    start = time.perf_counter()
+    results = await answer_questions_batch_async(
+        batch.questions, batch.model, batch.api_key,
+        parallelism=parallelism,
+        temperature=batch.temperature,
+        answer_temperature=batch.answer_temperature,
+        num_ctx=batch.num_ctx,
+        num_predict=batch.num_predict,
+        answer_mode=batch.answer_mode
+    )
+    return {"results": results, "elapsed": time.perf_counter() - start}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
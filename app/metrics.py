@@ -0,0 +1,125 @@
+"""
+Prometheus metrics for the question-answering pipeline, served by GET /metrics.
+- nl2sql_stage_seconds{model, stage}: histogram of the per-stage timings (see app.timing.stage_timer)
+- nl2sql_requests_total{model, path}: answered questions
+- nl2sql_errors_total{model, type}: failed questions by error type (invalid_api_key, insufficient_quota, ...)
+- nl2sql_in_flight_requests{path}: questions currently being answered
+- nl2sql_query_guard_total{reason}: queries rejected (read_only, cost) or stopped (timeout, cancelled) by app.query_guard
+- nl2sql_sql_validation_total{result}: generated queries found valid or invalid by app.sql_validator
+- nl2sql_race_wins_total{model}: races (model "race", see app.racing) won by each model
+- nl2sql_startup_seconds{phase}: app import time, total warmup time and each warmed component (see app.warmup)
+- nl2sql_cache_*{cache}: size, hits, misses, evictions and hit ratio of the registered caches, read at scrape time
+"""
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+stage_seconds = Histogram("nl2sql_stage_seconds", "Time spent per pipeline stage", ["model", "stage"], buckets=STAGE_BUCKETS)
+requests_total = Counter("nl2sql_requests_total", "Questions answered", ["model", "path"])
+errors_total = Counter("nl2sql_errors_total", "Questions that ended in an error, by type", ["model", "type"])
+in_flight = Gauge("nl2sql_in_flight_requests", "Questions currently being answered", ["path"])
+query_guard_total = Counter("nl2sql_query_guard", "Queries rejected or stopped by the query guard", ["reason"])
+sql_validation_total = Counter("nl2sql_sql_validation", "Generated queries checked by the SQL validator", ["result"])
+race_wins_total = Counter("nl2sql_race_wins", "Races won, by model", ["model"])
+startup_seconds = Gauge("nl2sql_startup_seconds", "Seconds spent importing the app and warming up its components", ["phase"])
+
+# Model names come from user input; anything not listed here is reported as "other"
+known_models = set()
+
+_caches = {}  # name -> function returning LRUCache-style stats
+
+
+def model_label(model_name: str) -> str:
+    return model_name if model_name in known_models else "other"
+
+
+def register_cache(name: str, stats_fn):
+    """
+    Exposes a cache's stats() (size, hits, misses, evictions, hit_ratio) under cache=`name`.
+    """
+    _caches[name] = stats_fn
+
+
+class _CacheCollector:
+    def collect(self):
+        families = {
+            "size": GaugeMetricFamily("nl2sql_cache_size", "Entries in the cache", labels=["cache"]),
+            "hit_ratio": GaugeMetricFamily("nl2sql_cache_hit_ratio", "Hits / lookups since start", labels=["cache"]),
+            "hits": CounterMetricFamily("nl2sql_cache_hits", "Cache hits", labels=["cache"]),
+            "misses": CounterMetricFamily("nl2sql_cache_misses", "Cache misses", labels=["cache"]),
+            "evictions": CounterMetricFamily("nl2sql_cache_evictions", "Entries evicted to stay within the size limit", labels=["cache"]),
+        }
+        for name, stats_fn in list(_caches.items()):
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"Could not read stats of cache {name}: {e}")
+                continue
+            for key, family in families.items():
+                if stats.get(key) is not None:
+                    family.add_metric([name], float(stats[key]))
+        return list(families.values())
+
+
+REGISTRY.register(_CacheCollector())
+
+
+def classify_error(sql_query, final_answer, has_error: bool) -> str:
+    """
+    Returns the error type of an answer_question result, or None if it succeeded.
+    """
+    if not has_error:
+        return None
+    text = f"{sql_query or ''} {final_answer or ''}".lower()
+    if "invalid_api_key" in text or "incorrect api key" in text:
+        return "invalid_api_key"
+    if "insufficient_quota" in text:
+        return "insufficient_quota"
+    if not sql_query:
+        return "no_sql"
+    if sql_query.startswith("-- Error: invalid SQL"):
+        return "invalid_sql"
+    if sql_query.startswith(("-- Error", "Error generating SQL")):
+        return "generation"
+    if "error connecting to database" in text:
+        return "db_connection"
+    if "error executing sql" in text:
+        return "sql_execution"
+    return "answer"
+
+
+@contextmanager
+def track_request(model_name: str, path: str, timings: dict):
+    """
+    Counts the request as in flight while the block runs, then observes every stage in `timings`
+    plus the "total" wall time.
+    """
+    gauge = in_flight.labels(path)
+    gauge.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        gauge.dec()
+        model = model_label(model_name)
+        for stage, seconds in timings.items():
+            if stage != "total":
+                stage_seconds.labels(model, stage).observe(seconds)
+        stage_seconds.labels(model, "total").observe(time.perf_counter() - start)
+        requests_total.labels(model, path).inc()
+
+
+def record_result(model_name: str, sql_query, final_answer, has_error: bool):
+    error_type = classify_error(sql_query, final_answer, has_error)
+    if error_type is not None:
+        errors_total.labels(model_label(model_name), error_type).inc()
+
+
+def render_latest() -> tuple:
+    """
+    Returns (body, content type) of the Prometheus text exposition.
+    """
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of HuggingFace seq2seq models (tokenizer + model).
+    - Loads each model once and keeps it resident in eval mode.
+    - Evicts least-recently-used models when the memory budget is exceeded.
+    - Records load/evict timings for every model.
+    """
+
+    def __init__(self, memory_budget_mb: float = None):
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.getenv("HF_MODEL_MEMORY_BUDGET_MB", "4096"))
+        # 0 or a negative budget means "never evict"
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self._models = OrderedDict()  # model_name -> (tokenizer, model, size_bytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._stats = {}
+
+    def _load_lock(self, model_name: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(model_name, threading.Lock())
+
+    def _stats_for(self, model_name: str) -> dict:
+        return self._stats.setdefault(model_name, {
+            "loads": 0,
+            "evictions": 0,
+            "last_load_seconds": None,
+            "total_load_seconds": 0.0,
+            "last_evict_seconds": None,
+            "size_bytes": None,
+            "last_used": None,
+        })
+
+    @staticmethod
+    def _model_size(model) -> int:
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+        size += sum(b.numel() * b.element_size() for b in model.buffers())
+        return size
+
+    def get(self, model_name: str) -> tuple:
+        """
+        Returns (tokenizer, model) for the given name, loading it on first use.
+        """
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+                self._stats_for(model_name)["last_used"] = time.time()
+                tokenizer, model, _ = self._models[model_name]
+                return tokenizer, model
+
+        # Only one thread loads a given model; others wait for it here
+        with self._load_lock(model_name):
+            with self._lock:
+                if model_name in self._models:
+                    self._models.move_to_end(model_name)
+                    tokenizer, model, _ = self._models[model_name]
+                    return tokenizer, model
+
+            tokenizer, model, size, elapsed = self._load(model_name)
+
+            with self._lock:
+                self._models[model_name] = (tokenizer, model, size)
+                stats = self._stats_for(model_name)
+                stats["loads"] += 1
+                stats["last_load_seconds"] = elapsed
+                stats["total_load_seconds"] += elapsed
+                stats["size_bytes"] = size
+                stats["last_used"] = time.time()
+                self._evict_over_budget(keep=model_name)
+
+            print(f"Loaded model {model_name} in {elapsed:.2f}s ({size / 1024 / 1024:.0f} MB)")
+            return tokenizer, model
+
+    def _load(self, model_name: str) -> tuple:
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+        import torch
+
+        start = time.perf_counter()
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(device)
+        model.eval()
+        elapsed = time.perf_counter() - start
+        return tokenizer, model, self._model_size(model), elapsed
+
+    def _evict_over_budget(self, keep: str = None):
+        # Must be called with self._lock held
+        if self.memory_budget_bytes <= 0:
+            return
+        while self.resident_bytes() > self.memory_budget_bytes:
+            victim = next((name for name in self._models if name != keep), None)
+            if victim is None:
+                print(f"Model {keep} alone exceeds the memory budget; keeping it resident")
+                return
+            self._evict_locked(victim)
+
+    def _evict_locked(self, model_name: str):
+        start = time.perf_counter()
+        _, model, _ = self._models.pop(model_name)
+        del model
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        elapsed = time.perf_counter() - start
+        stats = self._stats_for(model_name)
+        stats["evictions"] += 1
+        stats["last_evict_seconds"] = elapsed
+        print(f"Evicted model {model_name} in {elapsed:.3f}s")
+
+    def evict(self, model_name: str) -> bool:
+        with self._lock:
+            if model_name not in self._models:
+                return False
+            self._evict_locked(model_name)
+            return True
+
+    def resident_bytes(self) -> int:
+        return sum(size for _, _, size in self._models.values())
+
+    def is_loaded(self, model_name: str) -> bool:
+        return model_name in self._models
+
+    def stats(self) -> dict:
+        """
+        Returns load/evict timings per model plus the current memory usage.
+        """
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self.resident_bytes(),
+                "resident_models": list(self._models),
+                "models": {name: dict(stats) for name, stats in self._stats.items()},
+            }
+
+    def generate(self, model_name: str, prompt: str, **generate_kwargs) -> str:
+        """
+        Runs a single generation under torch.inference_mode and returns the decoded text.
+        """
+        import torch
+
+        tokenizer, model = self.get(model_name)
+        with torch.inference_mode():
+            inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+            outputs = model.generate(**inputs, **generate_kwargs)
+        return tokenizer.decode(outputs[0], skip_special_tokens=True)
+
+    def generate_batch(self, model_name: str, prompts: list, **generate_kwargs) -> list:
+        """
+        Runs one padded generation for several prompts and returns the decoded texts in prompt order.
+        """
+        import torch
+
+        tokenizer, model = self.get(model_name)
+        with torch.inference_mode():
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+            outputs = model.generate(**inputs, **generate_kwargs)
+        # generate returns num_return_sequences rows per prompt; keep the best one
+        per_prompt = outputs.shape[0] // len(prompts)
+        return tokenizer.batch_decode(outputs[::per_prompt], skip_special_tokens=True)
+
+
+model_registry = ModelRegistry()
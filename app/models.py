@@ -1,6 +1,36 @@
-from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
 
 class Question(BaseModel):
     question: str
     model: str # Model name (phi3:mini, llama3 or gpt 3.5/4o-mini)
-    api_key: str = " " # API key for OpenAI  
\ No newline at end of file
+    api_key: str = " " # API key for OpenAI
+
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    model: str
+    api_key: str = ""
+    temperature: float = 0.1 # SQL generation temperature
+    answer_temperature: float = 0.5
+    num_ctx: int = 2048
+    num_predict: int = 256
+    answer_mode: Optional[str] = None # "template" or "llm" (default: ANSWER_MODE / per-model setting)
+    parallelism: Optional[int] = Field(None, ge=1) # Max questions answered at once (default: BATCH_PARALLELISM)
+
+
+class BatchAnswer(BaseModel):
+    question: str
+    corrected_question: Optional[str] = None
+    sql: Optional[str] = None
+    rows: List[List[Any]] = []
+    truncated: bool = False  # The query returned more rows than RESULT_MAX_ROWS / RESULT_MAX_BYTES allow
+    result: Optional[str] = None
+    answer: Optional[str] = None
+    has_error: bool = False
+    timings: Dict[str, float] = {} # Seconds per stage (correction, generation, normalization, execution, answer, total)
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchAnswer]
+    elapsed: float
@@ -1,30 +1,101 @@
-from langchain.llms import Ollama
-import language_tool_python
-import requests
-import re
-from app.database import get_db_connection
+from app.database import get_pool, add_connect_listener, get_table_version
+from app.batching import seq2seq_scheduler
+from app.spelling import SpellingCorrector, normalize_question
+from app.cache import LRUCache, PersistentLRUCache, VersionedCache
+from app.intents import intent_matcher
+from app.answer_templates import get_answer_mode, render_answer
+from app.timing import stage_timer
+from app.results import ResultRows, fetch_rows, summarize_rows
+from app.query_guard import query_guard, QueryRejected
+from app.sql_validator import sql_validator
+from app.prompt_builder import prompt_builder
+from app.clients import get_ollama_base_url, get_openai_client, ollama_post
+from app.racing import RACE_MODEL, get_race_models, validate_sql, race, race_outcome, no_winner_error
+from app import metrics
+from app.schema import WEATHER_TABLE
+from app.sql_normalizer import canonicalize_sql, normalize_sql
 from tests.prompt_templates import prompt_templates_llms, prompt_templates_other
-import pyodbc
 import os
-from openai import AuthenticationError, RateLimitError, APIError
-from dotenv import load_dotenv
+import sys
+import hashlib
+import threading
 
-# Autocorrect
-autocorrect = language_tool_python.LanguageTool('en-US')
+_db_type = None
+_db_type_lock = threading.Lock()
 
-def get_db_type():
+
+def _dialect_from_driver(driver: str) -> str:
+    if "msodbcsql" in driver.lower():
+        return "sqlserver"
+    return "sqlite"
+
+
+def _dialect_of(conn) -> str:
+    # Connections without getinfo are the embedded SQLite replica (DB_BACKEND=replica/sqlite)
+    if not hasattr(conn, "getinfo"):
+        return "sqlite"
+    import pyodbc
+    return _dialect_from_driver(conn.getinfo(pyodbc.SQL_DRIVER_NAME))
+
+
+def detect_db_type():
+    """
+    Detects the SQL dialect from the driver of a pooled connection.
+    Returns None if the database cannot be reached.
+    """
     try:
-        conn = get_db_connection()
-        driver = conn.getinfo(pyodbc.SQL_DRIVER_NAME)  
-        conn.close()
-        print(f"Detected driver: {driver}")
-        if "msodbcsql" in driver.lower():
-            return "sqlserver"
+        with get_pool().connection() as conn:
+            dialect = _dialect_of(conn)
+        print(f"Detected dialect: {dialect}")
+        return dialect
     except Exception as e:
         print(f"Could not detect driver: {e}")
-    return "sqlite"
+    return None
+
+
+def get_db_type():
+    """
+    Returns the SQL dialect ('sqlserver' or 'sqlite'), resolved once and cached.
+    - SQL_DIALECT in the environment overrides detection.
+    - A failed detection falls back to 'sqlite' without caching, so the next call retries.
+    """
+    global _db_type
+    if _db_type is not None:
+        return _db_type
+
+    override = os.getenv("SQL_DIALECT", "").strip().lower()
+    if override:
+        _db_type = override
+        return _db_type
+
+    with _db_type_lock:
+        if _db_type is None:
+            _db_type = detect_db_type()
+    return _db_type or "sqlite"
+
+
+def reset_db_type():
+    """
+    Forgets the cached dialect so the next get_db_type() call detects it again.
+    """
+    global _db_type
+    _db_type = None
 
 
+def _redetect_on_connect(conn):
+    # Called by the pool for every new connection: if it points at a different
+    # backend than the cached one, switch dialects without an extra round trip.
+    global _db_type
+    if os.getenv("SQL_DIALECT", "").strip():
+        return
+    dialect = _dialect_of(conn)
+    if _db_type is not None and dialect != _db_type:
+        print(f"Database backend changed: {_db_type} -> {dialect}")
+    _db_type = dialect
+
+
+add_connect_listener(_redetect_on_connect)
+
 
 model_prompt_styles = {
     "phi3:mini": "few_shot",
@@ -39,315 +110,556 @@ model_prompt_styles = {
 def quote_values_after_equals(sql: str) -> str:
     """
     Finds values after '=' (or LIKE, <>, !=) and wraps them in single quotes if not already quoted or numeric.
+    Delegates to the single-pass normalizer (which also canonicalizes table/column names).
     """
-    def replacer(match):
-        operator = match.group(1)
-        value = match.group(2).strip()
-        # Ignore if already quoted or numeric
-        if value.startswith("'") or value.startswith('"') or re.match(r'^\d+(\.\d+)?$', value):
-            return f"{operator} {value}"
-        return f"{operator} '{value}'"
+    return normalize_sql(sql, extract=False)
 
-    # Match expressions like "= value", "!= value", "<> value", "LIKE value"
-    pattern = re.compile(r'(=|!=|<>|LIKE)\s+([a-zA-Z_][a-zA-Z0-9_]*)', flags=re.IGNORECASE)
-    return pattern.sub(replacer, sql)
-
-def extract_sql_from_response(response_text, db_type: str = "sqlserver", model_name: str = None) -> str:
+def extract_sql_from_response(response_text, db_type: str = None, model_name: str = None) -> str:
     """
     Extracts SQL from response starting at 'SELECT', applies normalization:
     - Replaces generic or lowercase column/table names with correct ones.
-    - Ensures basic consistency for evaluation.
+    - Quotes bare values and converts LIMIT/TOP for the current dialect.
+    - Repairs the typical mistakes of the local seq2seq models.
     """
-    # Find the first occurrence of 'select' (case-insensitive)
-    match = re.search(r'select\s.+', response_text, re.IGNORECASE)
-    if not match:
-        return None
+    if db_type is None:
+        db_type = get_db_type()
+    return normalize_sql(response_text, db_type=db_type, repair=model_name in LOCAL_SEQ2SEQ_MODELS)
 
-    sql = match.group().strip().rstrip(';')
+def repair_sql_query(sql: str) -> str:
+    """
+    Cleans and repairs common issues in SQL queries generated by models.
+    - Replaces invalid names.
+    - Fixes broken expressions like 'sky clear' → 'Weather = 'clear''
+    - Fixes AVG and other function calls.
+    - Normalizes table and column names.
+    """
+    if not sql:
+        return sql
+    return normalize_sql(sql, repair=True, extract=False)
 
-    # Normalize table name
-    sql = re.sub(r'\bfrom\s+table\b', 'FROM Weather', sql, flags=re.IGNORECASE)
-    sql = re.sub(r'\bfrom\s+weather\b', 'FROM Weather', sql, flags=re.IGNORECASE)
 
-    # Normalize columns
-    replacements = {
-        'location': 'City',
-        'weather': 'Weather',
-        'climate': 'Climate',
-        'temperature': 'Temperature',
-        'city': 'City',
-        'rain': "rainy"
-    }
+LOCAL_SEQ2SEQ_MODELS = ["tscholak/1zha5ono", "juierror/text-to-sql-with-table-schema"]
 
-    for old, new in replacements.items():
-        # Replace only column names (not part of strings or function calls)
-        sql = re.sub(rf'\b{old}\b', new, sql, flags=re.IGNORECASE)
+# Generation settings for the local HuggingFace models
+seq2seq_generate_kwargs = {
+    "juierror/text-to-sql-with-table-schema": {"num_beams": 10, "max_length": 700},
+    "tscholak/1zha5ono": {"max_new_tokens": 128},
+}
 
-   # add FROM Weather if not present and if the query is a SELECT statement
-    if not re.search(r'\bfrom\b', sql, re.IGNORECASE):
-            if re.search(r'\bselect\b.+\b(city|temperature|weather|climate)\b', sql, re.IGNORECASE):
-                sql += " FROM Weather"
+# Ollama options of the answer-phrasing call
+ANSWER_NUM_CTX = 2048
+ANSWER_NUM_PREDICT = 128
 
-    # Check for SQL Server specific syntax and convert LIMIT to TOP
-    print(f"DB Type: {db_type}")
-    if db_type == "sqlserver" and re.search(r'\bLIMIT\s+1\b', sql, flags=re.IGNORECASE):
-        sql = re.sub(r'\bLIMIT\s+1\b', '', sql, flags=re.IGNORECASE).strip()
-        sql = re.sub(r'(?i)^SELECT\s+', 'SELECT TOP 1 ', sql, count=1)
+DEFAULT_FINAL_PROMPT = """
+        You are a helpful assistant. Write a short, direct sentence in natural language answering the user's weather question.
 
+        Avoid repeating the question or mentioning SQL. Just answer clearly and concisely.
 
+        Question: {corrected_question}
+        SQL Result: {result_summary}
 
-    if model_name == "tscholak/1zha5ono" or model_name == "juierror/text-to-sql-with-table-schema":
-        sql = repair_sql_query(sql)
+        Answer:"""
 
-    sql = quote_values_after_equals(sql)
 
+_language_tool = None
+_language_tool_lock = threading.Lock()
 
-    return sql
 
-def repair_sql_query(sql: str) -> str:
+def get_language_tool():
     """
-    Cleans and repairs common issues in SQL queries generated by models.
-    - Replaces invalid names.
-    - Fixes broken expressions like 'sky clear' → 'Weather = 'clear''
-    - Fixes AVG and other function calls.
-    - Normalizes table and column names.
+    Returns the LanguageTool instance, starting its Java server on first use (or during app.warmup).
     """
-    if not sql:
-        return sql
+    global _language_tool
+    if _language_tool is None:
+        with _language_tool_lock:
+            if _language_tool is None:
+                import language_tool_python
+                _language_tool = language_tool_python.LanguageTool('en-US')
+    return _language_tool
 
-    # Remove invalid JOINs
-    sql = re.sub(r'\bjoin\s+it\s+as\s+t\d+\s+on\s+[^\n]+?(?=where|\bjoin|\Z)', '', sql, flags=re.IGNORECASE)
-    sql = re.sub(r'\bt\d+\.', '', sql, flags=re.IGNORECASE)
 
-    # Normalize table name
-    sql = re.sub(r'\bfrom\s+table\b', 'FROM Weather', sql, flags=re.IGNORECASE)
-    sql = re.sub(r'\bfrom\s+weather\b', 'FROM Weather', sql, flags=re.IGNORECASE)
+def language_tool_started() -> bool:
+    return _language_tool is not None
 
-    # Fix common broken value expressions (e.g. sky clear, 20 degrees)
-    sql = re.sub(r"=\s*sky clear", "= 'clear'", sql, flags=re.IGNORECASE)
-    sql = re.sub(r"=\s*20 degrees", "= 20", sql, flags=re.IGNORECASE)
-    sql = re.sub(r"=\s*sunny", "= 'sunny'", sql, flags=re.IGNORECASE)
 
-    # Fix function syntax (AVG Temperature → AVG(Temperature))
-    # Fix function syntax (e.g. AVG Temperature → AVG(Temperature))
-    sql = re.sub(r'\b(AVG|MAX|MIN|SUM|COUNT)\s+(\w+)', r'\1(\2)', sql, flags=re.IGNORECASE)
+def _language_tool_correct(question: str) -> str:
+    import language_tool_python
+    matches = get_language_tool().check(question)
+    return language_tool_python.utils.correct(question, matches)
 
 
-    # Replace common misused column names or keywords
-    replacements = {
-        'ethical': 'Weather',
-        'location': 'City',
-        'rain': "'rainy'",
-        'sky clear': "'clear'",
-        'raining': "rainy",
-        'drizzly': "drizzle"
-    }
-    for old, new in replacements.items():
-        sql = re.sub(rf'\b{old}\b', new, sql, flags=re.IGNORECASE)
-
-    # Normalize casing for known columns
-    casing_map = {
-        'city': 'City',
-        'weather': 'Weather',
-        'climate': 'Climate',
-        'temperature': 'Temperature'
+# Only questions with words outside the English/schema vocabulary reach LanguageTool
+spelling_corrector = SpellingCorrector(_language_tool_correct)
+
+
+def correct_question(question: str) -> str:
+    return spelling_corrector.correct(question)
+
+
+def _build_sql_cache():
+    size = int(os.getenv("SQL_CACHE_SIZE", "1024"))
+    ttl = float(os.getenv("SQL_CACHE_TTL", "86400")) or None
+    path = os.getenv("SQL_CACHE_PATH")
+    if path:
+        return PersistentLRUCache(path, maxsize=size, ttl=ttl)
+    return LRUCache(maxsize=size, ttl=ttl)
+
+
+# (corrected question, model, prompt template hash, temperature, dialect) -> normalized SQL
+sql_cache = _build_sql_cache()
+
+
+def sql_cache_key(corrected_question: str, model_name: str, prompt_template: str, temperature: float, db_type: str) -> tuple:
+    template_hash = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()[:16]
+    return (normalize_question(corrected_question).lower(), model_name, template_hash, float(temperature), db_type)
+
+
+def is_cacheable_sql(sql: str) -> bool:
+    return bool(sql) and sql.lstrip().upper().startswith("SELECT")
+
+
+def select_prompt_template(model_name: str, prompt_template: str = None) -> str:
+    """
+    Returns the given template, or the prompt style mapped to the model.
+    """
+    if prompt_template is not None:
+        return prompt_template
+
+    # Determine the prompt key (style) based on model
+    prompt_style = model_prompt_styles.get(model_name, "default")
+
+    if model_name not in LOCAL_SEQ2SEQ_MODELS and prompt_style is not None:
+        return prompt_templates_llms[prompt_style]
+    elif prompt_style is not None:
+        return prompt_templates_other[prompt_style]
+    return prompt_templates_llms["default"]
+
+
+# Prompt styles whose fixed template is replaced by app.prompt_builder
+BUILT_PROMPT_STYLES = {"few_shot"}
+
+
+def uses_prompt_builder(model_name: str) -> bool:
+    return (prompt_builder.enabled and model_name not in LOCAL_SEQ2SEQ_MODELS
+            and model_prompt_styles.get(model_name) in BUILT_PROMPT_STYLES)
+
+
+def prepare_prompt(corrected_question: str, model_name: str, prompt_template: str, db_type: str,
+                   num_ctx: int, num_predict: int) -> tuple:
+    """
+    Returns (cache template, prompt, num_ctx) for the SQL-generation call.
+    Models with a style in BUILT_PROMPT_STYLES get, unless a template is passed, a prompt with only the
+    most similar examples and the needed columns (app.prompt_builder) and num_ctx sized to it;
+    the cache template is then the builder's fingerprint.
+    """
+    if prompt_template is None and uses_prompt_builder(model_name):
+        prompt = prompt_builder.build(corrected_question, db_type)
+        return prompt_builder.fingerprint, prompt, prompt_builder.size_num_ctx(prompt, num_predict, num_ctx)
+    prompt_template = select_prompt_template(model_name, prompt_template)
+    return prompt_template, prompt_template.format(corrected_question=corrected_question), num_ctx
+
+
+def answer_num_ctx(model_name: str, answer_prompt: str) -> int:
+    # Sized like the model's SQL prompts: Ollama reloads the model whenever num_ctx changes
+    if uses_prompt_builder(model_name):
+        return prompt_builder.size_num_ctx(answer_prompt, ANSWER_NUM_PREDICT, ANSWER_NUM_CTX)
+    return ANSWER_NUM_CTX
+
+
+def ollama_payload(model_name: str, prompt: str, temperature: float, num_ctx: int, num_predict: int, stream: bool = False) -> dict:
+    return {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": stream,
+        "options": {
+            "temperature": temperature,
+            "num_ctx": num_ctx,
+            "num_predict": num_predict,
+        },
+        "keep_alive": "10m"
     }
-    for old, new in casing_map.items():
-        sql = re.sub(rf'\b{old}\b', new, sql, flags=re.IGNORECASE)
 
-    # Convert "value" → 'value'
-    sql = re.sub(r'"([^"]+)"', r"'\1'", sql)
 
-    # Cleanup
-    sql = re.sub(r'\s+', ' ', sql).strip()
-    sql = sql.rstrip(';')
+def generation_error(e: Exception) -> str:
+    """
+    Maps an exception raised while generating SQL to the string returned in place of the query.
+    """
+    # openai is only imported once a GPT model is used; before that no error can come from it
+    openai = sys.modules.get("openai")
+    if openai is not None and isinstance(e, openai.APIError) and "insufficient_quota" in str(e).lower():
+        return "insufficient_quota"
+    return f"Error generating SQL: {str(e)}"
+
 
-    return sql
+def is_generation_error(sql_query: str) -> bool:
+    """
+    True if SQL generation produced no query: nothing, an "-- Error" string or a generation_error string.
+    """
+    return not sql_query or sql_query.startswith(("-- Error", "Error generating SQL", "insufficient_quota"))
 
 
 def generate_sql(question: str, model_name: str, api_key: str=None, prompt_template: str = None, 
-temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256) -> tuple:
-    db_type = get_db_type()
-    load_dotenv()
-    matches = autocorrect.check(question)
-    corrected_question = language_tool_python.utils.correct(question, matches)
+temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, db_type: str = None, timings: dict = None) -> tuple:
+    """
+    - `timings`: optional dict that receives seconds spent in "correction", "intent", "generation", "normalization" and "validation".
+    """
+    if db_type is None:
+        db_type = get_db_type()
+    with stage_timer(timings, "correction"):
+        corrected_question = correct_question(question)
+    sql_query = intent_sql(corrected_question, db_type, timings)
+    if sql_query is not None:
+        return corrected_question, sql_query
+    return corrected_question, model_generate_sql(corrected_question, model_name, api_key, prompt_template, temperature,
+                                                  num_ctx, num_predict, db_type, timings)
+
+
+# The stages below need no model call or I/O of their own; app.async_pipeline shares them
+
+def intent_sql(corrected_question: str, db_type: str, timings: dict = None) -> str:
+    """
+    Returns the SQL of the question's intent template, or None if a model has to write it.
+    Common question templates are answered without calling a model (app.intents).
+    """
+    with stage_timer(timings, "intent"):
+        intent = intent_matcher.match(corrected_question, db_type)
+    return None if intent is None else intent["sql"]
+
+
+def start_model_sql(corrected_question: str, model_name: str, prompt_template: str, temperature: float, num_ctx: int,
+                    num_predict: int, db_type: str) -> tuple:
+    """
+    Returns (prompt, num_ctx, cache_key, cached_sql) for the model's SQL generation;
+    cached_sql is None unless the query is already in the SQL cache.
+    """
+    prompt_template, prompt, num_ctx = prepare_prompt(corrected_question, model_name, prompt_template, db_type,
+                                                      num_ctx, num_predict)
+    cache_key = sql_cache_key(corrected_question, model_name, prompt_template, temperature, db_type)
+    return prompt, num_ctx, cache_key, sql_cache.get(cache_key)
+
+
+def finish_model_sql(response: str, model_name: str, cache_key: tuple, db_type: str, timings: dict = None) -> str:
+    """
+    Extracts, normalizes and validates the query from the model's response and caches it;
+    returns the query or an "-- Error" string.
+    """
+    with stage_timer(timings, "normalization"):
+        sql_query = extract_sql_from_response(response, db_type=db_type, model_name=model_name)
+    with stage_timer(timings, "validation"):
+        sql_query = validated_sql(sql_query, db_type)
+    if is_cacheable_sql(sql_query):
+        sql_cache.put(cache_key, sql_query)
+    return sql_query
+
+
+def validated_sql(sql: str, db_type: str) -> str:
+    """
+    Returns the query checked by app.sql_validator (transpiled for the dialect with SQL_VALIDATION_REWRITE=1),
+    or an "-- Error: invalid SQL" string so that it never reaches the database.
+    """
+    if not sql:
+        return sql
+    valid_sql, reason = sql_validator.validate(sql, db_type)
+    if reason is not None:
+        metrics.sql_validation_total.labels("invalid").inc()
+        return f"-- Error: invalid SQL ({reason})"
+    metrics.sql_validation_total.labels("valid").inc()
+    return valid_sql
+
+
+def model_generate_sql(corrected_question: str, model_name: str, api_key: str = None, prompt_template: str = None,
+                       temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, db_type: str = None,
+                       timings: dict = None) -> str:
+    """
+    Generates the SQL for an already corrected question with the model (no intent templates);
+    returns the normalized query or an error string.
+    """
+    if db_type is None:
+        db_type = get_db_type()
     try:
-        if prompt_template is None:
-            # Determine the prompt key (style) based on model
-            prompt_style = model_prompt_styles.get(model_name, "default")
-
-            if model_name not in ["tscholak/1zha5ono", "juierror/text-to-sql-with-table-schema"] and prompt_style is not None:
-                prompt_template = prompt_templates_llms[prompt_style]
-            elif prompt_style is not None:
-                prompt_template = prompt_templates_other[prompt_style]
+        with stage_timer(timings, "generation"):
+            prompt, num_ctx, cache_key, cached_sql = start_model_sql(corrected_question, model_name, prompt_template,
+                                                                     temperature, num_ctx, num_predict, db_type)
+            if cached_sql is not None:
+                return cached_sql
+
+            if model_name in LOCAL_SEQ2SEQ_MODELS:
+                answer = seq2seq_scheduler.generate(model_name, prompt, **seq2seq_generate_kwargs[model_name]).strip()
+
+            elif "gpt" in model_name.lower():
+                # Use OpenAI API for gpt models
+                response = get_openai_client(api_key).chat.completions.create(
+                    model=model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature
+                )
+                answer = response.choices[0].message.content.strip()
+
             else:
-                prompt_template = prompt_templates_llms["default"]
-
-
-        prompt = prompt_template.format(corrected_question=corrected_question)
-
-        if model_name == "juierror/text-to-sql-with-table-schema":
-            from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-            import torch
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to("cuda" if torch.cuda.is_available() else "cpu")
-
-            inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-            outputs = model.generate(inputs=inputs["input_ids"], num_beams=10, max_length=700)
-            output = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            output = extract_sql_from_response(output.strip(), db_type=db_type, model_name=model_name)
-            return corrected_question, output
-
-        
-        if model_name == "tscholak/1zha5ono":
-            from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-            import torch
-            tokenizer = AutoTokenizer.from_pretrained("tscholak/1zha5ono")
-            model = AutoModelForSeq2SeqLM.from_pretrained("tscholak/1zha5ono").to("cuda" if torch.cuda.is_available() else "cpu")
-
-            inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-            outputs = model.generate(**inputs, max_new_tokens=128)
-            output = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            output = extract_sql_from_response(output, db_type=db_type, model_name=model_name)
-            return corrected_question, output
-
-
-        if "gpt" in model_name.lower():
-            # Use OpenAI API for gpt models
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=temperature
-            )
-            answer = response.choices[0].message.content.strip()
-
-        else:
-            # Use Ollama API for open-source models
-
-            ollama_base = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
-            response = requests.post(
-                f"{ollama_base}/api/generate",
-                json={
-                    "model": model_name,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": temperature, 
-                        "num_ctx": num_ctx,
-                        "num_predict": num_predict,
-                    },
-                    "keep_alive": "10m"
-                }
-            )
-            response.raise_for_status()
-            answer = response.json()["response"]
-
-        # Clean the SQL output
-        answer = extract_sql_from_response(answer, db_type=db_type, model_name=model_name)
-        return corrected_question, answer
-
-    except APIError as e:
-        if "insufficient_quota" in str(e).lower():
-            return corrected_question, "insufficient_quota"
-        return corrected_question, f"Error generating SQL: {e}"
+                # Use Ollama API for open-source models
+                answer = ollama_post("/api/generate", ollama_payload(model_name, prompt, temperature, num_ctx, num_predict))["response"]
+
+        return finish_model_sql(answer, model_name, cache_key, db_type, timings)
+
     except Exception as e:
-        return corrected_question, f"Error generating SQL: {str(e)}"
+        return generation_error(e)
 
 
-    
-def execute_sql(sql_query: str) -> list:
+def race_generate_sql(question: str, api_key: str = None, models: list = None, prompt_template: str = None,
+                      temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, db_type: str = None,
+                      timings: dict = None, race_details: dict = None) -> tuple:
+    """
+    "race" mode of generate_sql (see app.racing): returns (corrected_question, sql, model) with the first
+    valid query of `models` (default RACE_MODELS). `model` is the winner, or the first race model when an
+    intent template answered; the sql is an "-- Error" string when no model produced a valid query.
+    - `race_details`: optional dict that receives the "winner" and the per-model "attempts".
+    """
+    if db_type is None:
+        db_type = get_db_type()
+    models = get_race_models(api_key) if models is None else models
+    race_details = {} if race_details is None else race_details
+    race_details.update({"winner": None, "attempts": []})
+    with stage_timer(timings, "correction"):
+        corrected_question = correct_question(question)
+    if not models:
+        return corrected_question, no_winner_error([]), None
+    sql_query = intent_sql(corrected_question, db_type, timings)
+    if sql_query is not None:
+        return corrected_question, sql_query, models[0]
+
+    def candidate(model):
+        sql = model_generate_sql(corrected_question, model, api_key, prompt_template, temperature, num_ctx, num_predict,
+                                 db_type)
+        return sql, validate_sql(sql, db_type)
+
+    with stage_timer(timings, "generation"):
+        winner, sql_query, attempts = race(models, candidate)
+    sql_query, winner = race_outcome(winner, sql_query, attempts, race_details)
+    return corrected_question, sql_query, winner
+
+
+def race_validated(details: dict) -> bool:
+    """
+    True if the query came from a race winner, which app.racing.validate_sql has already checked
+    (an intent template answering in race mode leaves no winner).
+    """
+    return details.get("race", {}).get("winner") is not None
+
+
+def get_weather_table_version():
+    with get_pool().connection() as conn:
+        return get_table_version(conn, WEATHER_TABLE, get_db_type())
+
+
+# Canonical SQL -> fetched rows, cleared when the Weather table's data changes
+result_cache = VersionedCache(
+    get_weather_table_version,
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+    check_interval=float(os.getenv("RESULT_CACHE_VERSION_CHECK_SECONDS", "5")),
+)
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "1000"))
+
+metrics.known_models.update(model_prompt_styles)
+metrics.known_models.add(RACE_MODEL)
+metrics.register_cache("sql", sql_cache.stats)
+metrics.register_cache("result", result_cache.stats)
+metrics.register_cache("sql_validation", sql_validator.stats)
+metrics.register_cache("spelling", spelling_corrector.cache.stats)
+metrics.register_cache("intent", lambda: {
+    "hits": intent_matcher.stats()["hits"],
+    "misses": intent_matcher.lookups - intent_matcher.stats()["hits"],
+    "hit_ratio": intent_matcher.stats()["hit_rate"],
+})
+
+
+def execute_sql(sql_query: str, cancel=None, validated: bool = False) -> list:
+    """
+    Returns (rows, has_error); rows is a ResultRows capped at RESULT_MAX_ROWS / RESULT_MAX_BYTES,
+    with `truncated` set when the query returned more.
+    The query must parse and match the schema (app.sql_validator; it runs as given, never rewritten),
+    pass app.query_guard (read-only, within the cost budget) and is stopped after
+    QUERY_TIMEOUT_SECONDS, or when `cancel` (a query_guard.CancelToken) is cancelled.
+    - `validated=True` skips the validator and the guard's checks for a query that already passed them
+      (the race winner, see app.racing.validate_sql); the timeout still applies.
+    """
+    db_type = get_db_type()
+    if not validated:
+        _, reason = sql_validator.validate(sql_query, db_type)
+        if reason is not None:
+            return [f"Invalid SQL: {reason}"], True
+    cache_key = canonicalize_sql(sql_query)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached.copy(), False
+    # The rows fetched below are not cached if the data changes (and the cache is cleared) meanwhile
+    generation = result_cache.generation
+
+    pool = get_pool()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        conn = pool.acquire()
     except Exception as e:
         return ["Error connecting to database"], True
     try:
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
+        if not validated:
+            query_guard.check(conn, sql_query, db_type, validated=sql_validator.enabled)
+        with query_guard.limit(conn, cancel):
+            cursor = conn.cursor()
+            query_guard.bind_cursor(cursor, cancel)
+            cursor.execute(sql_query)
+            results = fetch_rows(cursor)
+            cursor.close()
         has_error = False
+    except QueryRejected as e:
+        pool.release(conn)
+        return [f"Query rejected: {e}"], True
     except Exception as e:
+        # The connection may be broken - make the pool verify it before reuse
+        pool.release(conn, check=True)
+        if cancel is not None and cancel.cancelled:
+            metrics.query_guard_total.labels("cancelled").inc()
+            return ["Query cancelled."], True
+        if query_guard.is_timeout(e):
+            metrics.query_guard_total.labels("timeout").inc()
+            print(f"Query timed out after {query_guard.timeout:g}s: {sql_query}")
+            return ["Query timed out."], True
         return ["Error executing SQL."], True
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-        except Exception as e:
-            print("Error closing connection.")
 
+    pool.release(conn)
+    if len(results) <= RESULT_CACHE_MAX_ROWS:
+        result_cache.put(cache_key, results.copy(), generation)
     return results, has_error
 
-def answer_question(question: str, model_name: str, api_key: str, prompt_template: str = None, temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, final_prompt: str = None, answer_temperature: float = 0.5) -> tuple:
-    db_type = get_db_type()
-    corrected_question, sql_query = generate_sql(
-            question, model_name, api_key,
-            prompt_template=prompt_template,
-            temperature=temperature,
-            num_ctx=num_ctx,
-            num_predict=num_predict
-        )
+def summarize_results(results, has_error: bool) -> str:
+    if has_error:
+        return "Error executing SQL query."
+    elif not results:
+        return "No matching results found."
+    return summarize_rows(results)
 
-    if sql_query.startswith("-- Error"):
-            return sql_query, sql_query, sql_query, corrected_question, True
-    results, has_error = execute_sql(sql_query)
 
+def build_answer_prompt(corrected_question: str, result_summary: str, final_prompt: str = None) -> str:
+    if final_prompt is None:
+        final_prompt = DEFAULT_FINAL_PROMPT
+    return final_prompt.format(
+        corrected_question=corrected_question,
+        result_summary=result_summary)
+
+
+def settle_answer(corrected_question: str, sql_query: str, results, has_error: bool, result_summary: str,
+                  model_name: str, db_type: str, answer_mode: str = None, final_prompt: str = None,
+                  timings: dict = None) -> tuple:
+    """
+    Returns (result, answer, answer_prompt) for executed results:
+    - when no model has to phrase the answer (execution error, local seq2seq model, template answer,
+      no rows), `answer` is the final answer and `answer_prompt` is None,
+    - otherwise `answer` is None and `answer_prompt` is the prompt for the model.
+    `result` is the result text returned next to the answer.
+    """
+    if model_name in LOCAL_SEQ2SEQ_MODELS:
+        return result_summary, result_summary, None
     if has_error:
-        result_summary = "Error executing SQL query."
-    elif not results:
-        result_summary = "No matching results found."
-    else:
-        result_summary = "; ".join([", ".join(map(str, row)) for row in results])
-    if model_name in ["tscholak/1zha5ono", "juierror/text-to-sql-with-table-schema"]:
-        return sql_query, result_summary, result_summary, corrected_question, has_error
+        return "Error executing SQL", "Error executing SQL query.", None
 
-    try:
-        if has_error:
-            return sql_query, "Error executing SQL", "Error executing SQL query.", corrected_question, True
+    # Phrase the result from a template when possible, skipping the second LLM call
+    with stage_timer(timings, "answer"):
+        answer = template_answer(corrected_question, results, model_name, db_type, answer_mode, sql_query)
+    if answer is not None:
+        return result_summary if results else "No results", answer, None
+    if not results:
+        return "No results", "No matching results found.", None
+    return result_summary, None, build_answer_prompt(corrected_question, result_summary, final_prompt)
 
-        if not results:
-            return sql_query, "No results", "No matching results found.", corrected_question, False
 
-        if final_prompt is None:
-            final_prompt = """
-        You are a helpful assistant. Write a short, direct sentence in natural language answering the user's weather question.
+def template_answer(corrected_question: str, results, model_name: str, db_type: str, answer_mode: str = None,
+                    sql_query: str = None) -> str:
+    """
+    Returns the answer rendered from the question's intent and the result shape,
+    or None when the LLM has to phrase it (unrecognized shape, or "llm" answer mode).
+    - `sql_query`: the executed query; the intent's sentence is only used for the intent's own SQL.
+    """
+    if get_answer_mode(model_name, answer_mode) != "template":
+        return None
+    if getattr(results, "truncated", False):
+        return None  # A template would present the partial rows as the whole answer
+    intent = intent_matcher.match(corrected_question, db_type, record=False)
+    return render_answer(results, intent, sql_query)
 
-        Avoid repeating the question or mentioning SQL. Just answer clearly and concisely.
 
-        Question: {corrected_question}
-        SQL Result: {result_summary}
+def answer_question(question: str, model_name: str, api_key: str, prompt_template: str = None, temperature: float = 0.1, num_ctx: int = 2048, num_predict: int = 256, final_prompt: str = None, answer_temperature: float = 0.5, answer_mode: str = None, details: dict = None) -> tuple:
+    """
+    - `model_name`: a model, or "race" to use the first valid SQL of the RACE_MODELS (app.racing).
+    - `details`: optional dict that receives the fetched "rows", whether they were "truncated"
+      (see app.results), per-stage "timings" (seconds) and, in race mode, the "race" winner and attempts.
+    Stage timings, errors and in-flight requests are also recorded in app.metrics.
+    """
+    if details is None:
+        details = {}
+    timings = details.setdefault("timings", {})
+    details.setdefault("rows", [])
+    details.setdefault("truncated", False)
+    with metrics.track_request(model_name, "sync", timings):
+        result = _answer_question(question, model_name, api_key, prompt_template, temperature, num_ctx, num_predict,
+                                  final_prompt, answer_temperature, answer_mode, details)
+    sql_query, _, final_answer, _, has_error = result
+    metrics.record_result(model_name, sql_query, final_answer, has_error)
+    return result
+
+
+def _answer_question(question, model_name, api_key, prompt_template, temperature, num_ctx, num_predict,
+                     final_prompt, answer_temperature, answer_mode, details) -> tuple:
+    timings = details["timings"]
 
-        Answer:"""
+    db_type = get_db_type()
+    if model_name == RACE_MODEL:
+        # The winning model also phrases the answer
+        corrected_question, sql_query, model_name = race_generate_sql(
+            question, api_key,
+            prompt_template=prompt_template,
+            temperature=temperature,
+            num_ctx=num_ctx,
+            num_predict=num_predict,
+            db_type=db_type,
+            timings=timings,
+            race_details=details.setdefault("race", {})
+        )
+    else:
+        corrected_question, sql_query = generate_sql(
+            question, model_name, api_key,
+            prompt_template=prompt_template,
+            temperature=temperature,
+            num_ctx=num_ctx,
+            num_predict=num_predict,
+            db_type=db_type,
+            timings=timings
+        )
 
+    if is_generation_error(sql_query):
+        return sql_query, sql_query, sql_query, corrected_question, True
+    with stage_timer(timings, "execution"):
+        results, has_error = execute_sql(sql_query, validated=race_validated(details))
+    if not has_error:
+        details["rows"] = [list(row) for row in results]
+        details["truncated"] = results.truncated
 
-        answer_prompt = final_prompt.format(
-            corrected_question=corrected_question, 
-            result_summary=result_summary)
-
-        if "gpt" in model_name.lower():
-            from openai import OpenAI
-            client = OpenAI(api_key=api_key)
-            final_response = client.chat.completions.create(
-                model=model_name,
-                messages=[{"role": "user", "content": answer_prompt}],
-                temperature=answer_temperature
-            ).choices[0].message.content.strip()
-        else:
-            ollama_base = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
-            final_response = requests.post(
-                f"{ollama_base}/api/generate",
-                json={
-                    "model": model_name,
-                    "prompt": answer_prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": answer_temperature,
-                        "num_ctx": 2048,
-                        "num_predict": 128
-                    },
-                    "keep_alive": "10m"
-                }
-            ).json()["response"].strip()
+    result_summary = summarize_results(results, has_error)
+    try:
+        result, final_response, answer_prompt = settle_answer(corrected_question, sql_query, results, has_error,
+                                                              result_summary, model_name, db_type, answer_mode,
+                                                              final_prompt, timings)
+        if answer_prompt is None:
+            return sql_query, result, final_response, corrected_question, has_error
+
+        with stage_timer(timings, "answer"):
+            if "gpt" in model_name.lower():
+                final_response = get_openai_client(api_key).chat.completions.create(
+                    model=model_name,
+                    messages=[{"role": "user", "content": answer_prompt}],
+                    temperature=answer_temperature
+                ).choices[0].message.content.strip()
+            else:
+                final_response = ollama_post("/api/generate", ollama_payload(
+                    model_name, answer_prompt, answer_temperature,
+                    num_ctx=answer_num_ctx(model_name, answer_prompt), num_predict=ANSWER_NUM_PREDICT))["response"].strip()
 
         return sql_query, result_summary, final_response, corrected_question, has_error
     
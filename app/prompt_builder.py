@@ -0,0 +1,161 @@
+"""
+Builds compact SQL-generation prompts instead of sending a fixed, verbose template:
+- a pool of question -> SQL examples is indexed once with TF-IDF (scikit-learn) over character n-grams
+  of the content words, so "rain" matches "raining" and "rainy",
+- each prompt gets only the `k` examples most similar to the question,
+- the schema line lists only the columns the question needs,
+- the instruction block (INSTRUCTIONS, "Examples:", "Now answer:") is kept,
+- num_ctx is sized to the prompt, so Ollama allocates (and evaluates) less context.
+Used for models with the "few_shot" prompt style unless a template is passed explicitly; disabled with PROMPT_BUILDER=0.
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+from app.cache import LRUCache
+from app.schema import WEATHER_TABLE, get_schema_values
+from app.sql_normalizer import to_sqlite
+
+# Written for SQL Server (TOP n) like the intent templates; converted for SQLite when needed
+EXAMPLES = [
+    ("Which cities have a tropical climate?", "SELECT City FROM Weather WHERE Climate LIKE '%tropical%';"),
+    ("What is the temperature in Warsaw?", "SELECT Temperature FROM Weather WHERE City = 'Warsaw';"),
+    ("Where is it raining?", "SELECT City FROM Weather WHERE Weather LIKE '%rain%';"),
+    ("Where is it the hottest?", "SELECT TOP 1 City, Temperature FROM Weather ORDER BY Temperature DESC;"),
+    ("Which city has the lowest temperature?", "SELECT TOP 1 City, Temperature FROM Weather ORDER BY Temperature ASC;"),
+    ("List the three warmest cities.", "SELECT TOP 3 City, Temperature FROM Weather ORDER BY Temperature DESC;"),
+    ("Is it sunny in Paris?", "SELECT City, Weather FROM Weather WHERE City = 'Paris' AND Weather LIKE '%sunny%';"),
+    ("What is the weather like in London?", "SELECT City, Weather FROM Weather WHERE City = 'London';"),
+    ("What is the climate of Cairo?", "SELECT City, Climate FROM Weather WHERE City = 'Cairo';"),
+    ("Where is it above 25 degrees?", "SELECT City, Temperature FROM Weather WHERE Temperature > 25;"),
+    ("Which cities are colder than 15 degrees?", "SELECT City, Temperature FROM Weather WHERE Temperature < 15;"),
+    ("Where is it exactly 18 degrees?", "SELECT City, Temperature FROM Weather WHERE Temperature = 18;"),
+    ("What is the average temperature in cities with a temperate climate?",
+     "SELECT AVG(Temperature) FROM Weather WHERE Climate LIKE '%temperate%';"),
+    ("What is the highest temperature among rainy cities?", "SELECT MAX(Temperature) FROM Weather WHERE Weather LIKE '%rain%';"),
+    ("How many cities are cloudy?", "SELECT COUNT(*) FROM Weather WHERE Weather LIKE '%cloudy%';"),
+    ("Which cities have a desert climate and sunny weather?",
+     "SELECT City FROM Weather WHERE Climate LIKE '%desert%' AND Weather LIKE '%sunny%';"),
+    ("Where is it foggy?", "SELECT City FROM Weather WHERE Weather LIKE '%fog%';"),
+    ("Which cities have a continental climate?", "SELECT City FROM Weather WHERE Climate LIKE '%continental%';"),
+    ("What is the temperature in New York?", "SELECT Temperature FROM Weather WHERE City = 'New York';"),
+    ("Show all cities sorted by temperature.", "SELECT City, Temperature FROM Weather ORDER BY Temperature DESC;"),
+]
+
+INSTRUCTIONS = "Only return the SQL query, no explanations."
+
+COLUMN_TYPES = {"City": "TEXT", "Temperature": "INT", "Weather": "TEXT", "Climate": "TEXT"}
+
+# Question words that mean a column is needed, besides the column's own values
+COLUMN_HINTS = {
+    "Temperature": re.compile(r"\b(temperatures?|degrees?|hot\w*|cold\w*|warm\w*|cool\w*|average|mean|celsius|°)"),
+    "Weather": re.compile(r"\b(weather|rain\w*|sun\w*|cloud\w*|sky|fog\w*|wind\w*|snow\w*|storm\w*|drizzl\w*)"),
+    "Climate": re.compile(r"\b(climate|tropical|temperate|desert|continental|arid|subtropical)\b"),
+}
+_WORD = re.compile(r"[a-z0-9°]+")
+
+# Chars per token is ~4 for English; 3 leaves room for SQL and names that tokenize poorly
+CHARS_PER_TOKEN = 3
+
+
+def _content_words(text: str) -> str:
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    # "Which city has the most rain" -> "city rain": n-grams of "which", "has", "the" would outweigh the topic
+    return " ".join(word for word in _WORD.findall(text.lower()) if word not in ENGLISH_STOP_WORDS)
+
+
+def _for_dialect(sql: str, db_type: str) -> str:
+    if db_type != "sqlite":
+        return sql
+    return to_sqlite(sql.rstrip(";")) + ";"
+
+
+class PromptBuilder:
+    """
+    - `build(question, db_type)` returns the prompt for a question.
+    - `size_num_ctx(prompt, num_predict, num_ctx)` returns the context size for it.
+    - `fingerprint` identifies the example pool and settings (part of the SQL cache key).
+    """
+
+    def __init__(self, examples: list = None, k: int = None, enabled: bool = None, min_num_ctx: int = None):
+        self.examples = list(examples or EXAMPLES)
+        self.k = k if k is not None else int(os.getenv("PROMPT_EXAMPLES_K", "2"))
+        self.enabled = enabled if enabled is not None else os.getenv("PROMPT_BUILDER", "1") != "0"
+        self.min_num_ctx = min_num_ctx if min_num_ctx is not None else int(os.getenv("PROMPT_MIN_NUM_CTX", "1024"))
+        self.fingerprint = "prompt_builder:" + hashlib.sha256(
+            repr((self.examples, self.k, INSTRUCTIONS)).encode("utf-8")).hexdigest()[:16]
+        self._index = None
+        self._lock = threading.Lock()
+        self._prompts = LRUCache(maxsize=int(os.getenv("PROMPT_CACHE_SIZE", "1024")))  # (question, dialect) -> prompt
+
+    def _build_index(self) -> tuple:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = TfidfVectorizer(analyzer="char_wb", preprocessor=_content_words, ngram_range=(2, 4), sublinear_tf=True)
+        matrix = vectorizer.fit_transform([question for question, _ in self.examples])
+        return vectorizer, matrix
+
+    @property
+    def index(self) -> tuple:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._build_index()
+        return self._index
+
+    def select_examples(self, question: str, k: int = None) -> list:
+        """
+        Returns the `k` (question, sql) examples most similar to the question, least similar first.
+        """
+        k = self.k if k is None else k
+        if k <= 0:
+            return []
+        import numpy as np
+        vectorizer, matrix = self.index
+        # Rows are L2-normalized, so the dot product is the cosine similarity
+        scores = (matrix @ vectorizer.transform([question]).T).toarray().ravel()
+        best = np.argsort(-scores, kind="stable")[:k]
+        # The closest example goes last, right before the question
+        return [self.examples[i] for i in reversed(best)]
+
+    def needed_columns(self, question: str) -> list:
+        """
+        Returns City plus the columns the question mentions (by name, hint word or stored value).
+        """
+        text = question.lower()
+        needed = {"City"}
+        values = get_schema_values()
+        for column, hint in COLUMN_HINTS.items():
+            if hint.search(text) or any(value.lower() in text for value in values.get(column, [])):
+                needed.add(column)
+        return [column for column in COLUMN_TYPES if column in needed]
+
+    def schema_text(self, columns: list) -> str:
+        return f"Table: {WEATHER_TABLE}(" + ", ".join(f"{column} {COLUMN_TYPES[column]}" for column in columns) + ")"
+
+    def build(self, question: str, db_type: str = None) -> str:
+        key = (question, db_type)
+        prompt = self._prompts.get(key)
+        if prompt is not None:
+            return prompt
+        examples = self.select_examples(question)
+        columns = self.needed_columns(question)
+        shots = "\n\n".join(f"Q: {example_question}\nA: {_for_dialect(sql, db_type)}" for example_question, sql in examples)
+        prompt = f"{self.schema_text(columns)}\n{INSTRUCTIONS}\n\nExamples:\n{shots}\n\nNow answer:\nQ: {question}\nA:"
+        self._prompts.put(key, prompt)
+        return prompt
+
+    def size_num_ctx(self, prompt: str, num_predict: int, num_ctx: int) -> int:
+        """
+        Returns the smallest power of two (at least `min_num_ctx`) that fits the prompt and `num_predict`
+        tokens, but never more than the requested `num_ctx`; returns `num_ctx` unchanged when disabled.
+        Sizes are rounded to powers of two so that most prompts of a model share one size.
+        """
+        if not self.enabled:
+            return num_ctx
+        needed = math.ceil(len(prompt) / CHARS_PER_TOKEN) + num_predict
+        sized = max(self.min_num_ctx, 2 ** math.ceil(math.log2(max(needed, 1))))
+        return min(sized, num_ctx)
+
+
+prompt_builder = PromptBuilder()
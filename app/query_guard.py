@@ -0,0 +1,280 @@
+"""
+Guards the execution of model-generated SQL:
+- read-only enforcement: a single SELECT (or WITH ... SELECT), no writes, DDL, EXEC, SELECT INTO or WAITFOR,
+- cost guard: rejects queries that would scan too many rows (table sizes, cartesian joins, unfiltered
+  full scans of large tables) and, on SQL Server, queries whose estimated plan cost exceeds a budget,
+- statement timeout with cancellation: pyodbc's query timeout on SQL Server, a progress handler on SQLite,
+  and a CancelToken that stops a running query when its request is abandoned.
+"""
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from app.cache import LRUCache
+from app.sql_normalizer import canonicalize_sql, tokenize
+from app import metrics
+
+# Words that never belong in a read-only query (string literals and [quoted] identifiers are not words)
+FORBIDDEN_WORDS = {
+    "insert", "update", "delete", "merge", "upsert", "drop", "alter", "create", "truncate", "rename",
+    "exec", "execute", "sp_executesql", "grant", "revoke", "deny", "into", "backup", "restore", "shutdown",
+    "kill", "dbcc", "bulk", "openrowset", "opendatasource", "openquery", "openxml", "waitfor",
+    "attach", "detach", "pragma", "vacuum", "reindex",
+}
+# Statements that are harmless words elsewhere (w.set, x.use): rejected only outside a dotted name
+STATEMENT_WORDS = {"declare", "set", "use"}
+
+_PLAN_COST = re.compile(r'StatementSubTreeCost="([0-9.eE+-]+)"')
+_TIMEOUT_ERRORS = ("hyt00", "hyt01", "timeout expired", "query timeout", "interrupted")
+
+
+class QueryRejected(Exception):
+    """Raised by QueryGuard.check for a query that must not be executed."""
+
+    def __init__(self, reason: str, kind: str):
+        super().__init__(reason)
+        self.kind = kind  # "read_only" or "cost"
+
+
+class CancelToken:
+    """
+    Lets another thread (e.g. an abandoned async request) cancel the query a worker thread is running.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._cancel_fn = None
+        self._lock = threading.Lock()
+
+    def bind(self, cancel_fn):
+        with self._lock:
+            self._cancel_fn = cancel_fn
+            cancelled = self.cancelled
+        if cancelled:
+            cancel_fn()
+
+    def unbind(self):
+        with self._lock:
+            self._cancel_fn = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            cancel_fn = self._cancel_fn
+        if cancel_fn is not None:
+            try:
+                cancel_fn()
+            except Exception as e:
+                print(f"Could not cancel the running query: {e}")
+
+
+def check_read_only(sql: str) -> str:
+    """
+    Returns why the query is not a single read-only SELECT, or None if it is.
+    """
+    tokens = [(kind, text) for kind, text in tokenize(sql) if kind not in ("ws", "comment")]
+    if not tokens or tokens[0][1].lower() not in ("select", "with"):
+        return "only SELECT queries are allowed"
+    for index, (kind, text) in enumerate(tokens):
+        if text == ";" and any(t != ";" for _, t in tokens[index + 1:]):
+            return "only a single statement is allowed"
+        if kind == "word" and text.lower() in FORBIDDEN_WORDS:
+            return f"{text.upper()} is not allowed in a read-only query"
+        if kind == "word" and text.lower() in STATEMENT_WORDS and "." not in (
+                tokens[index - 1][1], tokens[index + 1][1] if index + 1 < len(tokens) else None):
+            return f"{text.upper()} is not allowed in a read-only query"
+    return None
+
+
+def _table_references(tokens: list) -> list:
+    # Tables after FROM (including comma-separated ones) and JOIN, at any nesting depth
+    tables = []
+    expecting, in_from = False, False
+    for kind, text in tokens:
+        lower = text.lower()
+        if kind == "word" and lower in ("from", "join"):
+            expecting, in_from = True, lower == "from"
+        elif expecting and kind in ("word", "bracket", "dquote"):
+            tables.append(text.strip('[]"').split(".")[-1].lower())
+            expecting = False
+        elif text == "," and in_from:
+            expecting = True
+        elif text == "(":
+            expecting, in_from = False, False
+        elif kind == "word" and lower in ("where", "group", "order", "having", "on", "union", "except", "intersect"):
+            expecting, in_from = False, False
+    return tables
+
+
+def estimate_scan(sql: str, table_rows: dict, default_rows: int = 1000) -> tuple:
+    """
+    Returns (estimated rows scanned, largest table without a selective filter or None).
+    The estimate multiplies the sizes of all table references, i.e. assumes a nested-loop join;
+    a table counts as unfiltered if the query has no WHERE/TOP/LIMIT or only leading-wildcard LIKEs.
+    """
+    tokens = [(kind, text) for kind, text in tokenize(sql) if kind not in ("ws", "comment")]
+    words = {text.lower() for kind, text in tokens if kind == "word"}
+    tables = _table_references(tokens)
+    sizes = [table_rows.get(table, default_rows) for table in tables]
+    scanned = math.prod(sizes) if sizes else 0
+
+    selective = "top" in words or "limit" in words
+    if "where" in words:
+        # "LIKE '%x%'" cannot use an index; anything else in a WHERE may
+        likes = [i for i, (kind, text) in enumerate(tokens) if kind == "word" and text.lower() == "like"]
+        leading_wildcards = sum(1 for i in likes if i + 1 < len(tokens) and tokens[i + 1][1].startswith("'%"))
+        comparisons = sum(1 for kind, _ in tokens if kind == "op") + len(likes) \
+            + sum(1 for word in ("in", "between", "is") if word in words)
+        selective = selective or comparisons > leading_wildcards
+    unfiltered = None
+    if not selective and tables:
+        unfiltered = max(tables, key=lambda table: table_rows.get(table, default_rows))
+    return scanned, unfiltered
+
+
+class QueryGuard:
+    """
+    Checks model-generated SQL before execution and bounds its run time.
+    - check(conn, sql, db_type) raises QueryRejected for writes / multiple statements (unless `validated`
+      by app.sql_validator), for more than `max_scan_rows` estimated rows scanned, for an unfiltered scan
+      of a table above `full_scan_rows`, and (SQL Server, `max_cost` > 0) for an estimated plan cost above
+      `max_cost`; the plan is only estimated for queries scanning more than `plan_check_rows` rows, smaller
+      ones are left to the timeout.
+    - limit(conn, cancel) bounds the statement to `timeout` seconds and binds `cancel` to it.
+    - Disabled with QUERY_GUARD=0 (the timeout still applies).
+    """
+
+    def __init__(self, timeout: float = None, max_cost: float = None, max_scan_rows: int = None,
+                 full_scan_rows: int = None, plan_check_rows: int = None, enabled: bool = None):
+        self.timeout = timeout if timeout is not None else float(os.getenv("QUERY_TIMEOUT_SECONDS", "10"))
+        self.max_cost = max_cost if max_cost is not None else float(os.getenv("QUERY_MAX_COST", "50"))
+        self.max_scan_rows = max_scan_rows if max_scan_rows is not None else int(os.getenv("QUERY_MAX_SCAN_ROWS", "10000000"))
+        self.full_scan_rows = full_scan_rows if full_scan_rows is not None else int(os.getenv("QUERY_FULL_SCAN_ROWS", "1000000"))
+        self.plan_check_rows = plan_check_rows if plan_check_rows is not None else int(os.getenv("QUERY_PLAN_CHECK_ROWS", "100000"))
+        self.enabled = enabled if enabled is not None else os.getenv("QUERY_GUARD", "1") != "0"
+        stats_ttl = float(os.getenv("QUERY_GUARD_STATS_TTL", "60"))
+        self._table_rows = LRUCache(maxsize=4, ttl=stats_ttl)     # db_type -> {table: rows}
+        self._plan_costs = LRUCache(maxsize=1024, ttl=stats_ttl)  # canonical SQL -> estimated cost
+
+    def table_rows(self, conn, db_type: str) -> dict:
+        """
+        Returns {table name (lowercase): row count}, from the catalog and cached for QUERY_GUARD_STATS_TTL seconds.
+        """
+        rows = self._table_rows.get(db_type)
+        if rows is not None:
+            return rows
+        cursor = conn.cursor()
+        if db_type == "sqlserver":
+            cursor.execute("SELECT t.name, SUM(p.rows) FROM sys.tables t JOIN sys.partitions p "
+                           "ON p.object_id = t.object_id AND p.index_id IN (0, 1) GROUP BY t.name")
+            rows = {name.lower(): int(count) for name, count in cursor.fetchall()}
+        else:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            rows = {}
+            for (name,) in cursor.fetchall():
+                cursor.execute(f'SELECT COUNT(*) FROM "{name}"')
+                rows[name.lower()] = int(cursor.fetchone()[0])
+        cursor.close()
+        self._table_rows.put(db_type, rows)
+        return rows
+
+    def plan_cost(self, conn, sql: str) -> float:
+        """
+        Returns SQL Server's estimated subtree cost for the query, without running it.
+        """
+        key = canonicalize_sql(sql)
+        cost = self._plan_costs.get(key)
+        if cost is not None:
+            return cost
+        cursor = conn.cursor()
+        cursor.execute("SET SHOWPLAN_XML ON")
+        try:
+            cursor.execute(sql)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.execute("SET SHOWPLAN_XML OFF")
+            cursor.close()
+        costs = [float(cost) for cost in _PLAN_COST.findall(plan or "")]
+        cost = max(costs) if costs else 0.0
+        self._plan_costs.put(key, cost)
+        return cost
+
+    def _reject(self, reason: str, kind: str):
+        metrics.query_guard_total.labels(kind).inc()
+        print(f"Query rejected: {reason}")
+        raise QueryRejected(reason, kind)
+
+    def check(self, conn, sql: str, db_type: str, validated: bool = False):
+        if not self.enabled:
+            return
+        reason = None if validated else check_read_only(sql)
+        if reason:
+            self._reject(reason, "read_only")
+
+        try:
+            table_rows = self.table_rows(conn, db_type)
+        except Exception as e:
+            print(f"Could not read table sizes for the cost check: {e}")
+            table_rows = {}
+        scanned, unfiltered = estimate_scan(sql, table_rows)
+        if scanned > self.max_scan_rows:
+            self._reject(f"an estimated {scanned:,} rows would be scanned (limit {self.max_scan_rows:,})", "cost")
+        if unfiltered is not None and table_rows.get(unfiltered, 0) > self.full_scan_rows:
+            self._reject(f"unfiltered scan of {unfiltered} ({table_rows[unfiltered]:,} rows) without a selective "
+                         f"WHERE, TOP or LIMIT", "cost")
+
+        if db_type == "sqlserver" and self.max_cost > 0 and scanned > self.plan_check_rows:
+            try:
+                cost = self.plan_cost(conn, sql)
+            except Exception as e:
+                print(f"Could not estimate the query plan cost: {e}")
+                return
+            if cost > self.max_cost:
+                self._reject(f"estimated plan cost {cost:.1f} exceeds the budget of {self.max_cost:g}", "cost")
+
+    @contextmanager
+    def limit(self, conn, cancel: CancelToken = None):
+        """
+        Runs the block with a statement timeout of `timeout` seconds (0 = none) and lets `cancel` stop it.
+        On SQL Server, also pass the cursor to bind_cursor() so `cancel` can reach the running statement.
+        """
+        if hasattr(conn, "set_progress_handler"):
+            # SQLite: the handler runs every 1000 VM instructions; a non-zero return aborts the statement
+            deadline = time.monotonic() + self.timeout if self.timeout > 0 else None
+            conn.set_progress_handler(
+                lambda: int((cancel is not None and cancel.cancelled) or (deadline is not None and time.monotonic() > deadline)),
+                1000)
+            if cancel is not None:
+                cancel.bind(conn.interrupt)
+            try:
+                yield
+            finally:
+                if cancel is not None:
+                    cancel.unbind()
+                conn.set_progress_handler(None, 0)
+            return
+
+        previous = getattr(conn, "timeout", 0)
+        if self.timeout > 0:
+            conn.timeout = max(1, math.ceil(self.timeout))  # pyodbc: whole seconds, enforced by the driver
+        try:
+            yield
+        finally:
+            if cancel is not None:
+                cancel.unbind()
+            conn.timeout = previous
+
+    def bind_cursor(self, cursor, cancel: CancelToken = None):
+        # pyodbc cursors can be cancelled from another thread (SQLCancel)
+        if cancel is not None and hasattr(cursor, "cancel"):
+            cancel.bind(cursor.cancel)
+
+    @staticmethod
+    def is_timeout(error: Exception) -> bool:
+        text = str(error).lower()
+        return any(marker in text for marker in _TIMEOUT_ERRORS)
+
+
+query_guard = QueryGuard()
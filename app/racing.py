@@ -0,0 +1,217 @@
+"""
+"race" mode: one question is sent to several models and the first valid SQL wins.
+- RACE_MODELS lists the racing models in order of preference; GPT models race only with an API key.
+- RACE_HEDGE_MS = 0 starts all models at once; otherwise the next model starts only when the previous
+  ones have not produced a valid query within that many milliseconds (or all of them failed).
+- Each candidate is validated as soon as it arrives (parses as a single SELECT on the Weather schema, see
+  app.sql_validator, is read-only, within the query guard's cost budget and compiles on the database
+  without running) and the first valid one is used; when several finish together, the one listed first
+  in RACE_MODELS wins. The winning query is executed without being validated again.
+- The other candidates are cancelled: async requests are aborted and queued seq2seq prompts dropped;
+  in the sync pipeline, models already running finish in the background and only fill the SQL cache.
+- RACE_TIMEOUT_SECONDS bounds the whole race.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from app.database import get_pool
+from app.query_guard import query_guard, QueryRejected
+from app.sql_validator import sql_validator
+from app import metrics
+
+RACE_MODEL = "race"
+
+race_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RACE_WORKERS", "8")), thread_name_prefix="nl2sql-race")
+
+
+def get_race_models(api_key: str = None) -> list:
+    models = [model.strip() for model in os.getenv("RACE_MODELS", "phi3:mini,gpt-4o-mini,mistral").split(",") if model.strip()]
+    if not (api_key or "").strip():
+        models = [model for model in models if "gpt" not in model.lower()]
+    return models
+
+
+def get_hedge_delay() -> float:
+    return float(os.getenv("RACE_HEDGE_MS", "0")) / 1000
+
+
+def get_race_timeout() -> float:
+    return float(os.getenv("RACE_TIMEOUT_SECONDS", "60"))
+
+
+def compile_sql(conn, sql: str, db_type: str):
+    """
+    Compiles the query on the database without running it; raises if it does not compile
+    (syntax errors, unknown tables or columns).
+    """
+    cursor = conn.cursor()
+    try:
+        if db_type == "sqlserver":
+            cursor.execute("SET NOEXEC ON")
+            try:
+                cursor.execute(sql)
+            finally:
+                cursor.execute("SET NOEXEC OFF")
+        else:
+            cursor.execute(f"EXPLAIN {sql}")
+    finally:
+        cursor.close()
+
+
+def validate_sql(sql: str, db_type: str) -> str:
+    """
+    Returns why a candidate query cannot be used, or None if it is valid.
+    """
+    if not sql or sql.startswith(("-- Error", "Error generating SQL")):
+        return (sql or "no SQL query found").replace("-- Error: ", "", 1)
+    _, reason = sql_validator.validate(sql, db_type)
+    if reason is not None:
+        return f"invalid SQL ({reason})"
+    try:
+        with get_pool().connection() as conn:
+            try:
+                query_guard.check(conn, sql, db_type, validated=sql_validator.enabled)
+            except QueryRejected as e:
+                return str(e)
+            try:
+                compile_sql(conn, sql, db_type)
+            except Exception as e:
+                return f"does not compile: {e}"
+    except Exception as e:
+        return f"could not validate: {e}"
+    return None
+
+
+def no_winner_error(attempts: list) -> str:
+    reasons = "; ".join(f"{attempt['model']}: {attempt['reason']}" for attempt in attempts if attempt.get("reason"))
+    return f"-- Error: no valid SQL from the race models ({reasons or 'none available'})"
+
+
+def race_outcome(winner: str, sql: str, attempts: list, race_details: dict) -> tuple:
+    """
+    Records the race in `race_details` and returns (sql, winner); the sql is an "-- Error" string
+    and the winner None when no model produced a valid query.
+    """
+    race_details.update({"winner": winner, "attempts": attempts})
+    if winner is None:
+        return no_winner_error(attempts), None
+    return sql, winner
+
+
+def _record(attempts: list, model: str, started: float, sql: str = None, reason: str = None, status: str = None):
+    attempts.append({
+        "model": model,
+        "seconds": time.perf_counter() - started,
+        "status": status or ("valid" if reason is None else "invalid"),
+        "sql": sql,
+        "reason": reason,
+    })
+
+
+def _preferred(models: list, valid: list) -> tuple:
+    """
+    Returns the (model, sql) of the valid candidates that comes first in `models` (the RACE_MODELS order).
+    """
+    return min(valid, key=lambda candidate: models.index(candidate[0]))
+
+
+def _finish(winner: str, sql: str, attempts: list) -> tuple:
+    if winner is not None:
+        metrics.race_wins_total.labels(metrics.model_label(winner)).inc()
+        seconds = next(attempt["seconds"] for attempt in attempts if attempt["model"] == winner)
+        print(f"Race won by {winner} in {seconds:.2f}s")
+    return winner, sql, attempts
+
+
+def race(models: list, candidate, hedge_delay: float = None, timeout: float = None) -> tuple:
+    """
+    Runs `candidate(model)` -> (sql, reason or None) for the models on worker threads, staggered by
+    `hedge_delay` seconds, and returns (winning model, sql, attempts) as soon as one returns a valid query
+    (the earliest in `models` of those that finished at the same time);
+    (None, None, attempts) if none did within `timeout`. `attempts` lists every model that finished or was
+    cancelled, with its seconds, status, sql and reason.
+    """
+    hedge_delay = get_hedge_delay() if hedge_delay is None else hedge_delay
+    deadline = time.perf_counter() + (get_race_timeout() if timeout is None else timeout)
+    attempts, running = [], {}
+    queue = list(models)
+
+    def launch():
+        model = queue.pop(0)
+        running[race_executor.submit(candidate, model)] = (model, time.perf_counter())
+
+    try:
+        while queue or running:
+            if queue and (not running or hedge_delay <= 0):
+                launch()
+                continue
+            last_launch = max(started for _, started in running.values())
+            wait_until = min(deadline, last_launch + hedge_delay) if queue else deadline
+            done, _ = wait(running, timeout=max(0.0, wait_until - time.perf_counter()), return_when=FIRST_COMPLETED)
+            valid = []
+            for future in done:
+                model, started = running.pop(future)
+                try:
+                    sql, reason = future.result()
+                except Exception as e:
+                    sql, reason = None, f"failed: {e}"
+                _record(attempts, model, started, sql, reason)
+                if reason is None:
+                    valid.append((model, sql))
+            if valid:
+                return _finish(*_preferred(models, valid), attempts)
+            if time.perf_counter() >= deadline:
+                break
+            if queue and not done:
+                launch()  # Hedge: the running models missed the deadline
+    finally:
+        for future, (model, started) in running.items():
+            future.cancel()
+            _record(attempts, model, started, reason="cancelled", status="cancelled")
+    return _finish(None, None, attempts)
+
+
+async def race_async(models: list, candidate, hedge_delay: float = None, timeout: float = None) -> tuple:
+    """
+    Async counterpart of race(): `candidate(model)` is a coroutine function, the losers' tasks are cancelled.
+    """
+    hedge_delay = get_hedge_delay() if hedge_delay is None else hedge_delay
+    deadline = time.perf_counter() + (get_race_timeout() if timeout is None else timeout)
+    attempts, running = [], {}
+    queue = list(models)
+
+    def launch():
+        model = queue.pop(0)
+        running[asyncio.ensure_future(candidate(model))] = (model, time.perf_counter())
+
+    try:
+        while queue or running:
+            if queue and (not running or hedge_delay <= 0):
+                launch()
+                continue
+            last_launch = max(started for _, started in running.values())
+            wait_until = min(deadline, last_launch + hedge_delay) if queue else deadline
+            done, _ = await asyncio.wait(running, timeout=max(0.0, wait_until - time.perf_counter()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            valid = []
+            for task in done:
+                model, started = running.pop(task)
+                try:
+                    sql, reason = task.result()
+                except Exception as e:
+                    sql, reason = None, f"failed: {e}"
+                _record(attempts, model, started, sql, reason)
+                if reason is None:
+                    valid.append((model, sql))
+            if valid:
+                return _finish(*_preferred(models, valid), attempts)
+            if time.perf_counter() >= deadline:
+                break
+            if queue and not done:
+                launch()  # Hedge: the running models missed the deadline
+    finally:
+        for task, (model, started) in running.items():
+            task.cancel()
+            _record(attempts, model, started, reason="cancelled", status="cancelled")
+    return _finish(None, None, attempts)
@@ -0,0 +1,115 @@
+"""
+Bounded fetching and compact summaries of query results.
+- fetch_rows reads the cursor with fetchmany and stops at RESULT_MAX_ROWS rows or RESULT_MAX_BYTES
+  (estimated from the values' text length), so a `SELECT *` on a big table cannot exhaust memory.
+- summarize_rows keeps the "value, value; value, value" summary for small results; larger ones are
+  sampled and described by per-column aggregates, so the answer prompt stays within the model's context.
+"""
+import os
+from decimal import Decimal
+
+FETCH_BATCH_SIZE = 100
+
+
+class ResultRows(list):
+    """
+    Fetched rows (as tuples), plus:
+    - `truncated`: True if the query returned more rows than were fetched,
+    - `columns`: the column names from the cursor description (may be empty).
+    """
+
+    def __init__(self, rows=(), truncated: bool = False, columns: list = None):
+        super().__init__(rows)
+        self.truncated = truncated
+        self.columns = list(columns or [])
+
+    def copy(self) -> "ResultRows":
+        return ResultRows(self, self.truncated, self.columns)
+
+
+def get_max_rows() -> int:
+    return int(os.getenv("RESULT_MAX_ROWS", "1000"))
+
+
+def get_max_bytes() -> int:
+    return int(os.getenv("RESULT_MAX_BYTES", "1000000"))
+
+
+def _row_size(row) -> int:
+    return sum(len(str(value)) for value in row) + len(row)
+
+
+def fetch_rows(cursor, max_rows: int = None, max_bytes: int = None) -> ResultRows:
+    """
+    Fetches at most `max_rows` rows / `max_bytes` of values from an executed cursor.
+    The first row is always kept, even if it alone exceeds the byte budget.
+    """
+    max_rows = get_max_rows() if max_rows is None else max_rows
+    max_bytes = get_max_bytes() if max_bytes is None else max_bytes
+    columns = [column[0] for column in cursor.description or []]
+
+    rows, size, truncated = [], 0, False
+    while not truncated:
+        # One row more than the cap, to tell "exactly max_rows" from "more than max_rows"
+        batch = cursor.fetchmany(min(FETCH_BATCH_SIZE, max_rows + 1 - len(rows)))
+        if not batch:
+            break
+        for row in batch:
+            size += _row_size(row)
+            if len(rows) >= max_rows or (rows and size > max_bytes):
+                truncated = True
+                break
+            rows.append(tuple(row))
+    return ResultRows(rows, truncated, columns)
+
+
+def _format_rows(rows) -> str:
+    return "; ".join(", ".join(map(str, row)) for row in rows)
+
+
+def _format_number(value) -> str:
+    return f"{float(value):.2f}".rstrip("0").rstrip(".")
+
+
+def _describe_columns(rows, columns: list) -> list:
+    descriptions = []
+    for index in range(max(len(row) for row in rows)):
+        name = columns[index] if index < len(columns) else f"column {index + 1}"
+        values = [row[index] for row in rows if index < len(row) and row[index] is not None]
+        numbers = [value for value in values if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)]
+        if numbers and len(numbers) == len(values):
+            descriptions.append(f"{name}: min {_format_number(min(numbers))}, max {_format_number(max(numbers))}, "
+                                f"avg {_format_number(sum(map(float, numbers)) / len(numbers))}")
+        elif values:
+            distinct = {str(value) for value in values}
+            descriptions.append(f"{name}: {len(distinct)} distinct")
+    return descriptions
+
+
+def summarize_rows(rows, max_rows: int = None, max_chars: int = None) -> str:
+    """
+    Returns the rows as "value, value; value, value" if they fit in `max_rows` (RESULT_SUMMARY_MAX_ROWS)
+    and `max_chars` (RESULT_SUMMARY_MAX_CHARS); otherwise the first rows that fit, followed by the
+    row count and min/max/avg (numbers) or distinct counts (text) per column.
+    """
+    max_rows = int(os.getenv("RESULT_SUMMARY_MAX_ROWS", "50")) if max_rows is None else max_rows
+    max_chars = int(os.getenv("RESULT_SUMMARY_MAX_CHARS", "4000")) if max_chars is None else max_chars
+    truncated = getattr(rows, "truncated", False)
+
+    full = _format_rows(rows) if len(rows) <= max_rows else None
+    if full is not None and len(full) <= max_chars and not truncated:
+        return full
+
+    sample, length = [], 0
+    for row in rows[:max_rows]:
+        length += len(_format_rows([row])) + 2
+        if sample and length > max_chars // 2:
+            break
+        sample.append(row)
+
+    count = f"{len(rows)}+" if truncated else str(len(rows))
+    notes = [f"first {len(sample)} of {count} rows"]
+    if truncated:
+        notes.append("result truncated")
+    notes.extend(_describe_columns(rows, getattr(rows, "columns", [])))
+    return f"{_format_rows(sample)} ({'; '.join(notes)})"
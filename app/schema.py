@@ -0,0 +1,72 @@
+import os
+import re
+import threading
+
+WEATHER_TABLE = "Weather"
+WEATHER_COLUMNS = ["City", "Temperature", "Weather", "Climate"]
+TEXT_COLUMNS = ["City", "Weather", "Climate"]
+
+INIT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "init_db.sql")
+
+_SEED_ROW_PATTERN = re.compile(r"\(\s*'((?:[^']|'')*)'\s*,\s*(-?\d+)\s*,\s*'((?:[^']|'')*)'\s*,\s*'((?:[^']|'')*)'\s*\)")
+
+_schema_values = None
+_schema_values_lock = threading.Lock()
+
+
+def load_seed_rows(path: str = INIT_DB_PATH) -> list:
+    """
+    Parses the (City, Temperature, Weather, Climate) rows inserted by init_db.sql.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            script = f.read()
+    except OSError:
+        return []
+    return [
+        (city.replace("''", "'"), int(temperature), weather.replace("''", "'"), climate.replace("''", "'"))
+        for city, temperature, weather, climate in _SEED_ROW_PATTERN.findall(script)
+    ]
+
+
+def _values_from_rows(rows) -> dict:
+    values = {column: set() for column in TEXT_COLUMNS}
+    for city, _, weather, climate in rows:
+        values["City"].add(city)
+        values["Weather"].add(weather)
+        values["Climate"].add(climate)
+    return {column: sorted(v for v in vals if v) for column, vals in values.items()}
+
+
+def _load_schema_values() -> dict:
+    from app.database import get_pool
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT City, Temperature, Weather, Climate FROM {WEATHER_TABLE}")
+            rows = cursor.fetchall()
+            cursor.close()
+        return _values_from_rows(rows)
+    except Exception as e:
+        print(f"Could not load schema values from the database, using init_db.sql: {e}")
+        return _values_from_rows(load_seed_rows())
+
+
+def get_schema_values() -> dict:
+    """
+    Returns the distinct City/Weather/Climate values, loaded once from the
+    database (or from init_db.sql when the database is unavailable).
+    """
+    global _schema_values
+    if _schema_values is None:
+        with _schema_values_lock:
+            if _schema_values is None:
+                _schema_values = _load_schema_values()
+    return _schema_values
+
+
+def refresh_schema_values() -> dict:
+    global _schema_values
+    with _schema_values_lock:
+        _schema_values = _load_schema_values()
+    return _schema_values
@@ -0,0 +1,89 @@
+import os
+import re
+import threading
+from app.cache import LRUCache
+from app.schema import WEATHER_COLUMNS, get_schema_values
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+")
+_WHITESPACE = re.compile(r"\s+")
+
+# Words the questions use that a general English wordlist may not contain
+DOMAIN_WORDS = {"sql", "celsius", "fahrenheit", "avg", "max", "min", "whats"}
+
+
+def normalize_question(question: str) -> str:
+    return _WHITESPACE.sub(" ", question).strip()
+
+
+def load_english_words() -> set:
+    """
+    Loads the English wordlist: SPELLING_WORDLIST (one word per line) if set,
+    otherwise the dictionary bundled with the autocorrect package.
+    """
+    path = os.getenv("SPELLING_WORDLIST")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return {line.strip().lower() for line in f if line.strip()}
+    from autocorrect import Speller
+    return {word.lower() for word in Speller("en").nlp_data}
+
+
+def schema_words() -> set:
+    words = {column.lower() for column in WEATHER_COLUMNS}
+    for values in get_schema_values().values():
+        for value in values:
+            words.update(token.lower() for token in _TOKEN_PATTERN.findall(value))
+    return words
+
+
+class SpellingCorrector:
+    """
+    Spell correction with a vocabulary fast path in front of a slow corrector (LanguageTool).
+    - Questions whose tokens are all known words are returned unchanged.
+    - Otherwise `correct_fn` is called and its result cached per normalized question (LRU).
+    """
+
+    def __init__(self, correct_fn, maxsize: int = None, vocabulary: set = None):
+        self.correct_fn = correct_fn
+        self.cache = LRUCache(maxsize if maxsize is not None else int(os.getenv("SPELLING_CACHE_SIZE", "2048")))
+        self._vocabulary = vocabulary
+        self._lock = threading.Lock()
+        self.fast_path_hits = 0
+        self.slow_path_calls = 0
+
+    @property
+    def vocabulary(self) -> set:
+        if self._vocabulary is None:
+            with self._lock:
+                if self._vocabulary is None:
+                    self._vocabulary = load_english_words() | schema_words() | DOMAIN_WORDS
+        return self._vocabulary
+
+    def unknown_tokens(self, question: str) -> list:
+        vocabulary = self.vocabulary
+        # Single letters are left alone ("what's" -> "what", "s")
+        return [token for token in _TOKEN_PATTERN.findall(question)
+                if len(token) > 1 and token.lower() not in vocabulary]
+
+    def correct(self, question: str) -> str:
+        key = normalize_question(question)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        if not self.unknown_tokens(key):
+            self.fast_path_hits += 1
+            corrected = question
+        else:
+            self.slow_path_calls += 1
+            corrected = self.correct_fn(question)
+
+        self.cache.put(key, corrected)
+        return corrected
+
+    def stats(self) -> dict:
+        return {
+            "fast_path_hits": self.fast_path_hits,
+            "slow_path_calls": self.slow_path_calls,
+            "cache": self.cache.stats(),
+        }
@@ -0,0 +1,443 @@
+"""
+Single-pass SQL normalizer for model output.
+
+The text is tokenized once (string literals, quoted identifiers, numbers, words,
+operators, punctuation) and the tokens are rewritten in one left-to-right scan:
+- the statement is extracted from the surrounding prose / markdown,
+- table and column names are canonicalized (identifiers only, never inside literals),
+- bare values after comparison operators are quoted and mapped to known values,
+- LIMIT n <-> TOP n is rewritten for the target dialect,
+- the repairs for the local seq2seq models are applied when `repair=True`.
+"""
+import re
+import string
+
+# Alternatives ordered by frequency; the kind of a token comes from its first char (see _kind)
+_TOKEN_BODY = r"""
+    [A-Za-z_][A-Za-z0-9_]*      # word
+  | '[^']*(?:''[^']*)*'?        # string ('' escapes; may be unterminated)
+  | [<>!]=|<>                   # op (=, < and > alone are matched by \S)
+  | \d+(?:\.\d+)?               # number
+  | "[^"\n]*"?                  # dquote
+  | --[^\n]*                    # comment
+  | \[[^\]\n]*\]                # bracket
+  | `+                          # fence
+  | \S                          # punct
+"""
+_TOKEN_PATTERN = re.compile(r"\s+|" + _TOKEN_BODY, re.VERBOSE | re.DOTALL)
+# (whitespace before the token, token) pairs, so that normalize_sql visits only the tokens themselves
+_SPACED_TOKEN_PATTERN = re.compile(r"(\s*)(" + _TOKEN_BODY + ")", re.VERBOSE | re.DOTALL)
+
+_KINDS = {
+    **dict.fromkeys(string.ascii_letters + "_", "word"),
+    **dict.fromkeys(string.digits, "number"),
+    **dict.fromkeys(" \t\n\r\f\v", "ws"),
+    **dict.fromkeys("(),.;*+/%", "punct"),
+    "'": "string", '"': "dquote", "`": "fence", "=": "op", "<": "op", ">": "op",
+}
+# First chars that are punctuation on their own but start a longer token
+_PREFIX_KINDS = {"-": "comment", "[": "bracket", "!": "op"}
+
+TABLE_NAMES = {"table": "Weather", "weather": "Weather"}
+
+COLUMN_NAMES = {
+    "location": "City",
+    "city": "City",
+    "weather": "Weather",
+    "climate": "Climate",
+    "temperature": "Temperature",
+}
+
+# Extra column aliases produced by the local seq2seq models
+REPAIR_COLUMN_NAMES = {**COLUMN_NAMES, "ethical": "Weather"}
+
+# Values the models use that do not exist in the data
+VALUE_NAMES = {
+    "rain": "rainy",
+    "raining": "rainy",
+    "drizzly": "drizzle",
+    "sky clear": "clear",
+}
+
+AGGREGATES = {"avg", "max", "min", "sum", "count"}
+
+COMPARISON_WORDS = {"like"}
+
+# Tokens after which a bare value is quoted
+_VALUE_PREVIOUS = {"=", "!=", "<>", "<", ">", "<=", ">="} | COMPARISON_WORDS
+
+# Words that can legitimately start a continuation line of a query, or follow a comparison
+SQL_KEYWORDS = {
+    "select", "from", "where", "and", "or", "not", "in", "is", "null", "like", "between",
+    "group", "order", "by", "having", "limit", "offset", "fetch", "next", "first", "rows", "only",
+    "top", "distinct", "all", "any", "some", "exists", "as", "asc", "desc", "on", "join", "inner",
+    "left", "right", "outer", "full", "cross", "union", "except", "intersect", "case", "when",
+    "then", "else", "end", "with", "true", "false", "escape", "percent", "ties",
+    "avg", "max", "min", "sum", "count", "round", "cast", "coalesce", "isnull", "upper", "lower",
+    "len", "length", "trim", "ltrim", "rtrim",
+}
+
+# Tokens that need an operand after them: a line break after one continues the query
+_CONTINUATIONS = {
+    "select", "from", "where", "and", "or", "not", "by", "join", "on", "in", "like", "between", "is", "as",
+    "having", "distinct", "top", "union", "all", "case", "when", "then", "else",
+    ",", "(", "=", "!=", "<>", "<", ">", "<=", ">=", "+", "-", "/",
+}
+
+# Words with their own branch in normalize_sql
+_SPECIAL_WORDS = {"select", "top", "limit", "join"}
+
+_SEQ2SEQ_ALIAS = re.compile(r"t\d+$", re.IGNORECASE)
+# Prefer a SELECT that starts a line (optionally after "A:"), otherwise take the first one
+_STATEMENT_START_LINE = re.compile(r"^[ \t]*(?:A:[ \t]*)?(select\s)", re.IGNORECASE | re.MULTILINE)
+_STATEMENT_START = re.compile(r"\bselect\s", re.IGNORECASE)
+# A code fence ends the statement, and so does a blank line outside a literal or an unfinished clause
+_STATEMENT_END = re.compile(r"```|\n[ \t]*\n")
+_LAST_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def _kind(token: str) -> str:
+    first = token[0]
+    kind = _KINDS.get(first)
+    if kind is not None:
+        return kind
+    if first.isspace():
+        return "ws"
+    if first.isdecimal():
+        return "number"
+    return _PREFIX_KINDS[first] if len(token) > 1 else "punct"
+
+
+def tokenize(sql: str) -> list:
+    """
+    Splits SQL into (kind, text) tokens; kinds are ws, comment, string, dquote, bracket, number, word,
+    op, fence and punct (see _TOKEN_PATTERN).
+    """
+    kinds = _KINDS
+    return [(kinds.get(token[0]) or _kind(token), token) for token in _TOKEN_PATTERN.findall(sql)]
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Returns a canonical form of a query for use as a cache key:
+    - whitespace collapsed, comments and trailing ';' removed,
+    - everything outside string literals lowercased (identifiers/keywords are case-insensitive),
+    - string literals left untouched.
+    """
+    parts = []
+    for kind, text in tokenize(sql.strip()):
+        if kind == "ws":
+            parts.append(" ")
+        elif kind == "string":
+            parts.append(text)
+        elif kind != "comment":
+            parts.append(text.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _next_significant(tokens: list, i: int) -> int:
+    # `tokens` are (whitespace, token) pairs from _SPACED_TOKEN_PATTERN; skips comments
+    while i < len(tokens) and tokens[i][1].startswith("--"):
+        i += 1
+    return i
+
+
+def _is_word(token: str) -> bool:
+    return _KINDS.get(token[0]) == "word"
+
+
+def _last_token(text: str) -> str:
+    words = text.rsplit(None, 1)
+    return _LAST_TOKEN.findall(words[-1])[-1].lower() if words else ""
+
+
+def _statement_end(text: str, start: int) -> int:
+    """
+    Returns where the statement starting at `start` ends: at a code fence, or at a blank line that is not
+    inside a string literal, an open parenthesis or a clause still waiting for its operand.
+    """
+    for match in _STATEMENT_END.finditer(text, start):
+        if text[match.start()] == "`":
+            return match.start()
+        head = text[start:match.start()]
+        if head.count("'") % 2 == 0 and head.count("(") <= head.count(")") \
+                and _last_token(head) not in _CONTINUATIONS:
+            return match.start()
+    return len(text)
+
+
+def _ends_statement(ws: str, token: str, column_names: dict, prev: str, depth: int) -> bool:
+    # A blank line, or a new line starting with prose, ends the query; not while a parenthesis is open
+    # or the previous token still waits for its operand ("FROM", "=", "AND", ",")
+    if depth > 0 or prev in _CONTINUATIONS:
+        return False
+    if ws.count("\n") >= 2:
+        return True
+    if _is_word(token):
+        word = token.lower()
+        return word not in SQL_KEYWORDS and word not in column_names and word not in TABLE_NAMES
+    return False
+
+
+def _map_literal(text: str) -> str:
+    # 'rain' -> 'rainy', '%rain%' -> '%rainy%'
+    content = text[1:-1] if len(text) > 1 and text.endswith("'") else text[1:]
+    core = content.strip("%")
+    mapped = VALUE_NAMES.get(core.lower())
+    if mapped is None:
+        return text
+    return "'" + content.replace(core, mapped) + "'"
+
+
+def normalize_sql(text: str, db_type: str = None, repair: bool = False, extract: bool = True) -> str:
+    """
+    Normalizes model output into a query in a single scan over its tokens.
+    - `extract`: start at the first 'SELECT ' and stop at ';', a code fence, a blank line or a prose line
+      (but not inside a string literal, an open parenthesis or after a token that needs an operand).
+    - `db_type`: 'sqlserver' rewrites LIMIT n to TOP n, 'sqlite' rewrites TOP n to LIMIT n, None leaves both.
+    - `repair`: also fix the typical mistakes of the local seq2seq models.
+    Returns None if `extract` is set and there is no SELECT.
+    """
+    if extract:
+        # Only the text from the first SELECT on is tokenized, so quotes in the prose cannot confuse it
+        match = _STATEMENT_START_LINE.search(text)
+        if match:
+            start = match.start(1)
+        else:
+            match = _STATEMENT_START.search(text)
+            if not match:
+                return None
+            start = match.start()
+        text = text[start:_statement_end(text, start)]
+    tokens = _SPACED_TOKEN_PATTERN.findall(text)
+    i = 0
+
+    kinds = _KINDS
+    column_names = REPAIR_COLUMN_NAMES if repair else COLUMN_NAMES
+    out = []
+    depth = 0
+    top_slots = {}        # depth -> index in `out` where "TOP n" goes for that depth's SELECT
+    pending_limits = {}   # depth -> "LIMIT n" to emit when that depth's SELECT ends
+    prev = ""             # previous significant token, lowercased
+    saw_from = saw_column = False
+    clause_index = None   # where a missing "FROM Weather" is inserted
+    n = len(tokens)
+
+    def emit_space():
+        if out and out[-1] != " ":
+            out.append(" ")
+
+    def flush_limit(level):
+        limit = pending_limits.pop(level, None)
+        if limit is not None:
+            emit_space()
+            out.append(f"LIMIT {limit}")
+
+    while i < n:
+        ws, token = tokens[i]
+        if ws:
+            if extract and "\n" in ws and _ends_statement(ws, token, column_names, prev, depth):
+                break
+            if out and out[-1] != " ":
+                out.append(" ")
+        kind = kinds.get(token[0]) or _kind(token)
+        i += 1
+
+        if kind == "word":
+            lower = token.lower()
+
+            if lower in _SPECIAL_WORDS:
+                if lower == "select":
+                    out.append(token)
+                    prev = lower
+                    j = _next_significant(tokens, i)
+                    if j < n and tokens[j][1].lower() in ("distinct", "all"):
+                        emit_space()
+                        out.append(tokens[j][1])
+                        i = j + 1
+                    top_slots[depth] = len(out)
+                    out.append("")  # placeholder for "TOP n"
+                    continue
+
+                if lower == "top" and prev == "select":
+                    j = _next_significant(tokens, i)
+                    if db_type == "sqlite" and j < n and kinds.get(tokens[j][1][0]) == "number":
+                        pending_limits[depth] = tokens[j][1]
+                        i = j + 1
+                        continue
+                    top_slots[depth] = None  # Already has a TOP; a later LIMIT is dropped
+
+                elif lower == "limit":
+                    j = _next_significant(tokens, i)
+                    k = _next_significant(tokens, j + 1)
+                    has_offset = k < n and tokens[k][1].lower() in (",", "offset")
+                    if db_type == "sqlserver" and j < n and kinds.get(tokens[j][1][0]) == "number" \
+                            and depth in top_slots and not has_offset:
+                        if top_slots[depth] is not None:
+                            out[top_slots[depth]] = f" TOP {tokens[j][1]}"
+                        i = j + 1
+                        continue
+
+                elif repair and lower == "join":
+                    # Drop "JOIN it AS t1 ON ..." up to the next WHERE/JOIN
+                    j = _next_significant(tokens, i)
+                    if j < n and tokens[j][1].lower() == "it":
+                        k = j + 1
+                        while k < n and tokens[k][1].lower() not in ("where", "join", ";"):
+                            k += 1
+                        i = k
+                        continue
+
+            if repair:
+                if _SEQ2SEQ_ALIAS.match(token) and i < n and tokens[i] == ("", "."):
+                    # t1.City -> City
+                    i += 1
+                    continue
+
+                if lower in AGGREGATES:
+                    # AVG Temperature -> AVG(Temperature)
+                    j = _next_significant(tokens, i)
+                    if j < n and (j > i or tokens[j][0]) and _is_word(tokens[j][1]) \
+                            and tokens[j][1].lower() not in SQL_KEYWORDS:
+                        argument = column_names.get(tokens[j][1].lower(), tokens[j][1])
+                        saw_column = saw_column or argument in column_names.values()
+                        out.append(f"{token}({argument})")
+                        prev = ")"
+                        i = j + 1
+                        continue
+
+            if lower in TABLE_NAMES and prev in ("from", "join"):
+                out.append(TABLE_NAMES[lower])
+                prev = lower
+                continue
+
+            if lower in column_names:
+                out.append(column_names[lower])
+                saw_column = True
+                prev = lower
+                continue
+
+            if prev in _VALUE_PREVIOUS and lower not in SQL_KEYWORDS \
+                    and not (i < n and tokens[i] in (("", "("), ("", "."))):
+                # Bare value after a comparison: collect the phrase and quote it
+                words = [token]
+                k = i
+                while k < n and tokens[k][0] and "\n" not in tokens[k][0] and _is_word(tokens[k][1]):
+                    following = tokens[k][1].lower()
+                    if following in SQL_KEYWORDS or following in column_names:
+                        break
+                    words.append(tokens[k][1])
+                    k += 1
+                phrase = " ".join(words)
+                phrase = VALUE_NAMES.get(phrase.lower(), phrase)
+                out.append("'" + phrase.replace("'", "''") + "'")
+                prev = "'"
+                i = k
+                continue
+
+            if lower == "from":
+                saw_from = True
+            elif depth == 0 and clause_index is None and lower in ("where", "group", "order", "having"):
+                clause_index = len(out)
+            out.append(token)
+            prev = lower
+            continue
+
+        if kind == "punct":
+            if token == ";" and depth == 0:
+                break
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                flush_limit(depth)
+                depth = max(depth - 1, 0)
+                if out and out[-1] == " ":
+                    out.pop()
+            out.append(token)
+            prev = token
+            continue
+
+        if kind == "op":
+            out.append(token)
+            prev = token
+            continue
+
+        if kind == "string":
+            out.append(_map_literal(token))
+            prev = "'"
+            continue
+
+        if kind == "dquote":
+            if repair:
+                # "value" -> 'value'
+                token = _map_literal("'" + token.strip('"').replace("'", "''") + "'")
+            out.append(token)
+            prev = "'" if repair else token.lower()
+            continue
+
+        if kind == "number":
+            out.append(token)
+            if prev in _VALUE_PREVIOUS:
+                # "= 20 degrees" -> "= 20"
+                j = _next_significant(tokens, i)
+                if j < n and tokens[j][1].lower() in ("degrees", "degree", "celsius"):
+                    i = j + 1
+            prev = token
+            continue
+
+        if kind == "bracket":
+            out.append(token)
+            prev = token.lower()
+            continue
+
+        if kind == "fence" and extract:
+            break
+        # Comments and (without `extract`) fences are dropped
+
+    if not saw_from and saw_column:
+        if clause_index is not None:
+            out.insert(clause_index, "FROM Weather ")
+        else:
+            emit_space()
+            out.append("FROM Weather")
+    flush_limit(0)
+
+    return "".join(out).strip().rstrip(";").strip()
+
+
+# SQL Server functions that SQLite spells differently
+SQLITE_FUNCTIONS = {"len": "LENGTH", "isnull": "IFNULL", "count_big": "COUNT"}
+
+_SQLSERVER_SYNTAX = re.compile(r"\b(?:top|len|isnull|count_big)\b|\bN'", re.IGNORECASE)
+
+
+def to_sqlite(sql: str) -> str:
+    """
+    Translates the SQL Server syntax left in a query for execution on SQLite:
+    - TOP n -> LIMIT n,
+    - LEN / ISNULL / COUNT_BIG -> LENGTH / IFNULL / COUNT,
+    - N'...' literals -> '...'.
+    Queries without any of these are returned unchanged.
+    """
+    if not _SQLSERVER_SYNTAX.search(sql):
+        return sql
+    tokens = tokenize(sql)
+    out = []
+    has_top = False
+    for i, (kind, text) in enumerate(tokens):
+        lower = text.lower()
+        if kind == "word":
+            if lower == "n" and i + 1 < len(tokens) and tokens[i + 1][0] == "string":
+                continue
+            j = i + 1
+            while j < len(tokens) and tokens[j][0] in ("ws", "comment"):
+                j += 1
+            if lower in SQLITE_FUNCTIONS and j < len(tokens) and tokens[j][1] == "(":
+                out.append(SQLITE_FUNCTIONS[lower])
+                continue
+            has_top = has_top or lower == "top"
+        out.append(text)
+    translated = "".join(out)
+    if has_top:
+        translated = normalize_sql(translated, db_type="sqlite", extract=False)
+    return translated
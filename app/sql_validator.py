@@ -0,0 +1,141 @@
+"""
+Local validation of generated SQL, so invalid model output fails in-process instead of on the database:
+- the query is parsed with sqlglot (T-SQL first, then SQLite), so joins, subqueries, CTEs, set operations,
+  CASE, CAST, window functions, TOP and LIMIT are all understood,
+- anything but a single SELECT, unterminated literals and syntax errors are rejected,
+- tables and columns are checked against the Weather schema (app.schema); names defined by the query
+  itself (aliases, CTEs, derived tables) are accepted,
+- only with rewriting enabled (SQL_VALIDATION_REWRITE=1) the query is transpiled by sqlglot for the target dialect:
+  TOP n <-> LIMIT n, identifier quoting, LEN/LENGTH, ISNULL/IFNULL, STRING_AGG/GROUP_CONCAT, ...
+Functions are not checked: the database reports unknown ones.
+Disabled with SQL_VALIDATION=0.
+"""
+import os
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError, ParseError, TokenError
+from app.cache import LRUCache
+from app.schema import WEATHER_TABLE, WEATHER_COLUMNS
+
+# sqlglot dialect per DB_BACKEND dialect
+DIALECTS = {"sqlserver": "tsql", "sqlite": "sqlite"}
+
+_COLUMNS = {column.lower() for column in WEATHER_COLUMNS}
+
+# Statements and clauses a read query never contains
+_WRITES = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter, exp.Command, exp.Into)
+
+
+class InvalidSQL(Exception):
+    """Raised while parsing or checking a query; the message says what is wrong."""
+
+
+def _syntax_error(error: SqlglotError) -> str:
+    if isinstance(error, TokenError):
+        return "unterminated string or quoted name"
+    if isinstance(error, ParseError) and error.errors:
+        return f"syntax error at line {error.errors[0]['line']}, column {error.errors[0]['col']}"
+    return "syntax error"
+
+
+def parse_sql(sql: str) -> exp.Query:
+    """
+    Parses a single SELECT statement (T-SQL or SQLite syntax); raises InvalidSQL.
+    """
+    error = None
+    for dialect in ("tsql", "sqlite"):
+        try:
+            statements = [statement for statement in sqlglot.parse(sql, read=dialect) if statement is not None]
+            break
+        except SqlglotError as e:
+            error = error or e
+    else:
+        raise InvalidSQL(_syntax_error(error))
+    if len(statements) != 1:
+        raise InvalidSQL("only a single statement is allowed" if statements else "no SQL query found")
+    query = statements[0]
+    if not isinstance(query, exp.Query) or query.find(*_WRITES) is not None:
+        raise InvalidSQL("only SELECT queries are allowed")
+    return query
+
+
+def _defined_names(query: exp.Query) -> tuple:
+    """
+    Returns (table names, column names) the query defines itself: CTEs, table and column aliases.
+    """
+    tables, columns = set(), set()
+    for alias in query.find_all(exp.TableAlias):
+        tables.add(alias.name.lower())
+        columns.update(column.name.lower() for column in alias.columns)
+    for alias in query.find_all(exp.Alias):
+        columns.add(alias.alias.lower())
+    return tables, columns
+
+
+def _check_names(query: exp.Query):
+    tables, columns = _defined_names(query)
+    for table in query.find_all(exp.Table):
+        name = table.name.lower()
+        if name != WEATHER_TABLE.lower() and name not in tables:
+            raise InvalidSQL(f"unknown table '{table.name}'")
+    for column in query.find_all(exp.Column):
+        if column.table and column.table.lower() not in tables | {WEATHER_TABLE.lower()}:
+            raise InvalidSQL(f"unknown table or alias '{column.table}'")
+        name = column.name.lower()
+        if column.is_star or name in _COLUMNS or name in columns:
+            continue
+        raise InvalidSQL(f"unknown column '{column.sql()}'")
+
+
+def _string_for_unknown_dquotes(query: exp.Query, known: set) -> exp.Query:
+    # "Paris" is an identifier in standard SQL but SQLite reads it as a string when no such column exists;
+    # the models mean the string
+    def to_string(node):
+        if isinstance(node, exp.Column) and not node.table and node.this.quoted and node.name.lower() not in known:
+            return exp.Literal.string(node.name)
+        return node
+    return query.transform(to_string)
+
+
+class SQLValidator:
+    """
+    - validate(sql, db_type) returns (sql, None) for a valid query, or (None, reason) for invalid SQL.
+      With `rewrite` (opt-in, SQL_VALIDATION_REWRITE=1) the returned query is transpiled for the
+      dialect; otherwise it is returned as written.
+    - Results are cached per (sql, dialect) (SQL_VALIDATION_CACHE_SIZE).
+    """
+
+    def __init__(self, enabled: bool = None, cache_size: int = None, rewrite: bool = None):
+        self.enabled = enabled if enabled is not None else os.getenv("SQL_VALIDATION", "1") != "0"
+        self.rewrite = rewrite if rewrite is not None else os.getenv("SQL_VALIDATION_REWRITE", "0") == "1"
+        self._results = LRUCache(maxsize=cache_size or int(os.getenv("SQL_VALIDATION_CACHE_SIZE", "1024")))
+
+    def validate(self, sql: str, db_type: str = None) -> tuple:
+        if not self.enabled:
+            return sql, None
+        if not sql or not sql.strip():
+            return None, "no SQL query found"
+        key = (sql, db_type, self.rewrite)
+        result = self._results.get(key)
+        if result is not None:
+            return result
+        try:
+            query = parse_sql(sql)
+            query = _string_for_unknown_dquotes(query, _COLUMNS | _defined_names(query)[1])
+            _check_names(query)
+            rendered = query.sql(dialect=DIALECTS.get(db_type, "sqlite")) if self.rewrite else sql
+            result = (rendered, None)
+        except InvalidSQL as e:
+            result = (None, str(e))
+        except SqlglotError as e:
+            result = (None, _syntax_error(e))
+        except RecursionError:
+            result = (None, "query is nested too deeply")
+        self._results.put(key, result)
+        return result
+
+    def stats(self) -> dict:
+        return self._results.stats()
+
+
+sql_validator = SQLValidator()
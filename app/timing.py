@@ -0,0 +1,16 @@
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def stage_timer(timings: dict, stage: str):
+    """
+    Adds the wall time spent inside the block to timings[stage] (seconds).
+    `timings=None` turns it into a no-op so callers don't have to branch.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
@@ -0,0 +1,201 @@
+"""
+Startup warmup and readiness.
+- Heavy components are created on first use: the LanguageTool JVM, HuggingFace models, the SQLite replica,
+  database connections, the prompt builder's TF-IDF index and the openai package.
+- With WARMUP=1 (the default) the app starts them in background threads right after startup instead of
+  on the first requests: "language_tool", "database" (pool primed with WARMUP_DB_CONNECTIONS connections,
+  dialect detected), then "caches" (schema values, intent patterns, spelling vocabulary, prompt index),
+  "ollama" (WARMUP_OLLAMA_MODELS loaded into Ollama) and "hf" (WARMUP_HF_MODELS loaded into the registry).
+  WARMUP_COMPONENTS limits which ones run; failed ones are retried every WARMUP_RETRY_SECONDS, at most
+  WARMUP_MAX_ATTEMPTS times in all, and are then left degraded (loaded on first use, like lazy ones).
+- readiness() reports each component as lazy (not warmed, loaded on first use), pending, warming, ready,
+  failed (will be retried) or degraded; GET /ready returns it with 503 until every warmed component is
+  ready or degraded, and lists the degraded ones.
+- The import time of the app and the time of each warmup step are kept here and exported as
+  nl2sql_startup_seconds{phase}.
+"""
+import os
+import threading
+import time
+from app import metrics
+
+COMPONENTS = ("language_tool", "database", "caches", "ollama", "hf")
+
+# Each group runs in its own thread; within a group components run in order
+# ("caches" reads the schema values through the connections "database" opened)
+WARMUP_GROUPS = (("database", "caches"), ("language_tool",), ("ollama",), ("hf",))
+
+_state = {name: {"status": "lazy", "seconds": None, "error": None} for name in COMPONENTS}
+_state_lock = threading.Lock()
+_startup = {"import_seconds": None, "warmup_seconds": None}
+
+
+def _model_list(name: str) -> list:
+    return [model.strip() for model in os.getenv(name, "").split(",") if model.strip()]
+
+
+def is_enabled() -> bool:
+    return os.getenv("WARMUP", "1") != "0"
+
+
+def selected_components() -> list:
+    """
+    Returns the components to warm: WARMUP_COMPONENTS (default all), without "ollama"/"hf" when
+    no models are configured for them.
+    """
+    names = [name.strip() for name in os.getenv("WARMUP_COMPONENTS", ",".join(COMPONENTS)).split(",") if name.strip()]
+    if not _model_list("WARMUP_OLLAMA_MODELS"):
+        names = [name for name in names if name != "ollama"]
+    if not _model_list("WARMUP_HF_MODELS"):
+        names = [name for name in names if name != "hf"]
+    return [name for name in COMPONENTS if name in names]
+
+
+def record_import(seconds: float):
+    _startup["import_seconds"] = seconds
+    metrics.startup_seconds.labels("import").set(seconds)
+    print(f"App imported in {seconds:.2f}s")
+
+
+def warm_language_tool():
+    from app.nlp import get_language_tool
+    get_language_tool()
+
+
+def warm_database():
+    from app.database import get_pool
+    from app.nlp import get_db_type
+    pool = get_pool()
+    count = min(int(os.getenv("WARMUP_DB_CONNECTIONS", "2")), pool.max_size)
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(pool.acquire())
+    finally:
+        for conn in connections:
+            pool.release(conn)
+    get_db_type()
+
+
+def warm_caches():
+    from app.schema import get_schema_values
+    from app.intents import intent_matcher
+    from app.prompt_builder import prompt_builder
+    from app.nlp import spelling_corrector
+    get_schema_values()
+    intent_matcher.patterns
+    spelling_corrector.vocabulary
+    if prompt_builder.enabled:
+        prompt_builder.index
+
+
+def warm_ollama():
+    from app.clients import ollama_post
+    from app.nlp import ollama_payload, answer_num_ctx
+    for model in _model_list("WARMUP_OLLAMA_MODELS"):
+        # An empty prompt only loads the model; num_ctx must match the requests' or Ollama reloads it
+        ollama_post("/api/generate", ollama_payload(model, "", 0.0, answer_num_ctx(model, ""), 1))
+        print(f"Loaded Ollama model {model}")
+
+
+def warm_hf():
+    from app.model_registry import model_registry
+    for model in _model_list("WARMUP_HF_MODELS"):
+        model_registry.get(model)
+
+
+_WARMERS = {
+    "language_tool": warm_language_tool,
+    "database": warm_database,
+    "caches": warm_caches,
+    "ollama": warm_ollama,
+    "hf": warm_hf,
+}
+
+
+def _set(name: str, **values):
+    with _state_lock:
+        _state[name].update(values)
+
+
+def _warm(name: str) -> bool:
+    _set(name, status="warming")
+    start = time.perf_counter()
+    try:
+        _WARMERS[name]()
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        _set(name, status="failed", seconds=elapsed, error=str(e))
+        print(f"Warmup of {name} failed after {elapsed:.2f}s: {e}")
+        return False
+    elapsed = time.perf_counter() - start
+    _set(name, status="ready", seconds=elapsed, error=None)
+    metrics.startup_seconds.labels(name).set(elapsed)
+    print(f"Warmed up {name} in {elapsed:.2f}s")
+    return True
+
+
+def warmup(components: list = None):
+    """
+    Warms the components (default selected_components()) and blocks until all are done.
+    """
+    components = selected_components() if components is None else components
+    for name in components:
+        _set(name, status="pending", seconds=None, error=None)
+    start = time.perf_counter()
+
+    retry_seconds = float(os.getenv("WARMUP_RETRY_SECONDS", "10"))
+    max_attempts = max(1, int(os.getenv("WARMUP_MAX_ATTEMPTS", "6")))
+
+    def run_group(group):
+        for name in group:
+            if name not in components:
+                continue
+            # A failed component (e.g. the database is not up yet) is retried; one that keeps failing
+            # (e.g. no Java for LanguageTool) must not keep the app unready forever
+            for attempt in range(1, max_attempts + 1):
+                if _warm(name):
+                    break
+                if attempt == max_attempts or retry_seconds <= 0:
+                    _set(name, status="degraded")
+                    print(f"Gave up warming {name} after {attempt} attempt(s); it is loaded on first use")
+                    break
+                time.sleep(retry_seconds)
+
+    threads = [threading.Thread(target=run_group, args=(group,), name=f"nl2sql-warmup-{group[0]}")
+               for group in WARMUP_GROUPS if any(name in components for name in group)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    _startup["warmup_seconds"] = elapsed
+    metrics.startup_seconds.labels("warmup").set(elapsed)
+    print(f"Warmup finished in {elapsed:.2f}s")
+
+
+def start_warmup() -> threading.Thread:
+    """
+    Runs warmup() in a background thread if WARMUP is enabled, so the server answers /ready meanwhile.
+    """
+    if not is_enabled():
+        return None
+    # Marked pending right away so /ready does not report ready before the thread starts
+    for name in selected_components():
+        _set(name, status="pending")
+    thread = threading.Thread(target=warmup, name="nl2sql-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def readiness() -> dict:
+    """
+    Returns {"ready": ..., "degraded": [names], "components": {name: {"status", "seconds", "error"}},
+    "import_seconds", "warmup_seconds"}. Degraded components (warmup given up) do not hold readiness back.
+    """
+    with _state_lock:
+        components = {name: dict(state) for name, state in _state.items()}
+    ready = all(state["status"] in ("lazy", "ready", "degraded") for state in components.values())
+    degraded = [name for name, state in components.items() if state["status"] == "degraded"]
+    return {"ready": ready, "degraded": degraded, "components": components, **_startup}
@@ -0,0 +1,224 @@
+"""
+Offline end-to-end latency benchmark of the question-answering pipeline.
+
+Runs answer_question (or answer_question_async with --mode async) for the questions in
+tests/questions.py against:
+- tests/fake_llm_server.py, which replays the recorded Ollama/OpenAI outputs from tests/output/*.csv,
+- the embedded SQLite replica of the Weather table seeded from init_db.sql (app.database.SQLiteReplica),
+- the recorded spelling corrections instead of LanguageTool (the vocabulary fast path still runs),
+so no model server, SQL Server or Java is needed. Reports p50/p95/p99 latency and throughput per stage
+(correction, intent, generation, normalization, execution, answer, total) at each concurrency level,
+and saves the numbers as JSON for comparison with a previous run.
+
+Usage: python -m tests.benchmark_pipeline [--models mistral,gpt-4o-mini] [--concurrency 1,4,16]
+           [--repeat 5] [--llm-delay-ms 50] [--latency-scale 0] [--mode sync|async]
+           [--no-intents] [--answer-mode template|llm] [--warm-caches]
+           [--output tests/output/benchmarks/latest.json] [--compare tests/output/benchmarks/baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from tests import questions as question_set
+from tests.fake_llm_server import FakeLLMServer
+
+STAGES = ["correction", "intent", "generation", "normalization", "validation", "execution", "answer", "total"]
+
+
+def configure_pipeline(args, server):
+    """
+    Points the app at the stand-ins and applies the cache / intent / answer settings.
+    """
+    from app.database import ConnectionPool, SQLiteReplica, set_pool
+    from app import nlp
+    from app.intents import intent_matcher
+
+    set_pool(ConnectionPool(connect=SQLiteReplica().start().connect, max_size=max(args.concurrency)))
+    nlp.spelling_corrector.correct_fn = server.responses.correct
+    nlp.reset_db_type()
+    intent_matcher.enabled = not args.no_intents
+    if not args.warm_caches:
+        # Every request goes through every stage
+        for cache in (nlp.sql_cache, nlp.result_cache.cache, nlp.spelling_corrector.cache):
+            cache.maxsize = 0
+            cache.clear()
+
+
+def workload(models: list, repeat: int) -> list:
+    return [(question, model) for _ in range(repeat) for model in models for question in question_set.questions]
+
+
+def run_sync(jobs: list, concurrency: int, args) -> list:
+    from app.nlp import answer_question
+
+    def run(job):
+        question, model = job
+        details = {}
+        start = time.perf_counter()
+        *_, has_error = answer_question(question, model, "benchmark", answer_mode=args.answer_mode, details=details)
+        details["timings"]["total"] = time.perf_counter() - start
+        return details["timings"], bool(has_error)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(run, jobs))
+
+
+_loop = None
+
+
+def run_async(jobs: list, concurrency: int, args) -> list:
+    from app.async_pipeline import answer_question_async
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(job):
+            question, model = job
+            async with semaphore:
+                details = {}
+                start = time.perf_counter()
+                *_, has_error = await answer_question_async(question, model, "benchmark", answer_mode=args.answer_mode, details=details)
+                details["timings"]["total"] = time.perf_counter() - start
+                return details["timings"], bool(has_error)
+
+        return await asyncio.gather(*(run(job) for job in jobs))
+
+    # One loop for all runs, so the shared HTTP clients stay bound to it
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(main())
+
+
+def close_async():
+    from app.async_pipeline import close_http_client
+    if _loop is not None:
+        _loop.run_until_complete(close_http_client())
+        _loop.close()
+
+
+def summarize(samples: list, wall_seconds: float) -> dict:
+    stages = {}
+    for stage in STAGES:
+        durations = np.array([timings[stage] for timings, _ in samples if stage in timings])
+        if not len(durations):
+            continue
+        stages[stage] = {
+            "count": int(len(durations)),
+            "mean_ms": float(durations.mean() * 1000),
+            "p50_ms": float(np.percentile(durations, 50) * 1000),
+            "p95_ms": float(np.percentile(durations, 95) * 1000),
+            "p99_ms": float(np.percentile(durations, 99) * 1000),
+            # Calls one worker can finish per second in this stage
+            "throughput_per_worker": float(len(durations) / durations.sum()) if durations.sum() else None,
+        }
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, has_error in samples if has_error),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(samples) / wall_seconds if wall_seconds else None,
+        "stages": stages,
+    }
+
+
+def print_run(concurrency: int, run: dict):
+    print(f"\nConcurrency {concurrency}: {run['requests']} requests in {run['wall_seconds']:.2f}s "
+          f"({run['throughput_rps']:.1f} req/s, {run['errors']} errors)")
+    print(f"  {'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s/worker':>14}")
+    for stage, stats in run["stages"].items():
+        throughput = f"{stats['throughput_per_worker']:.1f}" if stats["throughput_per_worker"] else "-"
+        print(f"  {stage:<14}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{throughput:>14}")
+
+
+def compare(result: dict, baseline: dict):
+    print(f"\nChange vs. {baseline['config'].get('git_commit') or 'baseline'} (negative = faster):")
+    for concurrency, run in result["runs"].items():
+        base_run = baseline["runs"].get(concurrency)
+        if base_run is None:
+            continue
+        if base_run.get("throughput_rps") and run.get("throughput_rps"):
+            change = (run["throughput_rps"] / base_run["throughput_rps"] - 1) * 100
+            print(f"  concurrency {concurrency}: throughput {change:+.1f}%")
+        for stage, stats in run["stages"].items():
+            base = base_run["stages"].get(stage)
+            if not base:
+                continue
+            deltas = [
+                f"{p} {(stats[f'{p}_ms'] / base[f'{p}_ms'] - 1) * 100:+.1f}%" if base[f"{p}_ms"] else f"{p} n/a"
+                for p in ("p50", "p95", "p99")
+            ]
+            print(f"    {stage:<14}" + "  ".join(deltas))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default="mistral,gpt-4o-mini")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--llm-delay-ms", type=float, default=50.0)
+    parser.add_argument("--latency-scale", type=float, default=0.0)
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--no-intents", action="store_true")
+    parser.add_argument("--answer-mode", choices=["template", "llm"], default=None)
+    parser.add_argument("--warm-caches", action="store_true")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+
+    with FakeLLMServer(delay=args.llm_delay_ms / 1000, latency_scale=args.latency_scale) as server:
+        os.environ["OLLAMA_BASE_URL"] = server.url
+        os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+        configure_pipeline(args, server)
+
+        jobs = workload(models, args.repeat)
+        runner = run_async if args.mode == "async" else run_sync
+        runner(jobs[:len(question_set.questions)], 1, args)  # Warm-up: loads vocabularies, schema values
+
+        result = {
+            "config": {
+                "git_commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "models": models,
+                "questions": len(question_set.questions),
+                "repeat": args.repeat,
+                "mode": args.mode,
+                "llm_delay_ms": args.llm_delay_ms,
+                "latency_scale": args.latency_scale,
+                "intents": not args.no_intents,
+                "answer_mode": args.answer_mode,
+                "warm_caches": args.warm_caches,
+            },
+            "runs": {},
+        }
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            samples = runner(jobs, concurrency, args)
+            run = summarize(samples, time.perf_counter() - start)
+            result["runs"][str(concurrency)] = run
+            print_run(concurrency, run)
+        if args.mode == "async":
+            close_async()
+        print(f"\nFake LLM server handled {server.requests} requests")
+
+    output = args.output or f"tests/output/benchmarks/pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
@@ -0,0 +1,71 @@
+"""
+Startup benchmark: import time of the app and time of each warmup step.
+
+Imports a module (default app.main) in fresh interpreters with `python -X importtime`, reports the
+wall time and the slowest modules by cumulative import time, then optionally runs app.warmup in the
+same way and reports each component's time.
+
+Usage: python -m tests.benchmark_startup [--module app.main] [--repeat 3] [--top 15] [--warmup]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_profile(module: str) -> tuple:
+    """
+    Returns (wall seconds, {module: cumulative import seconds}) of importing `module` in a new interpreter.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|").split("|")]
+        cumulative[name] = int(cumulative_us) / 1e6
+    return wall, cumulative
+
+
+def warmup_profile() -> dict:
+    script = ("import json, os; os.environ['WARMUP_RETRY_SECONDS'] = '0'; import app.main; from app import warmup; "
+              "warmup.warmup(); print(json.dumps(warmup.readiness()))")
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(module: str, repeat: int, top: int, run_warmup: bool):
+    walls, profiles = [], []
+    for _ in range(repeat):
+        wall, cumulative = import_profile(module)
+        walls.append(wall)
+        profiles.append(cumulative)
+
+    print(f"import {module}: median {statistics.median(walls):.3f}s wall over {repeat} runs "
+          f"(interpreter start included), {statistics.median(p.get(module, 0.0) for p in profiles):.3f}s importing")
+    slowest = sorted(profiles[-1].items(), key=lambda item: -item[1])[:top]
+    print(f"{'module':50} {'cumulative s':>12}")
+    for name, seconds in slowest:
+        print(f"{name[:50]:50} {seconds:12.3f}")
+
+    if run_warmup:
+        status = warmup_profile()
+        print(f"\nwarmup: {status['warmup_seconds']:.3f}s, ready={status['ready']}")
+        for name, state in status["components"].items():
+            seconds = f"{state['seconds']:.3f}s" if state["seconds"] is not None else "-"
+            print(f"  {name:15} {state['status']:8} {seconds:>9} {state['error'] or ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--warmup", action="store_true")
+    args = parser.parse_args()
+    main(args.module, args.repeat, args.top, args.warmup)
@@ -1,7 +1,12 @@
+import numpy as np
 import pandas as pd
 import ast
+import json
+import os
 import re
-from app.nlp import execute_sql, generate_sql
+from concurrent.futures import ThreadPoolExecutor
+from app.nlp import execute_sql, generate_sql, get_weather_table_version
+from app.sql_normalizer import canonicalize_sql
 from tests.prompt_templates import prompt_templates_other
 import tests.questions as questions
 
@@ -113,7 +118,92 @@ def repair_sql_query(sql: str) -> str:
 
 
 
-def evaluate_model_outputs(model_outputs_path, ideal_answers_path):
+SEQ2SEQ_MODELS = ["juierror/text-to-sql-with-table-schema", "tscholak/1zha5ono"]
+DEFAULT_SQL_RESULT_CACHE = "tests/output/evaluation_sql_cache.json"
+
+
+def prepare_sql(sql_query, model):
+    """
+    Returns the query that is executed for a model output (None if it contains no SELECT).
+    """
+    if not isinstance(sql_query, str):
+        return None
+    sql = extract_sql_from_response(sql_query)
+    if sql and model in SEQ2SEQ_MODELS:
+        sql = repair_sql_query(sql)
+    return sql
+
+
+def load_sql_result_cache(path, version):
+    """
+    Loads {canonical SQL: {"has_error", "result"}} saved by a previous run, unless the data changed since.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    if saved.get("version") != version:
+        print("Weather data changed since the last evaluation, re-executing all queries")
+        return {}
+    return saved.get("results", {})
+
+
+def save_sql_result_cache(path, version, results):
+    if not path:
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "results": results}, f)
+    os.replace(tmp_path, path)
+
+
+def execute_unique(queries, max_workers):
+    """
+    Executes each query once, in parallel over the connection pool; returns {query: {"has_error", "result"}}.
+    Connection failures are returned but marked so they are not cached.
+    """
+    def run(sql):
+        result, has_error = execute_sql(sql)
+        if has_error:
+            return sql, {"has_error": True, "result": None, "transient": result == ["Error connecting to database"]}
+        return sql, {"has_error": False, "result": normalize_result(result)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(run, queries))
+
+
+def match_results(df):
+    """
+    is_match over the rows, vectorized: every ideal answer is split into its parts, all (distinct result,
+    part) pairs are checked with one numpy substring search, and a result matches a question if all parts
+    of one of its ideal answers were found.
+    """
+    ok = df["status"] == "ok"
+    results = df.loc[ok, ["question", "sql_result"]].drop_duplicates()
+    ideals = df.drop_duplicates("question")[["question", "ideal_answers"]].explode("ideal_answers").dropna()
+    ideals["ideal"] = np.arange(len(ideals))
+    parts = ideals.assign(part=ideals["ideal_answers"].str.split(",")).explode("part")
+    parts["part"] = parts["part"].str.strip().str.lower()
+
+    pairs = results.merge(parts[["question", "ideal", "part"]], on="question")
+    haystack = pairs["sql_result"].str.lower().str.strip().to_numpy(dtype=str)
+    pairs["found"] = np.char.find(haystack, pairs["part"].to_numpy(dtype=str)) >= 0
+    matched = pairs.groupby(["question", "sql_result", "ideal"])["found"].all().groupby(level=[0, 1]).any()
+
+    keys = pd.MultiIndex.from_arrays([df["question"], df["sql_result"]])
+    return ok & pd.Series(matched.reindex(keys, fill_value=False).to_numpy(dtype=bool), index=df.index)
+
+
+def evaluate_model_outputs(model_outputs_path, ideal_answers_path, cache_path=DEFAULT_SQL_RESULT_CACHE, max_workers=None):
+    """
+    Scores every model output against the ideal answers.
+    - Queries are canonicalized and each distinct query is executed once, in parallel (max_workers,
+      default DB_POOL_SIZE).
+    - Query results are cached in `cache_path` (None disables it), so re-runs only execute queries not seen before.
+    """
     # Load data
     df_model = pd.read_csv(model_outputs_path)
     df_ideal = pd.read_csv(ideal_answers_path)
@@ -124,51 +214,58 @@ def evaluate_model_outputs(model_outputs_path, ideal_answers_path):
     # Merge on question
     df = df_model.merge(df_ideal, on="question")
 
-    # Evaluate
-    results = []
-    for _, row in df.iterrows():
-        sql = extract_sql_from_response(row['sql_query'])
-        print(f"Evaluating question: {row['question']}")
-        print("Current results:", results[-1] if results else "No results yet")
-        print("Current row:", row.to_dict())
-        if not sql:
-            results.append({
-                "question": row['question'],
-                "model": row['model'],
-                "prompt_template": row['prompt_template'],
-                "response_time": row.get("response_time", None),
-                "status": "no_sql", "match": False})
-            continue
-
-        if row['model'] == "juierror/text-to-sql-with-table-schema" or row['model'] == "tscholak/1zha5ono":
-            sql_repaired = repair_sql_query(sql)
-        else:
-            sql_repaired = sql
-        result, has_error = execute_sql(sql_repaired)
-        if has_error:
-            results.append({
-                "question": row['question'],
-                "model": row['model'],
-                "prompt_template": row['prompt_template'],
-                "response_time": row.get("response_time", None),
-                "status": "sql_error", "match": False})
-            continue
-
-        result_str = normalize_result(result)
-        match = is_match(result_str, row['ideal_answers'])
-        results.append({
-            "question": row['question'],
-            "model": row['model'],
-            "prompt_template": row['prompt_template'],
-            "response_time": row.get("response_time", None),
-            "sql_query": sql_repaired,
-            "sql_result": result_str,
-            "status": "ok",
-            "match": match
+    # Extract / repair once per distinct (output, model)
+    prepared = {
+        key: prepare_sql(*key)
+        for key in set(zip(df["sql_query"], df["model"]))
+    }
+    df["sql_repaired"] = [prepared[key] for key in zip(df["sql_query"], df["model"])]
+    df["canonical_sql"] = df["sql_repaired"].map(lambda sql: canonicalize_sql(sql) if sql else None)
+
+    try:
+        version = str(get_weather_table_version())
+    except Exception as e:
+        print(f"Could not read the Weather table version, not reusing cached results: {e}")
+        version = None
+    cached = load_sql_result_cache(cache_path, version) if version is not None else {}
+
+    # One representative query per canonical form
+    representatives = df.dropna(subset=["canonical_sql"]).drop_duplicates("canonical_sql")
+    pending = {canonical: sql for canonical, sql in zip(representatives["canonical_sql"], representatives["sql_repaired"])
+               if canonical not in cached}
+    print(f"Rows: {len(df)}, distinct queries: {len(representatives)}, cached: {len(representatives) - len(pending)}, "
+          f"to execute: {len(pending)}")
+
+    executed = execute_unique(list(pending.values()), max_workers or int(os.getenv("DB_POOL_SIZE", "5")))
+    outcomes = dict(cached)
+    for canonical, sql in pending.items():
+        outcomes[canonical] = executed[sql]
+    if version is not None:
+        save_sql_result_cache(cache_path, version, {
+            canonical: outcome for canonical, outcome in outcomes.items() if not outcome.get("transient")
         })
 
+    outcome = df["canonical_sql"].map(lambda canonical: outcomes.get(canonical) if canonical else None)
+    df["status"] = [
+        "no_sql" if o is None else ("sql_error" if o["has_error"] else "ok")
+        for o in outcome
+    ]
+    df["sql_result"] = [o["result"] if o is not None and not o["has_error"] else None for o in outcome]
+    df["match"] = match_results(df)
+
+    ok = df["status"] == "ok"
+    df_results = pd.DataFrame({
+        "question": df["question"],
+        "model": df["model"],
+        "prompt_template": df["prompt_template"],
+        "response_time": df["response_time"] if "response_time" in df else None,
+        "status": df["status"],
+        "match": df["match"],
+        "sql_query": df["sql_repaired"].where(ok),
+        "sql_result": df["sql_result"].where(ok),
+    })
+
     # Summary by model and prompt
-    df_results = pd.DataFrame(results)
     grouped = df_results.groupby(['model', 'prompt_template'])
     summary = grouped.agg(
         accuracy=('match', 'mean'),
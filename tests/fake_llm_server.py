@@ -0,0 +1,249 @@
+"""
+Local stand-in for the Ollama and OpenAI HTTP APIs that replays recorded model outputs.
+
+Responses come from the test runs in tests/output/*.csv: a SQL-generation prompt gets one of the
+recorded `sql_query` texts for that model and question, an answer prompt ("SQL Result:") one of the
+recorded `final_answer` texts. Recorded responses are replayed round-robin, so runs are deterministic.
+
+Endpoints:
+- POST /api/generate            (Ollama, with and without "stream")
+- POST /v1/chat/completions     (OpenAI, with and without "stream")
+
+Usage:
+    with FakeLLMServer(delay=0.05) as server:
+        os.environ["OLLAMA_BASE_URL"] = server.url
+        os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+"""
+import glob
+import itertools
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+
+RECORDED_OUTPUTS = "tests/output/*.csv"
+FALLBACK_SQL = "SELECT City, Temperature, Weather, Climate FROM Weather"
+FALLBACK_ANSWER = "Here is the weather information you asked for."
+
+
+class RecordedResponses:
+    """
+    Recorded (sql_query, final_answer, response_time) per model and question, and the recorded spelling
+    corrections (correct()).
+    """
+
+    def __init__(self, pattern: str = RECORDED_OUTPUTS):
+        frames = [pd.read_csv(path) for path in sorted(glob.glob(pattern))]
+        df = pd.concat(frames, ignore_index=True).drop_duplicates() if frames else pd.DataFrame()
+        self.sql = {}
+        self.answers = {}
+        self.response_times = {}
+        self.questions = set()
+        self.corrections = {}
+        for row in df.itertuples(index=False):
+            if isinstance(row.corrected_question, str):
+                self.corrections.setdefault(str(row.question).lower(), row.corrected_question)
+            for question in {str(row.question), str(row.corrected_question)}:
+                key = (row.model, question.lower())
+                self.questions.add(question)
+                if isinstance(row.sql_query, str):
+                    self.sql.setdefault(key, []).append(row.sql_query)
+                if isinstance(row.final_answer, str):
+                    self.answers.setdefault(key, []).append(row.final_answer)
+                self.response_times.setdefault(key, []).append(float(row.response_time))
+        # Longest first, so "Where is it the hottest?" is not found inside a longer question
+        self._by_length = sorted(self.questions, key=len, reverse=True)
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def correct(self, question: str) -> str:
+        """
+        Returns the recorded correction of a question, or the question itself (a stand-in for LanguageTool).
+        """
+        return self.corrections.get(question.lower(), question)
+
+    def find_question(self, prompt: str) -> str:
+        lowered = prompt.lower()
+        return next((question.lower() for question in self._by_length if question.lower() in lowered), None)
+
+    def _next(self, table: dict, model: str, question: str, fallback: str) -> str:
+        candidates = table.get((model, question))
+        if candidates is None:
+            # Unknown model: replay what any model said for the question
+            candidates = next((values for (_, q), values in table.items() if q == question), None)
+        if not candidates:
+            return fallback
+        with self._lock:
+            cursor = self._cursors.setdefault((id(table), model, question), itertools.count())
+            return candidates[next(cursor) % len(candidates)]
+
+    def respond(self, model: str, prompt: str) -> tuple:
+        """
+        Returns (text, recorded response time) for a prompt.
+        """
+        question = self.find_question(prompt)
+        times = self.response_times.get((model, question), [])
+        recorded_time = sum(times) / len(times) if times else 0.0
+        if "SQL Result:" in prompt:
+            return self._next(self.answers, model, question, FALLBACK_ANSWER), recorded_time
+        return self._next(self.sql, model, question, FALLBACK_SQL), recorded_time
+
+
+def _chunks(text: str) -> list:
+    # Word-sized pieces, like a model streaming tokens
+    pieces = text.split(" ")
+    return [piece + (" " if i < len(pieces) - 1 else "") for i, piece in enumerate(pieces)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: str):
+        encoded = data.encode("utf-8")
+        self.wfile.write(f"{len(encoded):x}\r\n".encode("ascii") + encoded + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "")
+        if self.path.rstrip("/").endswith("/api/generate"):
+            prompt = request.get("prompt", "")
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            prompt = "\n".join(message.get("content") or "" for message in request.get("messages", []))
+        else:
+            self._send_json({"error": f"unknown endpoint {self.path}"}, status=404)
+            return
+
+        text, recorded_time = self.server.responses.respond(model, prompt)
+        self.server.record_request()
+        time.sleep(self.server.delay + self.server.latency_scale * recorded_time)
+
+        if self.path.rstrip("/").endswith("/api/generate"):
+            self._ollama(model, text, bool(request.get("stream")))
+        else:
+            self._openai(model, text, bool(request.get("stream")))
+
+    def _ollama(self, model: str, text: str, stream: bool):
+        if not stream:
+            self._send_json({"model": model, "response": text, "done": True})
+            return
+        self._start_stream("application/x-ndjson")
+        for piece in _chunks(text):
+            self._write_chunk(json.dumps({"model": model, "response": piece, "done": False}) + "\n")
+        self._write_chunk(json.dumps({"model": model, "response": "", "done": True}) + "\n")
+        self._end_stream()
+
+    def _openai(self, model: str, text: str, stream: bool):
+        created = int(time.time())
+        if not stream:
+            self._send_json({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+        self._start_stream("text/event-stream")
+        for piece in _chunks(text) + [None]:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece} if piece is not None else {},
+                             "finish_reason": None if piece is not None else "stop"}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_stream()
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server on localhost serving recorded responses.
+    - `delay`: fixed seconds added to every response.
+    - `latency_scale`: adds this fraction of the recorded response time (0 = as fast as possible).
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, delay: float = 0.0, latency_scale: float = 0.0, responses: RecordedResponses = None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.responses = responses or RecordedResponses()
+        self.delay = delay
+        self.latency_scale = latency_scale
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def record_request(self):
+        with self._count_lock:
+            self.requests += 1
+
+    def handle_error(self, request, client_address):
+        # Clients drop requests they no longer need (e.g. race losers), like with a real server
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--latency-scale", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(port=args.port, delay=args.delay_ms / 1000, latency_scale=args.latency_scale)
+    print(f"Replaying recorded responses on {server.url} (OLLAMA_BASE_URL={server.url}, OPENAI_BASE_URL={server.url}/v1)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
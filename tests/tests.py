@@ -1,5 +1,10 @@
+import argparse
+import json
+import threading
 import time
-from app.nlp import answer_question, generate_sql, execute_sql
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.nlp import answer_question, generate_sql, execute_sql, sql_cache
+from app.intents import intent_matcher
 from app.database import get_db_connection
 from tests import questions
 import pandas as pd
@@ -9,7 +14,7 @@ from dotenv import load_dotenv
 
 def measure_response_time(question, model, api_key="", sql_temperature=0.1, final_temperature=0.5, prompt_template=None, num_ctx=2048, num_predict=256, prompt_name =None):
     start = time.time()
-    sql, sql_result, answer, corrected_question, has_error = answer_question(question, model, api_key, prompt_template=prompt_template, temperature=sql_temperature, num_ctx=num_ctx, num_predict=num_predict, answer_temperature=final_temperature)
+    sql, sql_result, answer, corrected_question, has_error = answer_question(question, model, api_key, prompt_template=prompt_template, temperature=sql_temperature, num_ctx=num_ctx, num_predict=num_predict, answer_temperature=final_temperature, answer_mode="llm")
     elapsed = time.time() - start
     return {
         "question": question,
@@ -27,32 +32,137 @@ def measure_response_time(question, model, api_key="", sql_temperature=0.1, fina
         "num_predict": num_predict
     }
 
-if __name__ == "__main__":
-    load_dotenv()
+SEQ2SEQ_MODELS = ["tscholak/1zha5ono", "juierror/text-to-sql-with-table-schema"]
+LLM_MODELS = ["phi3:mini", "llama3", "gpt-4o-mini", "mistral"]
 
-    results = []
 
+def grid_cells(api_key=""):
+    """
+    Yields every cell of the parameter sweep as keyword arguments for measure_response_time.
+    """
     for question in questions.questions:
-        result = measure_response_time(question, 'tscholak/1zha5ono', prompt_template=prompt_templates_other["tscholak/1zha5ono"], prompt_name="tscholak/1zha5ono")
-        results.append(result)
-        print(f"Model: tscholak/1zha5ono, Question: {question}, SQL: {result['sql_query']}, Response Time: {result['response_time']:.2f} seconds, prompt template: tscholak/1zha5ono")
+        for model in SEQ2SEQ_MODELS:
+            yield {"question": question, "model": model, "prompt_template": prompt_templates_other[model], "prompt_name": model}
 
-        result = measure_response_time(question, 'juierror/text-to-sql-with-table-schema', prompt_template=prompt_templates_other["juierror/text-to-sql-with-table-schema"], prompt_name="juierror/text-to-sql-with-table-schema")
-        results.append(result)
-        print(f"Model: juierror/text-to-sql-with-table-schema, Question: {question}, SQL: {result['sql_query']}, Response Time: {result['response_time']:.2f} seconds, prompt template: juierror/text-to-sql-with-table-schema")
-
-    for model in ["phi3:mini", "llama3", "gpt-4o-mini", "mistral"]:
+    for model in LLM_MODELS:
         for sql_temperature in [0.1, 0.3, 0.0]:
             for final_temperature in [0.7, 0.5, 1.0]:
                 for name, prompt in prompt_templates_llms.items():
                     for num_ctx in [2048]:
                         for num_predict in [128, 64]:
                             for question in questions.questions:
-                                result = measure_response_time(question, model, api_key=os.getenv("OPEN_API_KEY", ""), sql_temperature=sql_temperature, final_temperature=final_temperature, prompt_template=prompt, num_ctx=num_ctx, num_predict=num_predict, prompt_name=name)
-                                results.append(result)
-                                print(f"Model: {model}, Question: {question}, SQL: {result['sql_query']}, Response Time: {result['response_time']:.2f} seconds, sql temperature: {sql_temperature}, final temperature: {final_temperature}, prompt template: {name}, num_ctx: {num_ctx}, num_predict: {num_predict}")
+                                yield {"question": question, "model": model, "api_key": api_key,
+                                       "sql_temperature": sql_temperature, "final_temperature": final_temperature,
+                                       "prompt_template": prompt, "prompt_name": name,
+                                       "num_ctx": num_ctx, "num_predict": num_predict}
+
+
+def cell_key(cell):
+    """
+    Identifies a grid cell; works for both a cell and the result row it produced.
+    """
+    # Result rows store the prompt name under "prompt_template"
+    prompt_name = cell["prompt_name"] if "prompt_name" in cell else cell.get("prompt_template")
+    return json.dumps([
+        cell["question"], cell["model"], prompt_name,
+        cell.get("sql_temperature", 0.1), cell.get("final_temperature", 0.5),
+        cell.get("num_ctx", 2048), cell.get("num_predict", 256),
+    ])
+
+
+def backend(model):
+    if model in SEQ2SEQ_MODELS:
+        return "seq2seq"
+    if "gpt" in model.lower():
+        return "openai"
+    return "ollama"
+
+
+def load_results(path):
+    """
+    Reads the JSONL results file, dropping a partially written last line left by an interrupted run.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+            content = content[:content.rfind(b"\n") + 1]
+    results = []
+    for line in content.decode("utf-8").splitlines():
+        try:
+            results.append(json.loads(line))
+        except ValueError:
+            continue
+    return results
+
+
+def run_sweep(output_path, concurrency, api_key=""):
+    """
+    Runs the grid cells not yet in `output_path`, each backend on its own pool of `concurrency[backend]` threads,
+    appending every result (with the "concurrency" it ran at) to the JSONL file as soon as it completes.
+    Above 1, a local backend (Ollama, seq2seq) queues the requests, so response_time includes that wait.
+    """
+    completed = {cell_key(result) for result in load_results(output_path)}
+    pending = [cell for cell in grid_cells(api_key) if cell_key(cell) not in completed]
+    print(f"{len(completed)} cells already done, {len(pending)} to run")
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    write_lock = threading.Lock()
+    executors = {name: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"sweep-{name}")
+                 for name, workers in concurrency.items()}
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        def run(cell):
+            result = measure_response_time(**cell)
+            result["concurrency"] = concurrency[backend(cell["model"])]
+            with write_lock:
+                out.write(json.dumps(result, default=str) + "\n")
+                out.flush()
+            print(f"Model: {result['model']}, Question: {result['question']}, SQL: {result['sql_query']}, Response Time: {result['response_time']:.2f} seconds, sql temperature: {result['sql_temperature']}, final temperature: {result['final_temperature']}, prompt template: {result['prompt_template']}, num_ctx: {result['num_ctx']}, num_predict: {result['num_predict']}")
+
+        futures = [executors[backend(cell["model"])].submit(run, cell) for cell in pending]
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                # Not written, so the cell is retried on the next run
+                failed += 1
+                print(f"Cell failed: {e}")
+    for executor in executors.values():
+        executor.shutdown()
+    print(f"Sweep finished, {failed} cells failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweep over models, temperatures, prompts and num_predict")
+    parser.add_argument("--output", default="tests/output/model_test_results.jsonl")
+    parser.add_argument("--csv", default="tests/output/model_test_results.csv")
+    parser.add_argument("--ollama-concurrency", type=int, default=int(os.getenv("SWEEP_OLLAMA_CONCURRENCY", "1")))
+    parser.add_argument("--openai-concurrency", type=int, default=int(os.getenv("SWEEP_OPENAI_CONCURRENCY", "8")))
+    parser.add_argument("--seq2seq-concurrency", type=int, default=int(os.getenv("SWEEP_SEQ2SEQ_CONCURRENCY", "1")))
+    parser.add_argument("--fresh", action="store_true", help="Discard the results of previous runs")
+    args = parser.parse_args()
+
+    load_dotenv()
+    # Every grid cell must hit the model, otherwise response times are not comparable
+    sql_cache.maxsize = 0
+    sql_cache.clear()
+    # ...and must be answered by the model, not by the intent templates
+    intent_matcher.enabled = False
 
-    df = pd.DataFrame(results)
-    df.to_csv("tests/output/model_test_results.csv", index=False)
-    print("Saved to model_test_results.csv")
+    if args.fresh and os.path.exists(args.output):
+        os.remove(args.output)
+    run_sweep(args.output, {
+        "ollama": args.ollama_concurrency,
+        "openai": args.openai_concurrency,
+        "seq2seq": args.seq2seq_concurrency,
+    }, api_key=os.getenv("OPEN_API_KEY", ""))
 
+    df = pd.DataFrame(load_results(args.output))
+    df.to_csv(args.csv, index=False)
+    print(f"Saved {len(df)} results to {args.csv}")